@@ -0,0 +1,76 @@
+"""busqueda trigram y texto
+
+Revision ID: 0e245f312128
+Revises: 96da5b768a8b
+Create Date: 2025-10-18 10:12:41.215903
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0e245f312128'
+down_revision: Union[str, Sequence[str], None] = '96da5b768a8b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# columnas con búsqueda "contiene" (ILIKE '%x%') -> índice GIN de trigramas
+INDICES_TRIGRAMA = [
+    ("ix_postulant_name_trgm", "postulant", "name"),
+    ("ix_postulant_email_trgm", "postulant", "email"),
+    ("ix_postulant_dni_trgm", "postulant", "dni"),
+    ("ix_evaluacioncv_name_trgm", "evaluacioncv", "name"),
+    ("ix_chargeprocess_code_trgm", "chargeprocess", "code"),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute("CREATE EXTENSION IF NOT EXISTS unaccent")
+    # unaccent() no es IMMUTABLE (depende del search_path), así que no sirve en un índice:
+    # envoltorio inmutable con el diccionario fijo
+    op.execute("""
+        CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+        AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$
+    """)
+
+    # CONCURRENTLY no bloquea escrituras en postulant/evaluacioncv mientras se arma el índice,
+    # pero no puede correr dentro de una transacción. Si falla a medias Postgres deja el índice
+    # INVALID: se borra antes de reintentar para que IF NOT EXISTS no lo dé por creado.
+    with op.get_context().autocommit_block():
+        for nombre, tabla, columna in INDICES_TRIGRAMA:
+            _crear_concurrente(
+                nombre,
+                f"ON {tabla} USING gin (lower(f_unaccent({columna})) gin_trgm_ops)",
+            )
+
+        # full-text en español sobre nombre + skills + summary (ver busqueda.DOCUMENTO_EVALUACION)
+        _crear_concurrente("ix_evaluacioncv_documento_ts", """ON evaluacioncv USING gin (
+            to_tsvector('spanish', f_unaccent(coalesce(name, '') || ' ' ||
+            coalesce(skills, '') || ' ' || coalesce(summary, '')))
+        )""")
+
+
+def _crear_concurrente(nombre: str, definicion: str):
+    invalido = op.get_bind().execute(sa.text("""
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = :nombre AND NOT i.indisvalid
+    """), {"nombre": nombre}).first()
+    if invalido:
+        op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nombre}")
+    op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nombre} {definicion}")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_evaluacioncv_documento_ts")
+        for nombre, _, _ in INDICES_TRIGRAMA:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nombre}")
+    op.execute("DROP FUNCTION IF EXISTS f_unaccent(text)")
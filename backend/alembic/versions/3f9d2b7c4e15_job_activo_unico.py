@@ -0,0 +1,58 @@
+"""job activo unico por proceso y tipo
+
+Revision ID: 3f9d2b7c4e15
+Revises: 5d8a2f1c7e63
+Create Date: 2025-10-27 10:18:33.640215
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9d2b7c4e15'
+down_revision: Union[str, Sequence[str], None] = '5d8a2f1c7e63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# debe coincidir con ProcesamientoJob.__table_args__
+INDICE = "ux_procesamientojob_activo"
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # procesamientojob la crea create_all (con el índice): en una base nueva no hay nada que hacer
+    if op.get_bind().execute(sa.text("SELECT to_regclass('procesamientojob')")).scalar() is None:
+        return
+    # los duplicados que ya hayan entrado dejarían fallar el índice único: queda el más antiguo
+    op.execute("""
+        UPDATE procesamientojob SET estado = 'fallido', worker_id = NULL, fecha_fin = now(),
+               detalle = 'Duplicado de otro job activo del mismo proceso'
+        WHERE estado IN ('pendiente', 'en_proceso')
+          AND id NOT IN (
+              SELECT min(id) FROM procesamientojob
+              WHERE estado IN ('pendiente', 'en_proceso') GROUP BY process_id, tipo
+          )
+    """)
+    # igual que "indices compuestos evaluacioncv": CONCURRENTLY fuera de transacción y
+    # limpieza de un índice INVALID que haya dejado un intento anterior
+    with op.get_context().autocommit_block():
+        invalido = op.get_bind().execute(sa.text("""
+            SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = :nombre AND NOT i.indisvalid
+        """), {"nombre": INDICE}).first()
+        if invalido:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {INDICE}")
+        op.execute(
+            f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {INDICE} ON procesamientojob (process_id, tipo) "
+            "WHERE estado IN ('pendiente', 'en_proceso')"
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {INDICE}")
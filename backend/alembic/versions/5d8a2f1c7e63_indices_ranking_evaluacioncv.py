@@ -0,0 +1,55 @@
+"""indices ranking evaluacioncv
+
+Revision ID: 5d8a2f1c7e63
+Revises: 7b3e1c9d2f40
+Create Date: 2025-10-24 16:12:48.204517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d8a2f1c7e63'
+down_revision: Union[str, Sequence[str], None] = '7b3e1c9d2f40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (nombre, columnas) — deben coincidir con EvaluacionCV.__table_args__ y ranking.PUNTAJES
+INDICES = [
+    ("ix_evaluacioncv_ranking_match", "charge_process_id, match, id"),
+    ("ix_evaluacioncv_ranking_total", "charge_process_id, (coalesce(match_total, match)), id"),
+]
+# ix_evaluacioncv_ranking_match sirve también a "match >= 80" del proceso (mismo prefijo)
+INDICE_REEMPLAZADO = "ix_evaluacioncv_proceso_match80"
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # igual que "indices compuestos evaluacioncv": CONCURRENTLY fuera de transacción y
+    # limpieza de un índice INVALID que haya dejado un intento anterior
+    with op.get_context().autocommit_block():
+        for nombre, columnas in INDICES:
+            invalido = op.get_bind().execute(sa.text("""
+                SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = :nombre AND NOT i.indisvalid
+            """), {"nombre": nombre}).first()
+            if invalido:
+                op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nombre}")
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nombre} ON evaluacioncv ({columnas})")
+        op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {INDICE_REEMPLAZADO}")
+        op.execute("ANALYZE evaluacioncv")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDICE_REEMPLAZADO} ON evaluacioncv "
+            "(charge_process_id, match) WHERE match >= 80"
+        )
+        for nombre, _ in INDICES:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nombre}")
@@ -0,0 +1,60 @@
+"""indices compuestos evaluacioncv
+
+Revision ID: 7b3e1c9d2f40
+Revises: 0e245f312128
+Create Date: 2025-10-19 09:41:07.532118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7b3e1c9d2f40'
+down_revision: Union[str, Sequence[str], None] = '0e245f312128'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (nombre, columnas, WHERE del índice parcial) — deben coincidir con EvaluacionCV.__table_args__
+INDICES = [
+    ("ix_evaluacioncv_proceso_match80", "charge_process_id, match", "match >= 80"),
+    ("ix_evaluacioncv_dni_proceso", "dni_postulante, charge_process_id", None),
+    ("ix_evaluacioncv_fecha_id", "date_create, id", None),
+    ("ix_evaluacioncv_proceso_url", "charge_process_id, url_cv", None),
+]
+# queda cubierto por ix_evaluacioncv_proceso_url (mismo prefijo): solo encarecía los INSERT
+INDICE_REDUNDANTE = "ix_evaluacioncv_charge_process_id"
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY no bloquea escrituras en evaluacioncv, pero no puede correr dentro
+    # de una transacción. Si falla a medias Postgres deja el índice INVALID: se borra
+    # antes de reintentar para que IF NOT EXISTS no lo dé por creado.
+    with op.get_context().autocommit_block():
+        for nombre, columnas, where in INDICES:
+            invalido = op.get_bind().execute(sa.text("""
+                SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = :nombre AND NOT i.indisvalid
+            """), {"nombre": nombre}).first()
+            if invalido:
+                op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nombre}")
+            op.execute(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nombre} ON evaluacioncv ({columnas})"
+                + (f" WHERE {where}" if where else "")
+            )
+        op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {INDICE_REDUNDANTE}")
+        op.execute("ANALYZE evaluacioncv")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDICE_REDUNDANTE} ON evaluacioncv (charge_process_id)"
+        )
+        for nombre, _, _ in INDICES:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nombre}")
@@ -0,0 +1,34 @@
+"""sin token en procesamientojob
+
+Revision ID: 8c4e1a6d9b27
+Revises: 3f9d2b7c4e15
+Create Date: 2025-10-27 11:02:51.917340
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c4e1a6d9b27'
+down_revision: Union[str, Sequence[str], None] = '3f9d2b7c4e15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # el Authorization del usuario quedaba guardado en claro; ahora el worker firma un token
+    # corto por envío (auth.create_job_token) y la columna se borra con lo que tenía
+    if op.get_bind().execute(sa.text("SELECT to_regclass('procesamientojob')")).scalar() is None:
+        return
+    op.execute("ALTER TABLE procesamientojob DROP COLUMN IF EXISTS token")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().execute(sa.text("SELECT to_regclass('procesamientojob')")).scalar() is None:
+        return
+    op.execute("ALTER TABLE procesamientojob ADD COLUMN IF NOT EXISTS token VARCHAR")
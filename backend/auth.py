@@ -10,6 +10,7 @@ from sqlmodel import Session, select
 from models import User, RefreshTokenRequest
 from dotenv import load_dotenv
 from cargabd import engine, get_session
+import cache_usuarios
 import os
 from fastapi.security import OAuth2PasswordRequestForm
 load_dotenv()
@@ -20,6 +21,8 @@ sekey = str(os.getenv('SECRET_KEY'))
 alg = str(os.getenv('ALGORITHM'))
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 7
+# token que el worker manda a n8n en nombre de quien encoló el job: se firma en cada envío
+JOB_TOKEN_EXPIRE_MINUTES = int(os.getenv("JOB_TOKEN_EXPIRE_MINUTES", "60"))
 
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -37,6 +40,19 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, sekey, algorithm=alg)
 
+def create_job_token(username: Optional[str], job_id: int) -> Optional[str]:
+    """
+    "Bearer <jwt>" de corta duración para las llamadas a n8n de un job. No se guarda: así un
+    job reanudado horas después no reenvía el token (ya vencido) del usuario que lo encoló.
+    """
+    if not username:
+        return None
+    token = create_access_token(
+        {"sub": username, "scope": "job", "job_id": job_id},
+        timedelta(minutes=JOB_TOKEN_EXPIRE_MINUTES),
+    )
+    return f"Bearer {token}"
+
 def create_refresh_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
@@ -44,6 +60,10 @@ def create_refresh_token(data: dict):
     return jwt.encode(to_encode, sekey, algorithm=alg)
 
 def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+    return get_user_from_token(token)
+
+def get_user_from_token(token: str) -> User:
+    """Valida el JWT y devuelve el usuario (también para WebSocket/SSE, donde el token va en la URL)."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="No autorizado",
@@ -57,10 +77,14 @@ def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     except JWTError:
         raise credentials_exception
 
+    user = cache_usuarios.obtener(username)
+    if user is not None:
+        return user
     with Session(engine) as session:
         user = session.exec(select(User).where(User.username == username)).first()
         if user is None:
             raise credentials_exception
+        cache_usuarios.guardar(user)
         return user
 
 def require_admin(user: User = Depends(get_current_user)):
@@ -0,0 +1,158 @@
+# bench_extraccion.py
+# Throughput de la extracción local de texto de CVs (extraccion_cv.py): páginas/seg y MB/seg
+# en un solo proceso vs. el ProcessPoolExecutor, y cuántos datos de contacto detectan las regex
+# con el texto extraído vs. los bytes decodificados como latin-1 (lo de antes).
+#   python bench_extraccion.py --dir ./cvs_de_prueba --procesos 4
+#   python bench_extraccion.py --pdfs 60 --docx 20 --cache     (CVs sintéticos; --cache usa el Postgres local)
+# Sin --dir genera PDFs con streams comprimidos (FlateDecode, como los de Word/Canva) y DOCX.
+import io
+import time
+import zlib
+import asyncio
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import extraccion_cv
+from extraccion_cv import extraer_texto, detectar_formato
+from utilidades import extraer_datos, extraer_dni, extraer_email, extraer_telefono
+
+CAMPOS = ("dni", "email", "telefono")
+
+
+def lineas_cv(i: int, pagina: int) -> list:
+    lineas = [
+        f"Nombre completo: POSTULANTE NUMERO {i}",
+        f"DNI: {40000000 + i}",
+        f"Correo: postulante{i}@correo.pe",
+        f"Celular: 9{i:08d}",
+        f"Experiencia laboral (pagina {pagina + 1})",
+    ]
+    for j in range(35):
+        lineas.append(f"- Analista de datos en Empresa {j}: Python, SQL, Power BI, modelos de clasificacion.")
+    return lineas
+
+
+def pdf_sintetico(i: int, paginas: int) -> bytes:
+    """PDF mínimo con una fuente estándar y un stream FlateDecode por página."""
+    objetos = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for p in range(paginas):
+        lineas = lineas_cv(i, p) if p == 0 else lineas_cv(i, p)[4:]  # contacto solo en la primera
+        texto = "".join(f"({linea.replace('(', '[').replace(')', ']')}) Tj T* " for linea in lineas)
+        stream = zlib.compress(f"BT /F1 10 Tf 12 TL 50 790 Td {texto}ET".encode("latin-1"))
+        objetos.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        contenido_id = len(objetos)
+        objetos.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+            % contenido_id
+        )
+        kids.append(len(objetos))
+    objetos[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % k for k in kids), len(kids))
+
+    salida = io.BytesIO()
+    salida.write(b"%PDF-1.4\n")
+    posiciones = []
+    for n, obj in enumerate(objetos, start=1):
+        posiciones.append(salida.tell())
+        salida.write(b"%d 0 obj\n" % n + obj + b"\nendobj\n")
+    xref = salida.tell()
+    salida.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objetos) + 1))
+    for pos in posiciones:
+        salida.write(b"%010d 00000 n \n" % pos)
+    salida.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objetos) + 1, xref))
+    return salida.getvalue()
+
+
+def docx_sintetico(i: int) -> bytes:
+    from docx import Document
+
+    documento = Document()
+    documento.sections[0].header.paragraphs[0].text = f"DNI: {40000000 + i}  |  postulante{i}@correo.pe"
+    for linea in lineas_cv(i, 0):
+        if not linea.startswith(("DNI", "Correo")):
+            documento.add_paragraph(linea)
+    tabla = documento.add_table(rows=2, cols=2)
+    tabla.cell(0, 0).text, tabla.cell(0, 1).text = "Idioma", "Nivel"
+    tabla.cell(1, 0).text, tabla.cell(1, 1).text = "Inglés", "Avanzado"
+    salida = io.BytesIO()
+    documento.save(salida)
+    return salida.getvalue()
+
+
+def corpus(args) -> list:
+    if args.dir:
+        archivos = [p.read_bytes() for p in sorted(Path(args.dir).iterdir()) if p.suffix.lower() in (".pdf", ".docx")]
+        return [a for a in archivos if detectar_formato(a)]
+    return [pdf_sintetico(i, 1 + i % 4) for i in range(args.pdfs)] + [docx_sintetico(args.pdfs + i) for i in range(args.docx)]
+
+
+def reportar(etiqueta: str, resultados: list, total_bytes: int, segundos: float):
+    paginas = sum(r["paginas"] for r in resultados)
+    print(f"{etiqueta:<22} {segundos:7.2f} s   {paginas / segundos:8.1f} páginas/s   "
+          f"{total_bytes / 1e6 / segundos:6.2f} MB/s   {len(resultados) / segundos:7.1f} CVs/s")
+
+
+def detectados_latin1(contenido: bytes) -> dict:
+    texto = contenido.decode("latin-1", errors="ignore")
+    return {"dni": extraer_dni(texto), "email": extraer_email(texto), "telefono": extraer_telefono(texto)}
+
+
+async def medir_cache(archivos: list):
+    from sqlmodel import Session, delete
+    from cargabd import engine
+    from models import TextoCV
+
+    hashes = [extraccion_cv.hash_contenido(a) for a in archivos]
+    try:
+        for etiqueta in ("cache fría (pool+BD)", "cache caliente (BD)"):
+            t0 = time.perf_counter()
+            resultados = await asyncio.gather(*(extraccion_cv.texto_de_cv(a) for a in archivos))
+            segundos = time.perf_counter() - t0
+            con_texto = sum(1 for r in resultados if r)
+            print(f"{etiqueta:<22} {segundos:7.2f} s   {len(archivos) / segundos:8.1f} CVs/s   ({con_texto} con texto)")
+    finally:
+        extraccion_cv.cerrar_pool()
+        with Session(engine) as session:
+            session.exec(delete(TextoCV).where(TextoCV.contenido_hash.in_(hashes)))  # type: ignore
+            session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dir", help="carpeta con CVs reales (.pdf / .docx)")
+    parser.add_argument("--pdfs", type=int, default=60)
+    parser.add_argument("--docx", type=int, default=20)
+    parser.add_argument("--procesos", type=int, default=extraccion_cv.EXTRACCION_PROCESOS)
+    parser.add_argument("--cache", action="store_true", help="mide también texto_de_cv con la cache en BD")
+    args = parser.parse_args()
+
+    archivos = corpus(args)
+    total_bytes = sum(len(a) for a in archivos)
+    print(f"{len(archivos)} CVs, {total_bytes / 1e6:.2f} MB, pool de {args.procesos} procesos")
+
+    t0 = time.perf_counter()
+    resultados = [extraer_texto(a) for a in archivos]
+    reportar("1 proceso", resultados, total_bytes, time.perf_counter() - t0)
+
+    with ProcessPoolExecutor(max_workers=args.procesos) as pool:
+        list(pool.map(extraer_texto, archivos[: args.procesos]))  # arranque de los workers fuera de la medición
+        t0 = time.perf_counter()
+        resultados_pool = list(pool.map(extraer_texto, archivos, chunksize=4))
+        reportar(f"pool ({args.procesos})", resultados_pool, total_bytes, time.perf_counter() - t0)
+
+    sin_texto = sum(1 for r in resultados if len(r["texto"]) < extraccion_cv.EXTRACCION_MIN_CARACTERES)
+    print(f"sin capa de texto (van como archivo): {sin_texto}")
+
+    antes = [detectados_latin1(a) for a in archivos]
+    ahora = [extraer_datos(r["texto"]) for r in resultados]
+    for campo in CAMPOS:
+        n_antes = sum(1 for d in antes if d[campo])
+        n_ahora = sum(1 for d in ahora if d[campo])
+        print(f"{campo:<9} detectado: latin-1 {n_antes:>4}/{len(archivos)}   extraído {n_ahora:>4}/{len(archivos)}")
+
+    if args.cache:
+        asyncio.run(medir_cache(archivos))
+
+
+if __name__ == "__main__":
+    main()
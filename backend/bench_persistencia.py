@@ -0,0 +1,89 @@
+# bench_persistencia.py
+# Compara filas/seg al guardar resultados de n8n: una transacción por CV (antes)
+# vs. lotes con group commit (guardar_lote + MapaPostulantes). Usar contra un Postgres local:
+#   python bench_persistencia.py --proceso 12 --filas 2000 --lote 25
+# Las filas de prueba se marcan con url "bench://" / dni "bench-" y se borran al final.
+import os
+import time
+import uuid
+import argparse
+from sqlmodel import Session, select, delete
+from cargabd import engine
+from models import ChargeProcess, EvaluacionCV, Postulant
+from procesos import guardar_resultado, guardar_lote, MapaPostulantes
+import estadisticas
+
+
+def resultado_falso(i: int, corrida: str) -> dict:
+    return {
+        "url_cv": f"bench://{corrida}/{i}",
+        "nombre_archivo": f"cv_{i}.pdf",
+        "cv_procesado": True,
+        "cv_estado": "leído",
+        "name": f"Postulante {i}",
+        "dni": f"bench-{corrida}-{i}",
+        "email": f"p{i}@bench.local",
+        "years_exper": i % 12,
+        "level_educa": "Titulado",
+        "certif": ["Scrum"],
+        "languages": ["Español", "Inglés"],
+        "evaluacion": {"match": i % 101, "reason": "bench", "skills": ["python", "sql"], "summary": "bench"},
+    }
+
+
+def por_fila(process, resultados) -> float:
+    t0 = time.perf_counter()
+    with Session(engine) as session:
+        for r in resultados:
+            guardar_resultado(session, r, process)
+            session.commit()
+    return time.perf_counter() - t0
+
+
+def por_lotes(process, resultados, tamano: int) -> float:
+    t0 = time.perf_counter()
+    with Session(engine, expire_on_commit=False) as session:
+        mapa = MapaPostulantes()
+        mapa.precargar(session, [r["url_cv"] for r in resultados], [])
+        for i in range(0, len(resultados), tamano):
+            guardar_lote(session, resultados[i:i + tamano], process, mapa)
+            session.commit()
+    return time.perf_counter() - t0
+
+
+def limpiar():
+    with Session(engine) as session:
+        borradas = session.exec(  # type: ignore
+            delete(EvaluacionCV).where(EvaluacionCV.url_cv.like("bench://%"))  # type: ignore
+            .returning(EvaluacionCV.charge_process_id)
+        ).all()
+        # el DELETE en bloque no pasa por el listener de estadisticas.py: rollup desde cero
+        for process_id in sorted({fila[0] for fila in borradas if fila[0] is not None}):
+            estadisticas.recalcular(session, process_id)
+        session.exec(delete(Postulant).where(Postulant.dni.like("bench-%")))  # type: ignore
+        session.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de persistencia de resultados de n8n")
+    parser.add_argument("--proceso", type=int, required=True, help="id de un ChargeProcess existente")
+    parser.add_argument("--filas", type=int, default=1000)
+    parser.add_argument("--lote", type=int, default=int(os.getenv("PERSISTENCIA_LOTE_TAMANO", "25")))
+    args = parser.parse_args()
+
+    engine.echo = False
+    with Session(engine) as session:
+        process = session.get(ChargeProcess, args.proceso)
+        if not process:
+            raise SystemExit(f"Proceso {args.proceso} no encontrado")
+
+    try:
+        corrida = uuid.uuid4().hex[:8]
+        antes = por_fila(process, [resultado_falso(i, f"{corrida}a") for i in range(args.filas)])
+        despues = por_lotes(process, [resultado_falso(i, f"{corrida}b") for i in range(args.filas)], args.lote)
+    finally:
+        limpiar()
+
+    print(f"Filas: {args.filas}")
+    print(f"Antes  (commit por CV):      {args.filas / antes:8.1f} filas/seg ({antes:.2f}s)")
+    print(f"Después (lotes de {args.lote:>3}):     {args.filas / despues:8.1f} filas/seg ({despues:.2f}s)")
@@ -0,0 +1,72 @@
+# busqueda.py
+# Búsqueda de texto para postulantes e historial. En Postgres usa los índices GIN de la
+# migración "busqueda trigram y texto": trigramas sobre lower(f_unaccent(col)) para
+# "contiene" sin distinguir tildes, y un tsvector en español sobre nombre + skills + summary
+# con ranking. Fuera de Postgres (desarrollo) cae a ILIKE.
+import unicodedata
+from sqlalchemy import func, literal_column, or_, desc
+from cargabd import engine
+from models import EvaluacionCV
+
+CONFIG_TS = "spanish"
+
+# debe coincidir con la expresión del índice ix_evaluacioncv_documento_ts
+DOCUMENTO_EVALUACION = literal_column(
+    "to_tsvector('spanish', f_unaccent(coalesce(evaluacioncv.name, '') || ' ' || "
+    "coalesce(evaluacioncv.skills, '') || ' ' || coalesce(evaluacioncv.summary, '')))"
+)
+
+
+def es_postgres() -> bool:
+    return engine.dialect.name == "postgresql"
+
+
+def normalizar(termino: str) -> str:
+    """minúsculas y sin tildes ("Núñez" -> "nunez"), igual que lower(f_unaccent(...)) en la BD."""
+    sin_tildes = "".join(
+        c for c in unicodedata.normalize("NFKD", termino) if not unicodedata.combining(c)
+    )
+    return sin_tildes.lower().strip()
+
+
+def _patron_contiene(termino: str) -> str:
+    escapado = termino.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escapado}%"
+
+
+def _columna_normalizada(columna):
+    return func.lower(func.f_unaccent(columna))
+
+
+def filtro_contiene(columnas: list, termino: str):
+    """Condición "alguna columna contiene el término", sin distinguir mayúsculas ni tildes."""
+    if not es_postgres():
+        return or_(*[c.ilike(f"%{termino}%") for c in columnas])
+    patron = _patron_contiene(normalizar(termino))
+    return or_(*[_columna_normalizada(c).like(patron) for c in columnas])
+
+
+def orden_similitud(columna, termino: str):
+    """ORDER BY por parecido (pg_trgm) con el término; None si no aplica."""
+    if not es_postgres():
+        return None
+    return desc(func.similarity(_columna_normalizada(columna), normalizar(termino)))
+
+
+def consulta_texto(termino: str):
+    """tsquery en español a partir de lo que escribe el usuario ("python -java", "data science")."""
+    return func.websearch_to_tsquery(literal_column(f"'{CONFIG_TS}'"), func.f_unaccent(termino))
+
+
+def filtro_texto_evaluacion(termino: str):
+    """Full-text sobre nombre + skills + summary de EvaluacionCV."""
+    if not es_postgres():
+        return filtro_contiene([EvaluacionCV.name, EvaluacionCV.skills, EvaluacionCV.summary], termino)
+    return DOCUMENTO_EVALUACION.op("@@")(consulta_texto(termino))
+
+
+def orden_relevancia_evaluacion(termino: str):
+    """ORDER BY por ranking del full-text; None si no aplica."""
+    if not es_postgres():
+        return None
+    return desc(func.ts_rank_cd(DOCUMENTO_EVALUACION, consulta_texto(termino)))
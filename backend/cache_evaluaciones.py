@@ -0,0 +1,138 @@
+# cache_evaluaciones.py
+# Cache de resultados de n8n por contenido: el mismo PDF copiado en otra carpeta o
+# resubido con otro nombre (mismo md5) no vuelve a pasar por el LLM si el contexto
+# (puesto + reque + functions) y la versión del flujo son los mismos.
+import os
+import hashlib
+from datetime import timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import text, delete, update, case
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, select
+from dotenv import load_dotenv
+from models import CacheEvaluacion, peru_time
+from cargabd import engine
+from metricas import incrementar
+
+load_dotenv()
+
+# subir N8N_FLOW_VERSION al cambiar el prompt/flujo de n8n invalida todo lo cacheado
+FLOW_VERSION = os.getenv("N8N_FLOW_VERSION", "1")
+CACHE_EVAL_MAX_FILAS = int(os.getenv("CACHE_EVAL_MAX_FILAS", "50000"))
+CACHE_EVAL_MAX_DIAS = int(os.getenv("CACHE_EVAL_MAX_DIAS", "90"))
+
+# campos propios de cada archivo: se toman del archivo actual, no del cacheado
+CAMPOS_ARCHIVO = ("url_cv", "nombre_archivo", "drive_file_id")
+# marca en el payload de los resultados servidos desde la cache (o copiados de otro archivo
+# igual en la corrida): no se vuelven a guardar, así no se renueva su antigüedad
+DESDE_CACHE = "desde_cache"
+
+
+def _sha256(*partes) -> str:
+    h = hashlib.sha256()
+    for parte in partes:
+        h.update(str(parte or "").encode("utf-8"))
+        h.update(b"\x1f")
+    return h.hexdigest()
+
+
+def hash_contexto(puesto_id, reque: Optional[str], functions: Optional[str]) -> str:
+    return _sha256(puesto_id, (reque or "").strip(), (functions or "").strip())
+
+
+def clave_cache(contenido_hash: Optional[str], contexto_hash: str) -> Optional[str]:
+    if not contenido_hash:
+        # p.ej. documentos nativos de Google: Drive no da md5
+        return None
+    return _sha256(contenido_hash, contexto_hash, FLOW_VERSION)
+
+
+def buscar(session: Session, claves: List[str]) -> Dict[str, dict]:
+    """Resultados cacheados vigentes para las claves dadas (marca su uso). No hace commit."""
+    claves = list({c for c in claves if c})
+    if not claves:
+        return {}
+    limite = peru_time() - timedelta(days=CACHE_EVAL_MAX_DIAS)
+    filas = session.exec(
+        select(CacheEvaluacion.clave, CacheEvaluacion.resultado).where(
+            CacheEvaluacion.clave.in_(claves),  # type: ignore
+            CacheEvaluacion.fecha_creacion >= limite,
+        )
+    ).all()
+    encontrados = {clave: resultado for clave, resultado in filas}
+    if encontrados:
+        session.exec(  # type: ignore
+            update(CacheEvaluacion)
+            .where(CacheEvaluacion.clave.in_(list(encontrados)))  # type: ignore
+            .values(hits=CacheEvaluacion.hits + 1, ultimo_uso=peru_time())
+        )
+    incrementar("cache_eval_hits", len(encontrados))
+    incrementar("cache_eval_misses", len(claves) - len(encontrados))
+    return encontrados
+
+
+def resultado_para_archivo(cacheado: dict, payload: dict) -> dict:
+    """Copia del resultado cacheado con los datos del archivo actual."""
+    resultado = dict(cacheado)
+    for campo in CAMPOS_ARCHIVO:
+        if campo in payload:
+            resultado[campo] = payload[campo]
+    return resultado
+
+
+def guardar(session: Session, entradas: List[tuple]):
+    """
+    Guarda (clave, contenido_hash, contexto_hash, resultado) evaluados por n8n, en la
+    transacción del caller. Si la clave ya existe y sigue vigente solo se marca su uso (p.ej.
+    dos jobs que evaluaron el mismo CV a la vez); si ya venció, el resultado nuevo la reemplaza
+    y su antigüedad vuelve a contar desde ahora.
+    """
+    filas = {}
+    for clave, contenido_hash, contexto_hash, resultado in entradas:
+        if clave and resultado:
+            ahora = peru_time()
+            filas[clave] = {
+                "clave": clave,
+                "contenido_hash": contenido_hash,
+                "contexto_hash": contexto_hash,
+                "flow_version": FLOW_VERSION,
+                "resultado": {k: v for k, v in resultado.items() if k not in CAMPOS_ARCHIVO},
+                "hits": 0,
+                "fecha_creacion": ahora,
+                "ultimo_uso": ahora,
+            }
+    if not filas:
+        return
+    tabla = CacheEvaluacion.__table__
+    vencida = tabla.c.fecha_creacion < peru_time() - timedelta(days=CACHE_EVAL_MAX_DIAS)
+    stmt = insert(CacheEvaluacion).values(list(filas.values()))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["clave"],
+        set_={
+            "resultado": case((vencida, stmt.excluded.resultado), else_=tabla.c.resultado),
+            "fecha_creacion": case((vencida, stmt.excluded.fecha_creacion), else_=tabla.c.fecha_creacion),
+            "ultimo_uso": stmt.excluded.ultimo_uso,
+        },
+    )
+    session.exec(stmt)  # type: ignore
+
+
+def purgar():
+    """Expulsa lo vencido (CACHE_EVAL_MAX_DIAS) y lo menos usado por encima de CACHE_EVAL_MAX_FILAS."""
+    with Session(engine) as session:
+        limite = peru_time() - timedelta(days=CACHE_EVAL_MAX_DIAS)
+        vencidos = session.exec(  # type: ignore
+            delete(CacheEvaluacion).where(CacheEvaluacion.fecha_creacion < limite)
+        ).rowcount
+        sobrantes = session.exec(  # type: ignore
+            text("""
+                DELETE FROM cacheevaluacion WHERE id IN (
+                    SELECT id FROM cacheevaluacion ORDER BY ultimo_uso DESC OFFSET :max_filas
+                )
+            """),
+            params={"max_filas": CACHE_EVAL_MAX_FILAS},
+        ).rowcount
+        session.commit()
+    if vencidos or sobrantes:
+        incrementar("cache_eval_expulsados", vencidos + sobrantes)
+        print(f"🧹 Cache de evaluaciones: {vencidos} vencidos y {sobrantes} por tamaño eliminados")
@@ -0,0 +1,91 @@
+# cache_usuarios.py
+# Cache en memoria de usuarios autenticados (por username) para get_current_user: con el
+# polling del frontend era la consulta más frecuente. LRU acotado + TTL corto; los cambios
+# de usuarios.py invalidan la entrada en este proceso y, por NOTIFY, en los demás
+# workers. El TTL cubre el caso de un NOTIFY perdido (p.ej. LISTEN reconectando).
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional
+from dotenv import load_dotenv
+from models import User
+from notificaciones import publicar, escucha
+from metricas import registrar_fuente
+
+load_dotenv()
+
+CANAL_USUARIOS = "usuarios_cambios"
+CACHE_USUARIOS_TTL_SEG = float(os.getenv("CACHE_USUARIOS_TTL_SEG", "30"))
+CACHE_USUARIOS_MAX = int(os.getenv("CACHE_USUARIOS_MAX", "1000"))
+
+_lock = threading.Lock()
+_entradas: "OrderedDict[str, tuple]" = OrderedDict()  # username -> (vence, columnas)
+_stats = {"hits": 0, "misses": 0, "invalidaciones": 0}
+
+
+def obtener(username: str) -> Optional[User]:
+    """Usuario cacheado y vigente, o None. Devuelve una instancia nueva en cada llamada."""
+    ahora = time.monotonic()
+    with _lock:
+        entrada = _entradas.get(username)
+        if entrada is None or entrada[0] < ahora:
+            if entrada is not None:
+                del _entradas[username]
+            _stats["misses"] += 1
+            return None
+        _entradas.move_to_end(username)
+        _stats["hits"] += 1
+        columnas = entrada[1]
+    # copia por request: los handlers pueden modificar o adjuntar el User a su sesión
+    return User(**columnas)
+
+
+def guardar(user: User):
+    columnas = user.model_dump()
+    with _lock:
+        _entradas[user.username] = (time.monotonic() + CACHE_USUARIOS_TTL_SEG, columnas)
+        _entradas.move_to_end(user.username)
+        while len(_entradas) > CACHE_USUARIOS_MAX:
+            _entradas.popitem(last=False)
+
+
+def _invalidar_local(username: Optional[str] = None):
+    with _lock:
+        if username is None:
+            _entradas.clear()
+        else:
+            _entradas.pop(username, None)
+        _stats["invalidaciones"] += 1
+
+
+def invalidar_usuario(*usernames: str):
+    """Olvida los usuarios en este proceso y avisa a los demás (llamar después del commit)."""
+    for username in usernames:
+        _invalidar_local(username)
+        try:
+            publicar(CANAL_USUARIOS, {"username": username})
+        except Exception as e:
+            # el TTL acota cuánto puede durar el dato viejo en otros workers
+            print(f"⚠️ No se pudo propagar la invalidación del usuario {username}:", e)
+
+
+def _recibir(mensaje: dict):
+    _invalidar_local(mensaje.get("username"))
+
+
+def _estadisticas() -> dict:
+    with _lock:
+        consultas = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "entradas": len(_entradas),
+            "hit_ratio": round(_stats["hits"] / consultas, 4) if consultas else None,
+            "ttl_seg": CACHE_USUARIOS_TTL_SEG,
+            "max": CACHE_USUARIOS_MAX,
+        }
+
+
+escucha.suscribir(CANAL_USUARIOS, _recibir)
+
+registrar_fuente("cache_usuarios", _estadisticas)
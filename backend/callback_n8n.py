@@ -0,0 +1,164 @@
+# callback_n8n.py
+# Contrato asíncrono con n8n para evaluar CVs (N8N_MODO_CALLBACK=true). El worker envía cada CV
+# con un correlation_id y n8n responde al recibirlo (202). Cuando el LLM termina, n8n hace POST
+# del resultado a N8N_CALLBACK_URL (POST /procesos/n8n/callback), firmado con HMAC-SHA256 de
+# "<timestamp>.<cuerpo>" con N8N_CALLBACK_SECRET:
+#   X-N8N-Timestamp: 1730000000
+#   X-N8N-Firma: sha256=<hex>
+#   {"correlation_id": "...", "resultado": {...}}   o   {"correlation_id": "...", "error": "..."}
+# Así no queda una conexión abierta (hasta 300 s) por CV. Cada envío queda en solicitudn8n; las
+# que no reciben callback en N8N_CALLBACK_VENCE_SEGUNDOS las barre barrer_vencidas().
+import os
+import hmac
+import time
+import uuid
+import asyncio
+import hashlib
+from collections import defaultdict
+from datetime import timedelta
+from typing import Dict, List, Optional, Set
+from fastapi import HTTPException
+from sqlmodel import Session, select, update
+from models import SolicitudN8N, peru_time
+from cargabd import engine
+from clientes_n8n import cliente
+from cola_jobs import sumar_avance, job_propio, LeasePerdido
+from dotenv import load_dotenv
+
+load_dotenv()
+
+N8N_MODO_CALLBACK = os.getenv("N8N_MODO_CALLBACK", "false").lower() == "true"
+N8N_CALLBACK_URL = os.getenv("N8N_CALLBACK_URL")  # URL del backend tal como la ve n8n
+N8N_CALLBACK_SECRET = os.getenv("N8N_CALLBACK_SECRET")
+N8N_CALLBACK_VENCE_SEGUNDOS = int(os.getenv("N8N_CALLBACK_VENCE_SEGUNDOS", "900"))
+N8N_CALLBACK_TOLERANCIA_SEGUNDOS = int(os.getenv("N8N_CALLBACK_TOLERANCIA_SEGUNDOS", "300"))  # anti replay
+N8N_CALLBACK_EN_VUELO = int(os.getenv("N8N_CALLBACK_EN_VUELO", "50"))  # CVs esperando callback por job
+N8N_CALLBACK_POLL_SEGUNDOS = float(os.getenv("N8N_CALLBACK_POLL_SEGUNDOS", "2"))
+N8N_CALLBACK_BARRIDO_SEGUNDOS = float(os.getenv("N8N_CALLBACK_BARRIDO_SEGUNDOS", "60"))
+
+
+def firmar(cuerpo: bytes, timestamp: str, secreto: Optional[str] = None) -> str:
+    secreto = secreto or N8N_CALLBACK_SECRET or ""
+    return hmac.new(secreto.encode("utf-8"), timestamp.encode("ascii") + b"." + cuerpo, hashlib.sha256).hexdigest()
+
+
+def verificar_firma(cuerpo: bytes, timestamp: Optional[str], firma: Optional[str]):
+    """Lanza 401 si la firma no corresponde al cuerpo o el timestamp está fuera de tolerancia."""
+    if not N8N_CALLBACK_SECRET:
+        raise HTTPException(status_code=503, detail="Callback de n8n no configurado")
+    try:
+        antiguedad = abs(time.time() - int(timestamp or ""))
+    except ValueError:
+        raise HTTPException(status_code=401, detail="Timestamp inválido")
+    if antiguedad > N8N_CALLBACK_TOLERANCIA_SEGUNDOS:
+        raise HTTPException(status_code=401, detail="Firma vencida")
+    esperada = firmar(cuerpo, timestamp)
+    if not firma or not hmac.compare_digest(esperada, firma.removeprefix("sha256=")):
+        raise HTTPException(status_code=401, detail="Firma inválida")
+
+
+def registrar_solicitudes(job_id: int, process_id: int, payloads: List[dict],
+                          claves_cache: Optional[Dict[str, tuple]] = None,
+                          worker_id: Optional[str] = None) -> List[str]:
+    """
+    Crea las solicitudes antes de enviarlas (el callback puede llegar antes que el 202).
+    Devuelve los correlation_id en el orden de `payloads`. LeasePerdido si el job ya no es de
+    `worker_id`: el nuevo dueño es quien envía.
+    """
+    claves_cache = claves_cache or {}
+    ahora = peru_time()
+    solicitudes = []
+    for payload in payloads:
+        clave, contenido, contexto = claves_cache.get(payload.get("drive_file_id"), (None, None, None))
+        solicitudes.append(SolicitudN8N(
+            id=str(uuid.uuid4()),
+            job_id=job_id,
+            process_id=process_id,
+            drive_file_id=payload.get("drive_file_id"),
+            payload={k: v for k, v in payload.items() if k != "token"},
+            clave_cache=clave,
+            contenido_hash=contenido,
+            contexto_hash=contexto,
+            enviado_en=ahora,
+            vence_en=ahora + timedelta(seconds=N8N_CALLBACK_VENCE_SEGUNDOS),
+        ))
+    with Session(engine) as session:
+        if not job_propio(session, job_id, worker_id):
+            raise LeasePerdido(f"Job {job_id}: ya no es de {worker_id}")
+        session.add_all(solicitudes)
+        session.commit()
+        return [s.id for s in solicitudes]
+
+
+async def enviar(correlation_id: str, payload: dict) -> Optional[Exception]:
+    """Entrega el CV a n8n (solo espera el acuse). Devuelve la excepción si no se aceptó."""
+    try:
+        response = await cliente("encolar_cvs").post(
+            json={**payload, "correlation_id": correlation_id, "callback_url": N8N_CALLBACK_URL}
+        )
+        response.raise_for_status()
+        return None
+    except Exception as e:
+        return e
+
+
+def cancelar(correlation_ids: List[str]):
+    """Solicitudes que no se llegaron a enviar (circuit breaker abierto): el archivo sigue pendiente."""
+    with Session(engine) as session:
+        session.exec(  # type: ignore
+            update(SolicitudN8N)
+            .where(SolicitudN8N.id.in_(correlation_ids), SolicitudN8N.estado == "enviado")  # type: ignore
+            .values(estado="cancelado", respondido_en=peru_time())
+        )
+        session.commit()
+
+
+def en_vuelo(job_id: int) -> Set[str]:
+    """drive_file_id de las solicitudes del job que esperan callback."""
+    with Session(engine) as session:
+        return set(session.exec(
+            select(SolicitudN8N.drive_file_id).where(SolicitudN8N.job_id == job_id, SolicitudN8N.estado == "enviado")
+        ).all())
+
+
+def barrer_vencidas(limite: int = 500) -> int:
+    """
+    Marca como vencidas las solicitudes sin callback a tiempo y las cuenta como no procesadas
+    en su job (el archivo sigue pendiente en Drive y se reintenta al volver a procesar).
+    """
+    ahora = peru_time()
+    with Session(engine) as session:
+        vencidas = session.exec(
+            select(SolicitudN8N)
+            .where(SolicitudN8N.estado == "enviado", SolicitudN8N.vence_en < ahora)
+            .order_by(SolicitudN8N.vence_en)
+            .limit(limite)
+            .with_for_update(skip_locked=True)
+        ).all()
+        por_job = defaultdict(list)
+        for s in vencidas:
+            s.estado = "vencido"
+            s.error = f"n8n no respondió en {N8N_CALLBACK_VENCE_SEGUNDOS} s"
+            s.respondido_en = ahora
+            session.add(s)
+            por_job[s.job_id].append(s)
+        for job_id, solicitudes in sorted(por_job.items()):
+            sumar_avance(session, job_id, no_procesados=len(solicitudes), errores=[
+                {"nombre_archivo": s.payload.get("nombre_archivo"), "url_cv": s.payload.get("url_cv"),
+                 "cv_estado": "falló", "error": s.error}
+                for s in solicitudes
+            ])
+        session.commit()
+    if vencidas:
+        print(f"⌛ {len(vencidas)} solicitudes a n8n vencidas sin callback")
+    return len(vencidas)
+
+
+async def barrer_periodicamente():
+    """Tarea de fondo del worker: barre también las solicitudes de jobs que ya no corren."""
+    while True:
+        try:
+            await asyncio.to_thread(barrer_vencidas)
+        except Exception as e:
+            print("Error barriendo solicitudes a n8n:", e)
+        await asyncio.sleep(N8N_CALLBACK_BARRIDO_SEGUNDOS)
@@ -2,6 +2,12 @@ from sqlmodel import SQLModel, create_engine, Session
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.engine import make_url
+from sqlalchemy import event
+from datetime import datetime
+from zoneinfo import ZoneInfo
 from dotenv import load_dotenv
 import os
 
@@ -13,11 +19,74 @@ import os
 DATABASE_URL = str(os.getenv("DATABASE_URL"))
 
 # Crear el motor de base de datos
-engine = create_engine(DATABASE_URL, echo=True)
+# (con psycopg2, los UPDATE en lote del ORM van en páginas por round trip)
+engine_kwargs = {"executemany_mode": "values_plus_batch"} if DATABASE_URL.startswith("postgresql") else {}
+engine = create_engine(DATABASE_URL, echo=True, **engine_kwargs)
+
+# Motor async (asyncpg) para los endpoints async def: con el motor sync cada consulta
+# bloqueaba el event loop del worker de uvicorn. El sync queda para rutas def, el worker
+# y Alembic. Solo Postgres: sin DATABASE_URL de Postgres async_engine es None.
+ASYNC_POOL_SIZE = int(os.getenv("ASYNC_POOL_SIZE", "10"))
+ASYNC_MAX_OVERFLOW = int(os.getenv("ASYNC_MAX_OVERFLOW", "10"))
+
+def url_async(url: str) -> str:
+    """postgresql[+psycopg2]://... -> postgresql+asyncpg://... (sslmode -> ssl para asyncpg)."""
+    u = make_url(url).set(drivername="postgresql+asyncpg")
+    if "sslmode" in u.query:
+        query = dict(u.query)
+        query["ssl"] = query.pop("sslmode")
+        u = u.set(query=query)
+    return u.render_as_string(hide_password=False)
+
+async_engine = (
+    create_async_engine(
+        url_async(DATABASE_URL),
+        echo=True,
+        pool_size=ASYNC_POOL_SIZE,
+        max_overflow=ASYNC_MAX_OVERFLOW,
+        pool_pre_ping=True,
+    )
+    if DATABASE_URL.startswith("postgresql")
+    else None
+)
+
+
+async def _codec_timestamp(conn):
+    """
+    peru_time() da datetimes con zona y varias columnas son TIMESTAMP sin zona. psycopg2 los
+    manda como timestamptz y Postgres los pasa a la TimeZone de la sesión; asyncpg en cambio
+    los rechaza. Este codec hace la misma conversión para que ambos motores guarden igual.
+    """
+    zona = ZoneInfo(await conn.fetchval("SHOW TimeZone"))
+
+    def codificar(valor: datetime) -> str:
+        if valor.tzinfo is not None:
+            valor = valor.astimezone(zona).replace(tzinfo=None)
+        return valor.isoformat(sep=" ")
+
+    await conn.set_type_codec(
+        "timestamp", schema="pg_catalog", format="text",
+        encoder=codificar, decoder=datetime.fromisoformat,
+    )
+
+if async_engine is not None:
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def _al_conectar(dbapi_connection, connection_record):
+        dbapi_connection.run_async(_codec_timestamp)
+
+# expire_on_commit=False: en async no se puede recargar un atributo vencido de forma implícita
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
 
 # Crear sesión local
 def get_session():
     return Session(engine)
 
+# Sesión async (dependencia para endpoints async def)
+async def get_async_session():
+    if async_engine is None:
+        raise RuntimeError("La sesión async requiere DATABASE_URL de Postgres")
+    async with AsyncSessionLocal() as session:
+        yield session
+
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
\ No newline at end of file
@@ -0,0 +1,286 @@
+# clientes_n8n.py
+# Un httpx.AsyncClient por webhook de n8n, compartido durante toda la vida del proceso
+# (API o worker): keep-alive, HTTP/2 opcional, límite de conexiones y timeout por destino.
+# Se crean en el startup (iniciar_clientes) y se cierran en el shutdown (cerrar_clientes).
+import os
+import time
+import random
+import asyncio
+from typing import Dict, Optional
+import httpx
+from dotenv import load_dotenv
+from metricas import incrementar, observar, registrar_fuente
+
+load_dotenv()
+
+N8N_HTTP2 = os.getenv("N8N_HTTP2", "false").lower() == "true"  # requiere el paquete h2
+N8N_KEEPALIVE_SEGUNDOS = float(os.getenv("N8N_KEEPALIVE_SEGUNDOS", "60"))
+N8N_CONNECT_TIMEOUT = float(os.getenv("N8N_CONNECT_TIMEOUT", "10"))
+
+# Reintentos: backoff exponencial con jitter completo, acotado
+N8N_REINTENTOS = int(os.getenv("N8N_REINTENTOS", "3"))
+N8N_BACKOFF_BASE = float(os.getenv("N8N_BACKOFF_BASE", "1"))
+N8N_BACKOFF_MAX = float(os.getenv("N8N_BACKOFF_MAX", "30"))
+# Circuit breaker por destino: se abre tras N fallos seguidos y prueba de nuevo tras T seg
+N8N_BREAKER_FALLOS = int(os.getenv("N8N_BREAKER_FALLOS", "5"))
+N8N_BREAKER_ABIERTO_SEG = float(os.getenv("N8N_BREAKER_ABIERTO_SEG", "60"))
+
+# respuestas del proxy/gateway cuando n8n está caído o rechaza por saturación: el request no
+# llegó a ejecutar el flujo. Un 504 no entra: el proxy se cansó de esperar pero el flujo pudo
+# haber corrido (o seguir corriendo), así que repetirlo puede duplicar el trabajo.
+STATUS_REINTENTABLES = {502, 503}
+STATUS_GATEWAY_TIMEOUT = 504
+
+# destino -> (variable de entorno con la URL, timeout de lectura en seg, conexiones máximas,
+#             idempotente, reintenta_504)
+# Los timeouts son los que ya usaba cada llamada; se pueden sobreescribir con N8N_TIMEOUT_<DESTINO>.
+# Los errores de conexión siempre se reintentan (el request no salió); un 502/503 solo en destinos
+# idempotentes (repetirlos no duplica nada en Drive/BD) y un 504 solo donde correr el flujo dos
+# veces da lo mismo que una (buscar o crear la carpeta). encolar_cvs no: un 504 puede haber
+# encolado la corrida y repetirla manda dos callbacks; evaluar_cv/procesar_cvs pagarían el LLM dos veces.
+PERFILES = {
+    "evaluar_cv": ("N8N_WEBHOOK_URL", 5.0, 10, True, False),                # evaluacioncv.py (default de httpx)
+    "carpeta": ("N8N_CREATE_FOLDER_URL", 1800.0, 4, True, True),            # busca o crea la carpeta del proceso
+    "procesar_cvs": ("N8N_PROCESAR_CVS_URL2", 300.0, 8, True, False),       # un CV por llamada (jobs), = N8N_CVS_CONCURRENCIA_GLOBAL
+    "encolar_cvs": ("N8N_PROCESAR_CVS_CALLBACK_URL", 30.0, 8, True, False),  # modo callback: solo el acuse (callback_n8n.py)
+    "matchs": ("N8N_ACTUALIZR_MATCHS_URL", 600.0, 2, False, False),         # un lote de la finalización (finalizacion.py)
+    "formulario": ("N8N_FOLDER_URL", 120.0, 10, False, False),              # subida de CV del formulario
+}
+
+
+class CircuitoAbierto(httpx.TransportError):
+    """n8n viene fallando en este destino: se rechaza sin llamar (los except httpx.HTTPError lo cubren)."""
+
+    def __init__(self, destino: str, segundos: float):
+        super().__init__(f"n8n '{destino}' no disponible (circuit breaker abierto, reintento en {segundos:.0f}s)")
+        self.destino = destino
+        self.segundos = segundos
+
+
+class Breaker:
+    """
+    cerrado -> (N8N_BREAKER_FALLOS fallos seguidos) -> abierto -> (pasados N8N_BREAKER_ABIERTO_SEG)
+    -> semiabierto: deja pasar una sola llamada de prueba; si sale bien se cierra, si no se reabre.
+    Todo corre en el event loop, no necesita locks.
+    """
+
+    def __init__(self, destino: str):
+        self.destino = destino
+        self.estado = "cerrado"
+        self.fallos = 0
+        self.abierto_hasta = 0.0
+        self.sondeando = False
+
+    def segundos_restantes(self) -> float:
+        return max(self.abierto_hasta - time.monotonic(), 0.0)
+
+    def verificar(self) -> bool:
+        """
+        Lanza CircuitoAbierto si no se debe llamar ahora. Devuelve True si esta llamada es
+        la de prueba del semiabierto (quien la hace libera `sondeando` al terminar).
+        """
+        if self.estado == "cerrado":
+            return False
+        if self.estado == "abierto" and self.segundos_restantes() <= 0:
+            self.estado = "semiabierto"
+        if self.estado == "semiabierto" and not self.sondeando:
+            self.sondeando = True
+            return True
+        incrementar(f"n8n_breaker_rechazos.{self.destino}")
+        raise CircuitoAbierto(self.destino, self.segundos_restantes() or N8N_BREAKER_ABIERTO_SEG)
+
+    def exito(self):
+        self.estado = "cerrado"
+        self.fallos = 0
+
+    def fallo(self):
+        self.fallos += 1
+        if self.estado == "semiabierto" or self.fallos >= N8N_BREAKER_FALLOS:
+            if self.estado != "abierto":
+                incrementar(f"n8n_breaker_aperturas.{self.destino}")
+                print(f"⚠️ n8n '{self.destino}': circuit breaker abierto tras {self.fallos} fallos")
+            self.estado = "abierto"
+            self.abierto_hasta = time.monotonic() + N8N_BREAKER_ABIERTO_SEG
+
+
+def _rebobinar_archivos(files):
+    """Antes de reintentar, vuelve al inicio los archivos (file-like) que httpx ya pudo leer."""
+    if not files:
+        return
+    for valor in (files.values() if isinstance(files, dict) else (v for _, v in files)):
+        archivo = valor[1] if isinstance(valor, tuple) else valor
+        if hasattr(archivo, "seek"):
+            archivo.seek(0)
+
+
+class ClienteN8N:
+    """
+    Cliente de un webhook. Las conexiones se limitan con un semáforo propio (mismo tamaño
+    que el pool de httpx) para poder medir cuántas están en uso y cuánto se espera por una.
+    """
+
+    def __init__(
+        self, destino: str, url: Optional[str], timeout: float, max_conexiones: int, idempotente: bool,
+        reintenta_504: bool = False,
+    ):
+        self.destino = destino
+        self.url = url
+        self.max_conexiones = max_conexiones
+        self.idempotente = idempotente
+        self.status_reintentables = STATUS_REINTENTABLES | ({STATUS_GATEWAY_TIMEOUT} if reintenta_504 else set())
+        self.breaker = Breaker(destino)
+        self.reintentos = 0
+        self._semaforo = asyncio.Semaphore(max_conexiones)
+        self.en_uso = 0
+        self.esperando = 0
+        self.solicitudes = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+        self.client = httpx.AsyncClient(
+            http2=_http2_disponible(),
+            timeout=httpx.Timeout(timeout, connect=min(N8N_CONNECT_TIMEOUT, timeout)),
+            limits=httpx.Limits(
+                max_connections=max_conexiones,
+                max_keepalive_connections=max_conexiones,
+                keepalive_expiry=N8N_KEEPALIVE_SEGUNDOS,
+            ),
+        )
+
+    async def post(self, url: Optional[str] = None, **kwargs) -> httpx.Response:
+        """
+        POST al webhook (o a `url` si se indica). Acepta los mismos kwargs que httpx.
+        Reintenta errores de conexión (y 502/503 si el destino es idempotente; 504 solo si el perfil lo permite); con el
+        breaker abierto lanza CircuitoAbierto sin llamar.
+        """
+        sondeo = self.breaker.verificar()
+        try:
+            return await self._post_con_reintentos(url, **kwargs)
+        finally:
+            # solo la llamada de prueba libera el sondeo (también si se cancela); las que ya
+            # estaban en vuelo al abrirse el breaker no habilitan una segunda prueba
+            if sondeo:
+                self.breaker.sondeando = False
+
+    async def _post_con_reintentos(self, url: Optional[str], **kwargs) -> httpx.Response:
+        intento = 0
+        while True:
+            if intento:
+                _rebobinar_archivos(kwargs.get("files"))
+            try:
+                response = await self._enviar(url, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                if intento >= N8N_REINTENTOS:
+                    self.breaker.fallo()
+                    raise
+            except httpx.TransportError:
+                # timeout de lectura, conexión cortada...: puede que n8n sí lo haya recibido
+                self.breaker.fallo()
+                raise
+            else:
+                if response.status_code not in self.status_reintentables:
+                    if response.status_code == STATUS_GATEWAY_TIMEOUT:
+                        self.breaker.fallo()
+                    else:
+                        self.breaker.exito()
+                    return response
+                if not self.idempotente or intento >= N8N_REINTENTOS:
+                    self.breaker.fallo()
+                    return response
+
+            intento += 1
+            self.reintentos += 1
+            incrementar(f"n8n_reintentos.{self.destino}")
+            await asyncio.sleep(random.uniform(0, min(N8N_BACKOFF_MAX, N8N_BACKOFF_BASE * 2 ** (intento - 1))))
+            # si mientras tanto otras llamadas abrieron el breaker, no insistir
+            if self.breaker.estado == "abierto":
+                raise CircuitoAbierto(self.destino, self.breaker.segundos_restantes())
+
+    async def _enviar(self, url: Optional[str], **kwargs) -> httpx.Response:
+        inicio = time.perf_counter()
+        self.esperando += 1
+        try:
+            await self._semaforo.acquire()
+        finally:
+            self.esperando -= 1
+        espera = time.perf_counter() - inicio
+        self.solicitudes += 1
+        self.espera_total += espera
+        self.espera_max = max(self.espera_max, espera)
+        self.en_uso += 1
+        try:
+            inicio = time.perf_counter()
+            return await self.client.post(url or self.url, **kwargs)
+        finally:
+            observar(f"n8n.{self.destino}", time.perf_counter() - inicio)
+            self.en_uso -= 1
+            self._semaforo.release()
+
+    def estadisticas(self) -> dict:
+        return {
+            "en_uso": self.en_uso,
+            "esperando": self.esperando,
+            "inactivas": self._conexiones_inactivas(),
+            "max_conexiones": self.max_conexiones,
+            "solicitudes": self.solicitudes,
+            "espera_promedio_ms": round(self.espera_total / self.solicitudes * 1000, 2) if self.solicitudes else 0.0,
+            "espera_max_ms": round(self.espera_max * 1000, 2),
+            "reintentos": self.reintentos,
+            "breaker": self.breaker.estado,
+            "breaker_fallos_seguidos": self.breaker.fallos,
+            "breaker_reabre_en_seg": round(self.breaker.segundos_restantes(), 1),
+        }
+
+    def _conexiones_inactivas(self) -> Optional[int]:
+        # conexiones keep-alive abiertas y libres en el pool de httpcore
+        pool = getattr(getattr(self.client, "_transport", None), "_pool", None)
+        if pool is None:
+            return None
+        return sum(1 for c in pool.connections if c.is_idle())
+
+    async def cerrar(self):
+        await self.client.aclose()
+
+
+_clientes: Dict[str, ClienteN8N] = {}
+
+
+def _http2_disponible() -> bool:
+    if not N8N_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        print("⚠️ N8N_HTTP2=true pero falta el paquete h2; se usa HTTP/1.1")
+        return False
+
+
+def cliente(destino: str) -> ClienteN8N:
+    """Cliente compartido del destino (se crea al primer uso si no se llamó iniciar_clientes)."""
+    if destino not in _clientes:
+        variable, timeout, max_conexiones, idempotente, reintenta_504 = PERFILES[destino]
+        sufijo = destino.upper()
+        _clientes[destino] = ClienteN8N(
+            destino,
+            os.getenv(variable),
+            float(os.getenv(f"N8N_TIMEOUT_{sufijo}", timeout)),
+            int(os.getenv(f"N8N_CONEXIONES_{sufijo}", max_conexiones)),
+            idempotente,
+            reintenta_504,
+        )
+    return _clientes[destino]
+
+
+def iniciar_clientes():
+    for destino in PERFILES:
+        cliente(destino)
+
+
+async def cerrar_clientes():
+    clientes = list(_clientes.values())
+    _clientes.clear()
+    for c in clientes:
+        await c.cerrar()
+
+
+registrar_fuente("n8n_pools", lambda: {d: c.estadisticas() for d, c in _clientes.items()})
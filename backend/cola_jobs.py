@@ -0,0 +1,273 @@
+# cola_jobs.py
+# Cola de trabajos respaldada en Postgres (tabla procesamientojob).
+# El API solo encola; el worker (worker.py) reclama con FOR UPDATE SKIP LOCKED.
+import os
+from datetime import timedelta
+from typing import Optional, List, Tuple
+from sqlmodel import Session, select, or_, and_, desc, func, update
+from sqlalchemy import literal
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import JSONB
+from models import ProcesamientoJob, ChargeProcess, peru_time
+from cargabd import engine
+from dotenv import load_dotenv
+
+load_dotenv()
+
+JOB_LEASE_SEGUNDOS = int(os.getenv("JOB_LEASE_SEGUNDOS", "120"))  # sin heartbeat por este tiempo -> se puede re-reclamar
+JOB_MAX_INTENTOS = int(os.getenv("JOB_MAX_INTENTOS", "5"))
+JOB_REINTENTO_SEGUNDOS = int(os.getenv("JOB_REINTENTO_SEGUNDOS", "60"))
+
+ESTADOS_ACTIVOS = ("pendiente", "en_proceso")
+
+
+def encolar_job(session: Session, process_id: int, tipo: str = "procesar_cvs",
+                creado_por: Optional[str] = None) -> ProcesamientoJob:
+    """
+    Encola un job para el proceso. Si ya hay uno activo del mismo tipo lo devuelve
+    (un doble click en "procesar" no duplica el trabajo). Dos requests a la vez los
+    resuelve el índice único ux_procesamientojob_activo: el que pierde devuelve el del otro.
+    """
+    activo = job_activo(session, process_id, tipo)
+    if activo:
+        return activo
+
+    job = ProcesamientoJob(process_id=process_id, tipo=tipo, creado_por=creado_por)
+    try:
+        session.add(job)
+        session.flush()
+
+        if tipo == "procesar_cvs":
+            process = session.get(ChargeProcess, process_id)
+            if process:
+                process.is_processing = True
+                session.add(process)
+
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        activo = job_activo(session, process_id, tipo)
+        if activo is None:
+            raise
+        return activo
+    session.refresh(job)
+    return job
+
+
+def job_activo(session: Session, process_id: int, tipo: str) -> Optional[ProcesamientoJob]:
+    return session.exec(
+        select(ProcesamientoJob).where(
+            ProcesamientoJob.process_id == process_id,
+            ProcesamientoJob.tipo == tipo,
+            ProcesamientoJob.estado.in_(ESTADOS_ACTIVOS)  # type: ignore
+        )
+    ).first()
+
+
+def reclamar_job(worker_id: str, tipos: Optional[List[str]] = None) -> Optional[Tuple[int, str]]:
+    """
+    Reclama el siguiente job disponible: pendiente, o en_proceso con heartbeat vencido
+    (worker caído). Devuelve (id, tipo) del job o None si no hay trabajo.
+    """
+    ahora = peru_time()
+    limite = ahora - timedelta(seconds=JOB_LEASE_SEGUNDOS)
+
+    with Session(engine) as session:
+        stmt = (
+            select(ProcesamientoJob)
+            .where(
+                or_(
+                    ProcesamientoJob.estado == "pendiente",
+                    and_(ProcesamientoJob.estado == "en_proceso", ProcesamientoJob.heartbeat < limite),  # type: ignore
+                ),
+                or_(ProcesamientoJob.disponible_desde == None, ProcesamientoJob.disponible_desde <= ahora),  # type: ignore
+            )
+            .order_by(ProcesamientoJob.id)  # type: ignore
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        if tipos:
+            stmt = stmt.where(ProcesamientoJob.tipo.in_(tipos))  # type: ignore
+
+        job = session.exec(stmt).first()
+        if not job:
+            return None
+
+        if job.intentos >= JOB_MAX_INTENTOS:
+            # demasiados intentos: no se vuelve a tomar
+            _cerrar(session, job, "fallido", f"Se agotaron los {JOB_MAX_INTENTOS} intentos")
+            session.commit()
+            return None
+
+        job.estado = "en_proceso"
+        job.worker_id = worker_id
+        job.intentos += 1
+        job.heartbeat = ahora
+        job.fecha_inicio = job.fecha_inicio or ahora
+        job.reclamado_en = ahora
+        job.avance_al_reclamar = job.procesados + job.no_procesados
+        session.add(job)
+        session.commit()
+        return job.id, job.tipo
+
+
+class LeasePerdido(Exception):
+    """Otro worker reclamó el job (lease vencido): el que lo perdió no debe escribir nada más."""
+
+
+def job_propio(session: Session, job_id: int, worker_id: Optional[str]) -> Optional[ProcesamientoJob]:
+    """
+    El job bloqueado (FOR UPDATE) si `worker_id` sigue siendo su dueño; None si no.
+    Sin worker_id (llamadas fuera del worker) no se verifica el dueño.
+    """
+    job = session.get(ProcesamientoJob, job_id, with_for_update=True)
+    if not job or (worker_id is not None and job.worker_id != worker_id):
+        return None
+    return job
+
+
+def latido(job_id: int, worker_id: str) -> bool:
+    """Renueva el lease del job. Devuelve False si otro worker se lo quedó."""
+    with Session(engine) as session:
+        job = session.get(ProcesamientoJob, job_id)
+        if not job or job.worker_id != worker_id or job.estado != "en_proceso":
+            return False
+        job.heartbeat = peru_time()
+        session.add(job)
+        session.commit()
+        return True
+
+
+def reintentar_mas_tarde(job_id: int, detalle: str, worker_id: Optional[str] = None):
+    """Devuelve el job a la cola tras un error transitorio (o lo marca fallido si no quedan intentos)."""
+    with Session(engine) as session:
+        job = job_propio(session, job_id, worker_id)
+        if not job:
+            return
+        if job.intentos >= JOB_MAX_INTENTOS:
+            _cerrar(session, job, "fallido", detalle)
+        else:
+            job.estado = "pendiente"
+            job.worker_id = None
+            job.detalle = detalle
+            job.disponible_desde = peru_time() + timedelta(seconds=JOB_REINTENTO_SEGUNDOS * job.intentos)
+            session.add(job)
+        session.commit()
+
+
+class JobPausado(Exception):
+    """El ejecutor no puede seguir por ahora (p.ej. n8n caído): volver a la cola tras `segundos`."""
+
+    def __init__(self, detalle: str, segundos: float):
+        super().__init__(detalle)
+        self.segundos = segundos
+
+
+def pausar_job(job_id: int, detalle: str, segundos: float, worker_id: Optional[str] = None):
+    """Devuelve el job a la cola sin consumir un intento (la falla no fue del job)."""
+    with Session(engine) as session:
+        job = job_propio(session, job_id, worker_id)
+        if not job:
+            return
+        job.estado = "pendiente"
+        job.worker_id = None
+        job.detalle = detalle
+        job.intentos = max(job.intentos - 1, 0)
+        job.disponible_desde = peru_time() + timedelta(seconds=segundos)
+        session.add(job)
+        session.commit()
+
+
+def finalizar_job(job_id: int, estado: str = "completado", detalle: Optional[str] = None,
+                  worker_id: Optional[str] = None):
+    """Cierra el job. Con `worker_id`, LeasePerdido si ya no es de ese worker."""
+    with Session(engine) as session:
+        job = job_propio(session, job_id, worker_id)
+        if not job:
+            if worker_id is not None:
+                raise LeasePerdido(f"Job {job_id}: ya no es de {worker_id}")
+            return
+        _cerrar(session, job, estado, detalle)
+        session.commit()
+
+
+def _cerrar(session: Session, job: ProcesamientoJob, estado: str, detalle: Optional[str]):
+    job.estado = estado
+    job.detalle = detalle or job.detalle
+    job.fecha_fin = peru_time()
+    job.worker_id = None
+    session.add(job)
+
+    if job.tipo == "procesar_cvs":
+        process = session.get(ChargeProcess, job.process_id)
+        if process:
+            process.is_processing = False
+            session.add(process)
+
+
+def sumar_avance(session: Session, job_id: int, procesados: int = 0, no_procesados: int = 0,
+                 errores: Optional[List[dict]] = None, worker_id: Optional[str] = None) -> Optional[Tuple[int, int, int]]:
+    """
+    Suma avance al job con un UPDATE atómico (en la transacción del caller): en modo callback
+    varios requests actualizan el mismo job a la vez. Devuelve (procesados, no_procesados, total).
+    Con `worker_id` (checkpoints del worker) solo si sigue siendo el dueño: si no, LeasePerdido
+    y el caller hace rollback. Los callbacks y el barrido no pasan worker_id: la solicitud ya
+    quedó registrada y su resultado cuenta aunque el job cambie de worker.
+    El lease (heartbeat) solo lo renueva el dueño: un callback no mantiene vivo un worker caído.
+    """
+    valores = {
+        "procesados": ProcesamientoJob.procesados + procesados,
+        "no_procesados": ProcesamientoJob.no_procesados + no_procesados,
+    }
+    if errores:
+        valores["errores"] = func.coalesce(ProcesamientoJob.errores, literal([], JSONB)).op("||")(literal(errores, JSONB))
+    stmt = update(ProcesamientoJob).where(ProcesamientoJob.id == job_id)
+    if worker_id is not None:
+        stmt = stmt.where(ProcesamientoJob.worker_id == worker_id)
+        valores["heartbeat"] = peru_time()
+    avance = session.exec(  # type: ignore
+        stmt.values(**valores)
+        .returning(ProcesamientoJob.procesados, ProcesamientoJob.no_procesados, ProcesamientoJob.total)
+    ).first()
+    if avance is None and worker_id is not None:
+        raise LeasePerdido(f"Job {job_id}: ya no es de {worker_id}")
+    return avance
+
+
+def ultimo_job(session: Session, process_id: int, tipo: str = "procesar_cvs") -> Optional[ProcesamientoJob]:
+    return session.exec(
+        select(ProcesamientoJob)
+        .where(ProcesamientoJob.process_id == process_id, ProcesamientoJob.tipo == tipo)
+        .order_by(desc(ProcesamientoJob.id))
+    ).first()
+
+
+def job_a_dict(job: ProcesamientoJob) -> dict:
+    """Estado público del job, con ETA estimado a partir del ritmo del intento actual."""
+    hechos = job.procesados + job.no_procesados
+    restantes = max(job.total - hechos, 0)
+
+    eta_segundos = None
+    if job.estado == "en_proceso" and job.reclamado_en and restantes:
+        avance = hechos - job.avance_al_reclamar
+        transcurrido = (peru_time() - job.reclamado_en).total_seconds()
+        if avance > 0 and transcurrido > 0:
+            eta_segundos = round(transcurrido / avance * restantes)
+
+    return {
+        "job_id": job.id,
+        "tipo": job.tipo,
+        "process_id": job.process_id,
+        "estado": job.estado,
+        "total": job.total,
+        "procesados": job.procesados,
+        "no_procesados": job.no_procesados,
+        "pendientes": restantes,
+        "errores": job.errores or [],
+        "detalle": job.detalle,
+        "intentos": job.intentos,
+        "eta_segundos": eta_segundos,
+        "fecha_creacion": job.fecha_creacion,
+        "fecha_inicio": job.fecha_inicio,
+        "fecha_fin": job.fecha_fin,
+    }
@@ -0,0 +1,315 @@
+# construir_dataset.py
+# Arma el set de fine-tuning (train / validación) desde datasetentry, sobre
+# export_dataset_to_jsonl.row_to_example:
+#  - los job_requirements que n8n no pudo parsear ({"raw", "__parse_error"}) entran al prompt
+#    como su texto, no como el blob con el mensaje de error
+#  - descarta CVs casi idénticos evaluados contra los mismos requisitos (MinHash + LSH); se
+#    queda el de menor id
+#  - cuenta tokens por ejemplo y recorta el CV (o descarta el ejemplo) si pasa el presupuesto
+#  - reparte train / validación con un hash estable del CV: el mismo CV cae siempre en la
+#    misma partición y sus variantes no se filtran de una a otra
+# Memoria acotada: las filas llegan por cursor de servidor y el índice LSH vive en un SQLite
+# en disco, así que sirve para millones de filas. Uso:
+#   python construir_dataset.py --out ft.jsonl.gz --max-tokens 6000 --validacion 0.05
+import os
+import json
+import struct
+import sqlite3
+import hashlib
+import argparse
+import tempfile
+import unicodedata
+from export_dataset_to_jsonl import (
+    DSN, ITERSIZE, row_to_example, iterar_filas, abrir_salida, ruta_con_sufijo,
+)
+
+NUM_HASHES = 128
+# 16 bandas x 8 filas: pares con Jaccard >= ~0.7 comparten algún balde con alta probabilidad;
+# luego se confirma con la similitud estimada de las firmas completas
+BANDAS = 16
+FILAS_BANDA = NUM_HASHES // BANDAS
+SHINGLE = 5  # palabras por shingle
+UMBRAL_DUPLICADO = 0.85
+# tope de candidatos por balde (un balde gigante de texto genérico no debe volverse O(n))
+MAX_CANDIDATOS = 50
+MIN_TOKENS_CV = 200  # si para entrar habría que dejar el CV más corto que esto, se descarta
+ENCODING = "o200k_base"
+
+_BITS_VALOR = 64 - (NUM_HASHES - 1).bit_length()  # 57: deja lugar al desplazamiento de densificación
+_MASCARA = (1 << 64) - 1
+MAX_CACHE_PALABRAS = 500_000
+_ids_palabras = {}
+
+
+def normalizar(texto: str) -> str:
+    """
+    minúsculas, sin tildes y con espacios colapsados. Pasa a ASCII (lo que no tiene equivalente
+    se descarta): solo sirve para comparar CVs entre sí y es varias veces más rápido que
+    filtrar los caracteres combinantes uno a uno en textos de ~100 KB.
+    """
+    if not texto.isascii():
+        texto = unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode("ascii")
+    return " ".join(texto.lower().split())
+
+
+def firma_minhash(texto: str):
+    """
+    MinHash de una sola permutación (one permutation hashing): un hash por shingle repartido
+    en NUM_HASHES cubetas, O(shingles) en vez de O(shingles x NUM_HASHES). Las cubetas vacías
+    se rellenan con la siguiente no vacía más un desplazamiento (densificación por rotación)
+    para que las firmas sigan siendo comparables posición a posición. None si no hay texto.
+
+    Cada palabra pasa a un id estable de 64 bits (blake2b, cacheado) y el shingle se hashea
+    como tupla de ints con hash() de Python: en C (~5x más rápido que blake2b por shingle) y,
+    a diferencia del hash de str, igual en cada corrida, así que el resultado es reproducible.
+    """
+    palabras = texto.split()
+    if not palabras:
+        return None
+    ids = _ids(palabras)
+    if len(ids) <= SHINGLE:
+        hashes = {hash(tuple(ids))}
+    else:
+        hashes = set(map(hash, zip(*(ids[i:] for i in range(SHINGLE)))))
+
+    cubetas = [None] * NUM_HASHES
+    for h in hashes:
+        h &= _MASCARA
+        cubeta, valor = h % NUM_HASHES, h >> (64 - _BITS_VALOR)
+        if cubetas[cubeta] is None or valor < cubetas[cubeta]:
+            cubetas[cubeta] = valor
+
+    firma = list(cubetas)
+    for j in range(NUM_HASHES):
+        if firma[j] is None:
+            for t in range(1, NUM_HASHES):
+                origen = cubetas[(j + t) % NUM_HASHES]
+                if origen is not None:
+                    firma[j] = origen + (t << _BITS_VALOR)
+                    break
+    return firma
+
+
+def _ids(palabras):
+    if len(_ids_palabras) > MAX_CACHE_PALABRAS:
+        _ids_palabras.clear()
+    ids = list(map(_ids_palabras.get, palabras))
+    for i, valor in enumerate(ids):
+        if valor is None:
+            palabra = palabras[i]
+            valor = int.from_bytes(hashlib.blake2b(palabra.encode("utf8"), digest_size=8).digest(), "big")
+            ids[i] = _ids_palabras[palabra] = valor
+    return ids
+
+
+def similitud(a, b) -> float:
+    return sum(1 for x, y in zip(a, b) if x == y) / NUM_HASHES
+
+
+class IndiceLSH:
+    """Baldes LSH y firmas en un SQLite temporal (dir con --tmp): vive lo que dura la corrida."""
+
+    def __init__(self, directorio=None):
+        fd, self.ruta = tempfile.mkstemp(suffix=".lsh.sqlite", dir=directorio)
+        os.close(fd)
+        self.db = sqlite3.connect(self.ruta)
+        # el índice se descarta al terminar: sin journal ni fsync
+        self.db.execute("PRAGMA journal_mode=OFF")
+        self.db.execute("PRAGMA synchronous=OFF")
+        self.db.execute("PRAGMA cache_size=-65536")  # 64 MB
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS baldes (banda INTEGER, clave INTEGER, doc INTEGER,"
+            " PRIMARY KEY (banda, clave, doc)) WITHOUT ROWID"
+        )
+        self.db.execute("CREATE TABLE IF NOT EXISTS firmas (doc INTEGER PRIMARY KEY, firma BLOB)")
+        self._pendientes = 0
+
+    @staticmethod
+    def _claves(firma, contexto: str):
+        # hash() de Python entra en un INTEGER de SQLite (64 bits con signo); con el str del
+        # contexto varía entre corridas, pero solo decide qué se compara, no el resultado
+        for banda in range(BANDAS):
+            yield banda, hash((tuple(firma[banda * FILAS_BANDA:(banda + 1) * FILAS_BANDA]), contexto))
+
+    def duplicado_de(self, doc: int, firma, contexto: str):
+        """Id del documento ya indexado casi igual a este, o None (y entonces lo indexa)."""
+        claves = list(self._claves(firma, contexto))
+        candidatos = set()
+        for banda, clave in claves:
+            filas = self.db.execute(
+                "SELECT doc FROM baldes WHERE banda = ? AND clave = ? LIMIT ?", (banda, clave, MAX_CANDIDATOS)
+            )
+            candidatos.update(fila[0] for fila in filas)
+        for candidato in sorted(candidatos):
+            (blob,) = self.db.execute("SELECT firma FROM firmas WHERE doc = ?", (candidato,)).fetchone()
+            if similitud(firma, struct.unpack(f">{NUM_HASHES}Q", blob)) >= UMBRAL_DUPLICADO:
+                return candidato
+
+        self.db.executemany("INSERT OR IGNORE INTO baldes VALUES (?, ?, ?)", [(b, c, doc) for b, c in claves])
+        self.db.execute("INSERT OR REPLACE INTO firmas VALUES (?, ?)", (doc, struct.pack(f">{NUM_HASHES}Q", *firma)))
+        self._pendientes += 1
+        if self._pendientes >= 5000:
+            self.db.commit()
+            self._pendientes = 0
+        return None
+
+    def cerrar(self):
+        self.db.close()
+        os.remove(self.ruta)
+
+
+class ContadorTokens:
+    """tiktoken si está instalado; si no, estimación de ~4 caracteres por token."""
+
+    def __init__(self, encoding=ENCODING):
+        try:
+            import tiktoken
+            self._enc = tiktoken.get_encoding(encoding)
+        except ImportError:
+            print("⚠️ Falta el paquete tiktoken; los tokens se estiman como caracteres / 4")
+            self._enc = None
+
+    @property
+    def estimado(self) -> bool:
+        return self._enc is None
+
+    def contar(self, texto: str) -> int:
+        if self._enc is None:
+            return (len(texto) + 3) // 4
+        return len(self._enc.encode(texto, disallowed_special=()))
+
+    def recortar(self, texto: str, tokens: int) -> str:
+        if self._enc is None:
+            return texto[:tokens * 4]
+        return self._enc.decode(self._enc.encode(texto, disallowed_special=())[:tokens])
+
+
+def limpiar_requisitos(jr):
+    """{"raw": texto, "__parse_error": ...} -> {"text": texto}; lo demás queda igual."""
+    if isinstance(jr, dict) and "__parse_error" in jr and isinstance(jr.get("raw"), str):
+        return {"text": jr["raw"]}
+    return jr
+
+
+def _texto_requisitos(jr) -> str:
+    if isinstance(jr, dict):
+        return jr.get("text") or json.dumps(jr, ensure_ascii=False, sort_keys=True)
+    return str(jr) if jr is not None else ""
+
+
+def particion(clave: str, semilla: str, validacion: float) -> str:
+    digest = hashlib.blake2b(f"{semilla}:{clave}".encode("utf8"), digest_size=8).digest()
+    return "val" if int.from_bytes(digest, "big") / 2 ** 64 < validacion else "train"
+
+
+def construir(dsn, out_file, max_tokens=8000, validacion=0.05, semilla="ft", modo="recortar",
+              limit=None, itersize=ITERSIZE, tmp=None, encoding=ENCODING, por_requisitos=True):
+    tokens = ContadorTokens(encoding)
+    lsh = IndiceLSH(tmp)
+    rutas = {"train": ruta_con_sufijo(out_file, "-train"), "val": ruta_con_sufijo(out_file, "-val")}
+    reporte = {
+        "filas": 0,
+        "tokens_originales": 0,
+        "requisitos_limpiados": {"ejemplos": 0, "tokens_ahorrados": 0},
+        "duplicados": {"ejemplos": 0, "tokens_ahorrados": 0},
+        "recortados": {"ejemplos": 0, "tokens_ahorrados": 0},
+        "omitidos_por_presupuesto": {"ejemplos": 0, "tokens_ahorrados": 0},
+        "train": {"ejemplos": 0, "tokens": 0},
+        "val": {"ejemplos": 0, "tokens": 0},
+    }
+
+    salidas = {nombre: abrir_salida(ruta) for nombre, ruta in rutas.items()}
+    try:
+        for row in iterar_filas(dsn, limit=limit, itersize=itersize):
+            reporte["filas"] += 1
+            ex = row_to_example(row)
+            completion_tokens = tokens.contar(ex["completion"])
+            originales = tokens.contar(ex["prompt"]) + completion_tokens
+            reporte["tokens_originales"] += originales
+
+            row = dict(row)
+            jr = limpiar_requisitos(row.get("job_requirements"))
+            if jr is not row.get("job_requirements"):
+                row["job_requirements"] = jr
+                ex = row_to_example(row)
+                limpios = tokens.contar(ex["prompt"]) + completion_tokens
+                reporte["requisitos_limpiados"]["ejemplos"] += 1
+                reporte["requisitos_limpiados"]["tokens_ahorrados"] += originales - limpios
+            else:
+                limpios = originales
+
+            # de aquí en adelante se descuenta desde `limpios`: lo ahorrado al limpiar requisitos
+            # ya quedó contado arriba y cada token ahorrado cae en una sola razón
+            cv_normalizado = normalizar(row.get("cv_text") or "")
+            firma = firma_minhash(cv_normalizado)
+            if firma is not None:
+                contexto = normalizar(_texto_requisitos(jr)) if por_requisitos else ""
+                if lsh.duplicado_de(row["id"], firma, contexto) is not None:
+                    reporte["duplicados"]["ejemplos"] += 1
+                    reporte["duplicados"]["tokens_ahorrados"] += limpios
+                    continue
+
+            total = limpios
+            if total > max_tokens:
+                cv_text = row.get("cv_text") or ""
+                restante = tokens.contar(cv_text)
+                # el corte puede cambiar la tokenización en el borde: se ajusta un par de veces
+                for _ in range(3):
+                    restante -= total - max_tokens
+                    if modo != "recortar" or restante < MIN_TOKENS_CV:
+                        break
+                    row["cv_text"] = tokens.recortar(cv_text, restante)
+                    ex = row_to_example(row)
+                    total = tokens.contar(ex["prompt"]) + completion_tokens
+                    if total <= max_tokens:
+                        break
+                if total > max_tokens:
+                    reporte["omitidos_por_presupuesto"]["ejemplos"] += 1
+                    reporte["omitidos_por_presupuesto"]["tokens_ahorrados"] += limpios
+                    continue
+                reporte["recortados"]["ejemplos"] += 1
+                reporte["recortados"]["tokens_ahorrados"] += limpios - total
+
+            clave = cv_normalizado or f"id:{row['id']}"
+            destino = particion(clave, semilla, validacion)
+            salidas[destino].write(json.dumps(ex, ensure_ascii=False) + "\n")
+            reporte[destino]["ejemplos"] += 1
+            reporte[destino]["tokens"] += total
+    finally:
+        for salida in salidas.values():
+            salida.close()
+        lsh.cerrar()
+
+    reporte["tokens_finales"] = reporte["train"]["tokens"] + reporte["val"]["tokens"]
+    reporte["tokens_ahorrados"] = reporte["tokens_originales"] - reporte["tokens_finales"]
+    reporte["tokens_estimados"] = tokens.estimado
+    ruta_reporte = ruta_con_sufijo(out_file, "-reporte")
+    for ext in (".gz", ".zst", ".jsonl"):
+        if ruta_reporte.endswith(ext):
+            ruta_reporte = ruta_reporte[:-len(ext)]
+    with open(ruta_reporte + ".json", "w", encoding="utf8") as f:
+        json.dump(reporte, f, ensure_ascii=False, indent=2)
+    print(json.dumps(reporte, ensure_ascii=False, indent=2))
+    return reporte
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Arma train/val deduplicado y con presupuesto de tokens")
+    parser.add_argument("--out", "-o", default="dataset_ft.jsonl", help="base de los archivos (-train / -val / -reporte)")
+    parser.add_argument("--dsn", default=DSN)
+    parser.add_argument("--limit", "-n", type=int, default=None)
+    # CVs de hasta ~100 KB: 500 filas por viaje mantienen el lote del cursor en decenas de MB
+    parser.add_argument("--itersize", type=int, default=500)
+    parser.add_argument("--max-tokens", type=int, default=8000, help="prompt + completion por ejemplo")
+    parser.add_argument("--modo", choices=("recortar", "omitir"), default="recortar",
+                        help="qué hacer con los ejemplos que pasan el presupuesto")
+    parser.add_argument("--validacion", type=float, default=0.05, help="fracción para validación")
+    parser.add_argument("--semilla", default="ft", help="cambia el reparto train/val de forma reproducible")
+    parser.add_argument("--encoding", default=ENCODING, help="encoding de tiktoken")
+    parser.add_argument("--tmp", default=None, help="directorio del índice LSH temporal (por defecto el del sistema)")
+    parser.add_argument("--global", dest="por_requisitos", action="store_false",
+                        help="deduplica CVs aunque se hayan evaluado contra requisitos distintos")
+    args = parser.parse_args()
+
+    construir(args.dsn, args.out, args.max_tokens, args.validacion, args.semilla, args.modo,
+              args.limit, args.itersize, args.tmp, args.encoding, args.por_requisitos)
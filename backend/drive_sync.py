@@ -0,0 +1,202 @@
+# drive_sync.py
+# Sincronización incremental de la carpeta de Drive de cada proceso.
+# La primera vez se lista la carpeta completa; después solo se leen los cambios
+# (changes.list desde el último page token) y se marcan como pendientes los
+# archivos nuevos o cuyo contenido cambió (md5Checksum / size). Al reevaluarlos,
+# guardar_lote actualiza la evaluación que ya tenía el CV en vez de agregar otra.
+# Costo: changes.list no filtra por carpeta, devuelve los cambios de toda la cuenta desde el
+# token de cada proceso. Con muchos procesos sobre la misma cuenta cada uno lee los mismos
+# cambios (una página de hasta 1000 por llamada, solo metadatos); de esos solo se consultan
+# y guardan los de la carpeta del proceso o los de archivos que ya conocía.
+from typing import List, Dict, Optional
+from sqlmodel import Session, select, update
+from googleapiclient.errors import HttpError
+from models import DriveSyncEstado, DriveArchivo, EvaluacionCV, peru_time
+from google_oauth import get_drive_service, ejecutar_drive
+from cargabd import engine
+
+CAMPOS_ARCHIVO = "id, name, parents, md5Checksum, size, modifiedTime, webViewLink, mimeType, trashed"
+MIME_CARPETA = "application/vnd.google-apps.folder"
+
+
+def listar_carpeta(service, folder_id: str) -> List[dict]:
+    """Listado completo de la carpeta (solo primera sincronización). Lanza HttpError si falla."""
+    archivos = []
+    page_token = None
+    while True:
+        results = ejecutar_drive(service.files().list(
+            q=f"'{folder_id}' in parents and mimeType!='{MIME_CARPETA}' and trashed=false",
+            fields=f"nextPageToken, files({CAMPOS_ARCHIVO})",
+            pageSize=1000,
+            pageToken=page_token,
+        ), "files.list")
+        archivos.extend(results.get("files", []))
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            return archivos
+
+
+def leer_cambios(service, page_token: str) -> tuple:
+    """
+    Cambios de Drive desde page_token (de toda la cuenta, ver costo arriba).
+    Devuelve (cambios, nuevo_page_token).
+    """
+    cambios = []
+    while True:
+        results = ejecutar_drive(service.changes().list(
+            pageToken=page_token,
+            spaces="drive",
+            includeRemoved=True,
+            pageSize=1000,
+            fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({CAMPOS_ARCHIVO}))",
+        ), "changes.list")
+        cambios.extend(results.get("changes", []))
+        if results.get("newStartPageToken"):
+            return cambios, results["newStartPageToken"]
+        page_token = results["nextPageToken"]
+
+
+def _size(valor) -> Optional[int]:
+    try:
+        return int(valor) if valor is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _aplicar_archivo(existente: Optional[DriveArchivo], f: dict, process_id: int) -> DriveArchivo:
+    """
+    Inserta o actualiza el archivo; queda pendiente si es nuevo o cambió su contenido.
+    Un archivo restaurado de la papelera con el mismo contenido no se vuelve a evaluar
+    (sigue pendiente solo si no se llegó a evaluar antes de borrarlo).
+    """
+    if existente is None:
+        existente = DriveArchivo(process_id=process_id, drive_file_id=f["id"], pendiente=True)
+    else:
+        cambio = (
+            existente.md5_checksum != f.get("md5Checksum")
+            or existente.size != _size(f.get("size"))
+        )
+        existente.pendiente = existente.pendiente or cambio
+    existente.nombre = f.get("name")
+    existente.web_view_link = f.get("webViewLink")
+    existente.md5_checksum = f.get("md5Checksum")
+    existente.size = _size(f.get("size"))
+    existente.modified_time = f.get("modifiedTime")
+    existente.eliminado = False
+    return existente
+
+
+def _sync_inicial(session: Session, service, process_id: int, folder_id: str) -> str:
+    # el token se pide ANTES de listar: lo que cambie durante el listado se verá la próxima vez
+    token = ejecutar_drive(service.changes().getStartPageToken(), "changes.getStartPageToken")["startPageToken"]
+    archivos = listar_carpeta(service, folder_id)
+
+    # una sola vez por proceso: lo que ya tiene evaluación (flujo anterior) no queda pendiente
+    ya = set(u for u in session.exec(
+        select(EvaluacionCV.url_cv).where(EvaluacionCV.charge_process_id == process_id)
+    ).all() if u)
+
+    existentes = {a.drive_file_id: a for a in session.exec(
+        select(DriveArchivo).where(DriveArchivo.process_id == process_id)
+    ).all()}
+    for f in archivos:
+        nuevo = f["id"] not in existentes
+        archivo = _aplicar_archivo(existentes.get(f["id"]), f, process_id)
+        if nuevo and f.get("webViewLink") in ya:
+            archivo.pendiente = False
+        session.add(archivo)
+    return token
+
+
+def _sync_incremental(session: Session, service, process_id: int, folder_id: str, page_token: str) -> str:
+    cambios, token = leer_cambios(service, page_token)
+    if not cambios:
+        return token
+
+    # los cambios son de toda la cuenta: solo interesan los de la carpeta y los de archivos
+    # que el proceso ya conocía (borrados, a la papelera o movidos fuera)
+    existentes = {}
+    ids = list({c["fileId"] for c in cambios})
+    for i in range(0, len(ids), 1000):
+        existentes.update({a.drive_file_id: a for a in session.exec(
+            select(DriveArchivo).where(
+                DriveArchivo.process_id == process_id,
+                DriveArchivo.drive_file_id.in_(ids[i:i + 1000]),  # type: ignore
+            )
+        ).all()})
+
+    for c in cambios:
+        f = c.get("file") or {}
+        en_carpeta = (
+            not c.get("removed")
+            and not f.get("trashed")
+            and folder_id in (f.get("parents") or [])
+            and f.get("mimeType") != MIME_CARPETA
+        )
+        existente = existentes.get(c["fileId"])
+        if en_carpeta:
+            existentes[c["fileId"]] = _aplicar_archivo(existente, f, process_id)
+            session.add(existentes[c["fileId"]])
+        elif existente is not None and not existente.eliminado:
+            # borrado, en papelera o movido fuera de la carpeta; pendiente se conserva
+            # (los eliminados no se listan) por si vuelve sin haberse evaluado
+            existente.eliminado = True
+            session.add(existente)
+    return token
+
+
+def sincronizar_carpeta(process_id: int, folder_id: str) -> List[Dict]:
+    """
+    Sincroniza la carpeta del proceso y devuelve los archivos pendientes de evaluar
+    (mismo formato que files.list: id, name, webViewLink, md5Checksum, size).
+    """
+    service = get_drive_service()
+    with Session(engine) as session:
+        estado = session.get(DriveSyncEstado, process_id)
+        token = None
+        if estado and estado.page_token and estado.folder_id == folder_id:
+            try:
+                token = _sync_incremental(session, service, process_id, folder_id, estado.page_token)
+            except HttpError as e:
+                # token inválido/vencido: volver a listar todo
+                print(f"⚠️ changes.list falló para proceso {process_id} ({e}); se hace sync completo")
+                session.rollback()
+        if token is None:
+            token = _sync_inicial(session, service, process_id, folder_id)
+
+        estado = estado or DriveSyncEstado(process_id=process_id)
+        estado.folder_id = folder_id
+        estado.page_token = token
+        estado.ultima_sync = peru_time()
+        session.add(estado)
+        session.commit()
+
+        pendientes = session.exec(
+            select(DriveArchivo).where(
+                DriveArchivo.process_id == process_id,
+                DriveArchivo.pendiente == True,
+                DriveArchivo.eliminado == False,
+            ).order_by(DriveArchivo.id)  # type: ignore
+        ).all()
+        return [
+            {
+                "id": a.drive_file_id,
+                "name": a.nombre,
+                "webViewLink": a.web_view_link,
+                "md5Checksum": a.md5_checksum,
+                "size": a.size,
+            }
+            for a in pendientes
+        ]
+
+
+def marcar_procesados(session: Session, process_id: int, drive_file_ids: List[str]):
+    """Quita de pendientes los archivos ya evaluados (en la transacción del caller)."""
+    ids = [i for i in drive_file_ids if i]
+    if not ids:
+        return
+    session.exec(  # type: ignore
+        update(DriveArchivo)
+        .where(DriveArchivo.process_id == process_id, DriveArchivo.drive_file_id.in_(ids))  # type: ignore
+        .values(pendiente=False)
+    )
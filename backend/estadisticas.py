@@ -0,0 +1,183 @@
+# estadisticas.py
+# Rollup de EvaluacionCV por proceso (tabla EstadisticaProceso) para /procesos/{id}/estadisticas,
+# en vez de traer todas las evaluaciones y calcular en el frontend.
+# Un listener after_flush de la Session convierte los INSERT / UPDATE / DELETE de EvaluacionCV
+# hechos por el ORM (guardar_resultado, guardar_lote, update_evaluacion_match...) en deltas y los
+# aplica con un upsert en la misma transacción: si hay rollback (o de un SAVEPOINT), el rollup
+# vuelve atrás con las filas. Los procesos anteriores al rollup se recalculan desde cero con
+# recalcular() la primera vez que se piden.
+# Las escrituras en bloque no pasan por el listener: session.exec(update(EvaluacionCV)...) /
+# delete(EvaluacionCV), text() o SQL fuera de la app. Quien las haga debe llamar a recalcular()
+# de cada proceso afectado en la misma transacción (ver bench_persistencia.limpiar).
+# Concurrencia: los deltas toman un advisory lock compartido por proceso y recalcular() el
+# exclusivo, ambos hasta el fin de la transacción. Los deltas entre sí no se esperan (los upserts
+# suman), pero un recálculo espera a que terminen las transacciones con deltas en vuelo (así su
+# INSERT ... SELECT ve esas filas) y las nuevas esperan a que él termine (y suman encima).
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+from sqlalchemy import event, inspect, text, delete
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import select
+from models import EvaluacionCV, EstadisticaProceso
+
+CAMPOS = ("charge_process_id", "match", "cv_procesado", "cv_estado", "years_exper", "match_total")
+BUCKET_MATCH = 10  # ancho de los buckets del histograma (0-10, 10-20, ..., 90-100)
+# fila marcador: el rollup del proceso está completo (se calculó desde las filas al menos una vez)
+INICIALIZADO = ("inicializado", "")
+# primer entero de la clave de pg_advisory_xact_lock(int, int); el segundo es el process_id
+LOCK_ROLLUP = 1021
+
+Clave = Tuple[int, str, str]
+
+
+def bucket_match(match: float) -> str:
+    # mismo cálculo que SQL_RECALCULAR (floor + tope); 100 cae en el último bucket
+    return str(max(min(int(match // BUCKET_MATCH), 100 // BUCKET_MATCH - 1), 0) * BUCKET_MATCH)
+
+
+def _contribucion(valores: dict, signo: int, deltas: Dict[Clave, list]):
+    pid = valores["charge_process_id"]
+    if pid is None:
+        return  # evaluaciones sueltas (/evaluar-cv) no pertenecen a un proceso
+
+    def sumar(dimension, valor="", suma=0.0):
+        delta = deltas[(pid, dimension, valor)]
+        delta[0] += signo
+        delta[1] += signo * suma
+
+    procesado = bool(valores["cv_procesado"])
+    sumar("total")
+    sumar("cv_procesado", "true" if procesado else "false")
+    sumar("cv_estado", valores["cv_estado"] or "")
+    # el histograma es de CVs evaluados: los no procesados quedan con match 0
+    if procesado and valores["match"] is not None:
+        sumar("match", bucket_match(float(valores["match"])))
+    if valores["years_exper"] is not None:
+        sumar("years_exper", suma=float(valores["years_exper"]))
+    if valores["match_total"] is not None:
+        sumar("match_total", suma=float(valores["match_total"]))
+
+
+def _valores_previos(obj) -> dict:
+    estado = inspect(obj)
+    previos = {}
+    for campo in CAMPOS:
+        historia = estado.attrs[campo].history
+        if historia.deleted:
+            previos[campo] = historia.deleted[0]
+        elif historia.unchanged:
+            previos[campo] = historia.unchanged[0]
+        else:
+            previos[campo] = getattr(obj, campo)
+    return previos
+
+
+def _cambio_relevante(obj) -> bool:
+    estado = inspect(obj)
+    return any(estado.attrs[campo].history.has_changes() for campo in CAMPOS)
+
+
+@event.listens_for(Session, "after_flush")
+def _al_flush(session: Session, flush_context):
+    # en after_flush new/dirty/deleted y el historial de atributos aún muestran el estado previo
+    deltas: Dict[Clave, list] = defaultdict(lambda: [0, 0.0])
+    for obj in session.new:
+        if isinstance(obj, EvaluacionCV):
+            _contribucion({campo: getattr(obj, campo) for campo in CAMPOS}, 1, deltas)
+    for obj in session.dirty:
+        if isinstance(obj, EvaluacionCV) and _cambio_relevante(obj):
+            _contribucion(_valores_previos(obj), -1, deltas)
+            _contribucion({campo: getattr(obj, campo) for campo in CAMPOS}, 1, deltas)
+    for obj in session.deleted:
+        if isinstance(obj, EvaluacionCV):
+            _contribucion(_valores_previos(obj), -1, deltas)
+
+    filas = [
+        {"process_id": pid, "dimension": dimension, "valor": valor, "cantidad": cantidad, "suma": suma}
+        for (pid, dimension, valor), (cantidad, suma) in sorted(deltas.items())  # orden fijo: evita deadlocks
+        if cantidad or suma
+    ]
+    if filas:
+        aplicar_deltas(session.connection(), filas)
+
+
+def aplicar_deltas(conexion, filas: list):
+    """Suma las filas (process_id, dimension, valor, cantidad, suma) al rollup con un solo upsert."""
+    for pid in sorted({fila["process_id"] for fila in filas}):
+        conexion.execute(text("SELECT pg_advisory_xact_lock_shared(:clave, :pid)"), {"clave": LOCK_ROLLUP, "pid": pid})
+    tabla = EstadisticaProceso.__table__
+    stmt = insert(tabla).values(filas)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[tabla.c.process_id, tabla.c.dimension, tabla.c.valor],
+        set_={"cantidad": tabla.c.cantidad + stmt.excluded.cantidad, "suma": tabla.c.suma + stmt.excluded.suma},
+    )
+    conexion.execute(stmt)
+
+
+SQL_RECALCULAR = """
+INSERT INTO estadisticaproceso (process_id, dimension, valor, cantidad, suma)
+SELECT :pid, 'total', '', count(*), 0 FROM evaluacioncv WHERE charge_process_id = :pid
+UNION ALL
+SELECT :pid, 'cv_procesado', CASE WHEN cv_procesado THEN 'true' ELSE 'false' END, count(*), 0
+FROM evaluacioncv WHERE charge_process_id = :pid GROUP BY 3
+UNION ALL
+SELECT :pid, 'cv_estado', coalesce(cv_estado, ''), count(*), 0
+FROM evaluacioncv WHERE charge_process_id = :pid GROUP BY 3
+UNION ALL
+SELECT :pid, 'match', (greatest(0, least(9, floor(match / 10)::int)) * 10)::text, count(*), 0
+FROM evaluacioncv WHERE charge_process_id = :pid AND cv_procesado AND match IS NOT NULL GROUP BY 3
+UNION ALL
+SELECT :pid, 'years_exper', '', count(years_exper), coalesce(sum(years_exper), 0)
+FROM evaluacioncv WHERE charge_process_id = :pid
+UNION ALL
+SELECT :pid, 'match_total', '', count(match_total), coalesce(sum(match_total), 0)
+FROM evaluacioncv WHERE charge_process_id = :pid
+UNION ALL
+SELECT :pid, 'inicializado', '', 1, 0
+"""
+
+
+def recalcular(session: Session, process_id: int):
+    """Rehace el rollup del proceso desde EvaluacionCV (no hace commit; el lock dura hasta el commit)."""
+    session.execute(text("SELECT pg_advisory_xact_lock(:clave, :pid)"), {"clave": LOCK_ROLLUP, "pid": process_id})
+    session.exec(delete(EstadisticaProceso).where(EstadisticaProceso.process_id == process_id))  # type: ignore
+    session.execute(text(SQL_RECALCULAR), {"pid": process_id})
+
+
+def _promedio(fila: Optional[EstadisticaProceso]):
+    if not fila or not fila.cantidad:
+        return None
+    return round(fila.suma / fila.cantidad, 2)
+
+
+def resumen(session: Session, process_id: int) -> dict:
+    """Estadísticas del proceso desde el rollup (lo inicializa la primera vez)."""
+    filas = session.exec(select(EstadisticaProceso).where(EstadisticaProceso.process_id == process_id)).all()
+    por_clave = {(f.dimension, f.valor): f for f in filas}
+    if INICIALIZADO not in por_clave:
+        recalcular(session, process_id)
+        session.commit()
+        return resumen(session, process_id)
+
+    def cantidad(dimension, valor=""):
+        fila = por_clave.get((dimension, valor))
+        return fila.cantidad if fila else 0
+
+    return {
+        "process_id": process_id,
+        "total": cantidad("total"),
+        "procesados": cantidad("cv_procesado", "true"),
+        "no_procesados": cantidad("cv_procesado", "false"),
+        "histograma_match": [
+            {"desde": desde, "hasta": desde + BUCKET_MATCH, "cantidad": cantidad("match", str(desde))}
+            for desde in range(0, 100, BUCKET_MATCH)
+        ],
+        "por_cv_estado": {
+            f.valor: f.cantidad for f in filas if f.dimension == "cv_estado" and f.cantidad > 0
+        },
+        "promedio_years_exper": _promedio(por_clave.get(("years_exper", ""))),
+        "con_years_exper": cantidad("years_exper"),
+        "promedio_match_total": _promedio(por_clave.get(("match_total", ""))),
+        "con_match_total": cantidad("match_total"),
+    }
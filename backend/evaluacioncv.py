@@ -1,9 +1,21 @@
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Query
 from sqlmodel import Session, select, or_, and_, desc, join
 from models import EvaluacionCV, JobPosition, ChargeProcess, User , MatchUpdateSchema
-from cargabd import engine, get_session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.orm import selectinload
+from cargabd import engine, get_session, get_async_session, AsyncSessionLocal
+from fastapi.responses import StreamingResponse
 from auth import get_current_user
-import httpx, json
+import io
+import json
+import asyncio
+import anyio
+from clientes_n8n import cliente
+import extraccion_cv
+from utilidades import extraer_datos
+from paginacion import contar, codificar_cursor, decodificar_cursor
+import busqueda
+from sqlalchemy import tuple_
 from typing import List, Optional
 from dotenv import load_dotenv
 from datetime import datetime
@@ -11,38 +23,65 @@ import os
 
 load_dotenv()
 
-n8n = str(os.getenv('N8N_WEBHOOK_URL'))
+EVALUAR_CVS_CONCURRENCIA = int(os.getenv("EVALUAR_CVS_CONCURRENCIA", "4"))
+EVALUAR_CVS_LOTE = int(os.getenv("EVALUAR_CVS_LOTE", "20"))
+
 routercv = APIRouter()
 
+
+async def obtener_puesto(session: AsyncSession, puesto_id: int) -> JobPosition:
+    """Puesto con su área ya cargada (en async no hay carga perezosa de relaciones)."""
+    job = (await session.exec(
+        select(JobPosition).where(JobPosition.id == puesto_id).options(selectinload(JobPosition.area))  # type: ignore
+    )).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Puesto no encontrado")
+    # no retener la conexión mientras n8n evalúa
+    await session.commit()
+    return job
+
+
+async def cuerpo_n8n(nombre: str, tipo: str, contenido: bytes, archivo, job_json: dict) -> dict:
+    """
+    kwargs del POST al flujo "evaluar_cv": con el texto extraído localmente va `cv_text` (y lo
+    que detectan las regex) en vez del archivo; si no hay texto (escaneado, .doc) va `archivo`.
+    """
+    data = {"job_json": json.dumps(job_json)}
+    extraido = await extraccion_cv.texto_de_cv(contenido)
+    if extraido is None:
+        return {"files": {"file": (nombre, archivo, tipo)}, "data": data}
+    data.update({
+        "cv_text": extraido["texto"],
+        "nombre_archivo": nombre,
+        "formato": extraido["formato"],
+        "paginas": str(extraido["paginas"]),
+        "datos_detectados": json.dumps(extraer_datos(extraido["texto"]), ensure_ascii=False),
+    })
+    return {"data": data}
+
 #Solo un CV
 @routercv.post("/evaluar-cv/", response_model=EvaluacionCV)
 async def eval_cv(
     puesto_id: int = Form(...),
     archivo: UploadFile = File(...),
-    user=Depends(get_current_user)
+    user=Depends(get_current_user),
+    session: AsyncSession = Depends(get_async_session)
 ):
     file_bytes = await archivo.read() #archivo pdf
     
     #puestos
-    with Session(engine) as session:
-        job = session.get(JobPosition, puesto_id)
-        if not job:
-            raise HTTPException(status_code=404, detail="Puesto no encontrado")
+    job = await obtener_puesto(session, puesto_id)
     
     #JSON puesto
     job_json = {
         "name": job.name,
         # "requirements": job.requirements,
-        "area": job.area
+        "area": job.area.name if job.area else None
     }
     
-    files = {'file': (archivo.filename, file_bytes, archivo.content_type),}
-    
-    data = {'job_json': json.dumps(job_json)}
+    cuerpo = await cuerpo_n8n(archivo.filename, archivo.content_type, file_bytes, file_bytes, job_json)
     
-    
-    async with httpx.AsyncClient() as client:
-        response = await client.post(n8n, files=files, data=data) #enviar a n8n
+    response = await cliente("evaluar_cv").post(**cuerpo) #enviar a n8n
     
     if response.status_code != 200:
         raise HTTPException(status_code=500, detail="Error al analizar CV") #en caso de error
@@ -73,91 +112,164 @@ async def eval_cv(
         #match = result["match"],
         match = match_value,
         reason = result["reason"],
+        functions = "",
         skills = skills,
         summary = result["summary"],
         puesto_id = puesto_id
     )
 
-    with Session(engine) as session:
-        session.add(eval)
-        session.commit()
-        session.refresh(eval)
+    session.add(eval)
+    await session.commit()
+    await session.refresh(eval)
     
     return eval
 
 
 #Carga masiva de Cvs
-@routercv.post("/evaluar-cvs", response_model=List[EvaluacionCV])
+class ArchivoRechazado(ValueError):
+    pass
+
+
+def evaluacion_desde_respuesta(result: dict, puesto_id: int) -> EvaluacionCV:
+    """Valida la respuesta de n8n para un CV; ArchivoRechazado si no sirve."""
+    try:
+        match_value = int(result.get("match", 0))
+    except (ValueError, TypeError):
+        raise ArchivoRechazado("Match inválido o malformado")
+    if not (0 <= match_value <= 100):
+        raise ArchivoRechazado("El valor de match debe estar entre 0 y 100")
+
+    skills_raw = result.get("skills", [])
+    if isinstance(skills_raw, list):
+        skills = ", ".join(skills_raw)
+    elif isinstance(skills_raw, str):
+        skills = skills_raw
+    else:
+        skills = ""
+    if not skills:
+        raise ArchivoRechazado("Skills vacías o mal formateadas")
+
+    return EvaluacionCV(
+        name=result["name"],
+        match=match_value,
+        reason=result["reason"],
+        functions="",
+        skills=skills,
+        summary=result["summary"],
+        puesto_id=puesto_id
+    )
+
+
+async def evaluar_archivo(nombre: str, tipo: str, archivo, job_json: dict, puesto_id: int, semaforo: asyncio.Semaphore) -> EvaluacionCV:
+    async with semaforo:
+        # dentro del semáforo: a lo sumo EVALUAR_CVS_CONCURRENCIA archivos en memoria a la vez
+        contenido = await asyncio.to_thread(archivo.read)
+        archivo.seek(0)
+        # sin texto, httpx lee el archivo por partes desde el spool
+        cuerpo = await cuerpo_n8n(nombre, tipo, contenido, archivo, job_json)
+        response = await cliente("evaluar_cv").post(**cuerpo)
+    if response.status_code != 200:
+        raise ArchivoRechazado(f"n8n respondió {response.status_code}")
+    return evaluacion_desde_respuesta(response.json(), puesto_id)
+
+
+def linea_ndjson(evento: dict) -> bytes:
+    return (json.dumps(evento, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+
+@routercv.post("/evaluar-cvs")
 async def evaluar_cvs(
     puesto_id: int = Form(...),
     archivos: List[UploadFile] = File(...),
     user = Depends(get_current_user)
 ):
-    resultados = []
-    
-    with Session(engine) as session:
-        job = session.get(JobPosition, puesto_id)
-        if not job:
-            raise HTTPException(status_code=404, detail="Puesto no encontrado")
-        
+    """
+    Evalúa los CVs en paralelo (hasta EVALUAR_CVS_CONCURRENCIA a la vez) y responde NDJSON,
+    una línea por archivo apenas termina, en orden de llegada:
+      {"tipo": "resultado", "archivo": ..., "ok": true, "evaluacion": {...}}
+      {"tipo": "resultado", "archivo": ..., "ok": false, "error": "..."}
+      {"tipo": "guardado", "ids": [...]}      (cada lote insertado)
+      {"tipo": "fin", "total": n, "ok": n, "fallidos": n}
+    """
+    async with AsyncSessionLocal() as session:
+        job = await obtener_puesto(session, puesto_id)
     job_json = {
         "name": job.name,
         # "requirements": job.requirements,
-        "area": job.area
+        "area": job.area.name if job.area else None
     }
-    
-    async with httpx.AsyncClient() as client:
-        for archivo in archivos:
-            file_bytes = await archivo.read()
-            
-            files = {'file': (archivo.filename, file_bytes, archivo.content_type)}
-            data = {'job_json': json.dumps(job_json)}
 
-            try:
-                response = await client.post(n8n, files=files, data=data)
-                if response.status_code != 200:
-                    continue  # Saltar si falla
+    # FastAPI cierra los UploadFile al salir del endpoint, antes de que corra el stream:
+    # el generador se queda con los archivos temporales y los cierra al terminar
+    entradas = []
+    for archivo in archivos:
+        entradas.append((archivo.filename, archivo.content_type, archivo.file))
+        archivo.file = io.BytesIO()
 
-                result = response.json()
+    async def evaluar(nombre: str, tipo: str, f, semaforo: asyncio.Semaphore):
+        try:
+            return nombre, await evaluar_archivo(nombre, tipo, f, job_json, puesto_id, semaforo), None
+        except Exception as e:
+            print(f"Error al procesar {nombre}: {e}")
+            return nombre, None, str(e) or type(e).__name__
 
-                match_value = int(result.get("match", 0))
-                if not (0 <= match_value <= 100):
-                    continue
+    async def eventos():
+        semaforo = asyncio.Semaphore(EVALUAR_CVS_CONCURRENCIA)
+        tareas = [asyncio.create_task(evaluar(nombre, tipo, f, semaforo)) for nombre, tipo, f in entradas]
+        lote: List[EvaluacionCV] = []
+        ok = fallidos = 0
 
-                skills_raw = result.get("skills", [])
-                if isinstance(skills_raw, list):
-                    skills = ", ".join(skills_raw)
-                elif isinstance(skills_raw, str):
-                    skills = skills_raw
-                else:
-                    skills = ""
+        async def guardar_lote():
+            if not lote:
+                return []
+            async with AsyncSessionLocal() as session:
+                session.add_all(lote)
+                await session.commit()  # un INSERT ... VALUES (...), (...) RETURNING id por lote
+                ids = [e.id for e in lote]
+            lote.clear()
+            return ids
 
-                if not skills or skills == "":
+        try:
+            for terminada in asyncio.as_completed(tareas):
+                nombre, evaluacion, error = await terminada
+                if evaluacion is None:
+                    fallidos += 1
+                    yield linea_ndjson({"tipo": "resultado", "archivo": nombre, "ok": False, "error": error})
                     continue
-
-                evaluacion = EvaluacionCV(
-                    name=result["name"],
-                    match=match_value,
-                    reason=result["reason"],
-                    skills=skills,
-                    summary=result["summary"],
-                    puesto_id=puesto_id
-                )
-
-                with Session(engine) as session:
-                    session.add(evaluacion)
-                    session.commit()
-                    session.refresh(evaluacion)
-                    resultados.append(evaluacion)
-
+                ok += 1
+                lote.append(evaluacion)
+                yield linea_ndjson({
+                    "tipo": "resultado", "archivo": nombre, "ok": True,
+                    "evaluacion": evaluacion.model_dump(exclude={"id"}),
+                })
+                if len(lote) >= EVALUAR_CVS_LOTE:
+                    yield linea_ndjson({"tipo": "guardado", "ids": await guardar_lote()})
+            ids = await guardar_lote()
+            if ids:
+                yield linea_ndjson({"tipo": "guardado", "ids": ids})
+            yield linea_ndjson({"tipo": "fin", "total": len(entradas), "ok": ok, "fallidos": fallidos})
+            try:
+                await asyncio.to_thread(extraccion_cv.purgar)
             except Exception as e:
-                print(f"Error al procesar {archivo.filename}: {e}")
-                continue
-
-    if not resultados:
-        raise HTTPException(status_code=500, detail="No se pudo procesar ningún CV")
+                print("⚠️ No se pudo purgar el texto de CVs:", e)
+        finally:
+            # cliente desconectado: no seguir llamando a n8n, pero guardar lo ya evaluado
+            for tarea in tareas:
+                tarea.cancel()
+            with anyio.CancelScope(shield=True):
+                try:
+                    await guardar_lote()
+                except Exception as e:
+                    print("Error al guardar evaluaciones pendientes:", e)
+            for _, _, f in entradas:
+                f.close()
 
-    return resultados
+    return StreamingResponse(
+        eventos(),
+        media_type="application/x-ndjson",
+        # que nginx/proxies no acumulen la respuesta
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 #Obtener un resultado de cv(detalle)
 @routercv.get("/evaluacion/{id}", response_model=EvaluacionCV)
@@ -179,10 +291,22 @@ def historial_general_evaluaciones(
     min_match: Optional[int] = Query(None),
     max_match: Optional[int] = Query(None),
     proceso: Optional[str] = Query(None),
+    texto: Optional[str] = Query(None),
     offset: int = 0,
     limit: int = 20,
+    cursor: Optional[str] = Query(None),
+    modo_total: str = Query("exacto"),
     user: User = Depends(get_current_user)
 ):
+    """
+    Historial paginado. `cursor` (el `siguiente_cursor` de la página anterior) pagina por
+    keyset sobre (date_create, id) y reemplaza a `offset` en páginas profundas.
+    `modo_total`: exacto | estimado (planner de Postgres) | ninguno.
+    `search` y `proceso` buscan "contiene" sin distinguir tildes; `texto` busca en nombre,
+    skills y summary (full-text en español) y ordena por relevancia.
+    """
+    if texto and cursor:
+        raise HTTPException(status_code=400, detail="El cursor no se puede usar al ordenar por relevancia (texto)")
     with Session(engine) as session:
         try:
             #print("Query params:", search, puesto_id, fecha_desde, fecha_hasta, min_match, max_match)
@@ -199,7 +323,11 @@ def historial_general_evaluaciones(
 
             # Filtro por nombre
             if search:
-                query = query.where(EvaluacionCV.name.ilike(f"%{search}%")) # type: ignore
+                query = query.where(busqueda.filtro_contiene([EvaluacionCV.name], search))
+
+            # Búsqueda full-text (nombre, skills, summary)
+            if texto:
+                query = query.where(busqueda.filtro_texto_evaluacion(texto))
 
             # Filtro por puesto
             if puesto_id:
@@ -226,13 +354,31 @@ def historial_general_evaluaciones(
                 query = query.where(EvaluacionCV.match <= max_match) # type: ignore
                 
             if proceso:
-                query = query.where(ChargeProcess.code.ilike(f"%{proceso}%"))  # type: ignore
+                query = query.where(busqueda.filtro_contiene([ChargeProcess.code], proceso))
+
+            total = contar(session, query, modo_total)
+
+            relevancia = busqueda.orden_relevancia_evaluacion(texto) if texto else None
+            if relevancia is not None:
+                query = query.order_by(relevancia)
+            query = query.order_by(desc(EvaluacionCV.date_create), desc(EvaluacionCV.id))
+            if cursor:
+                fecha_cursor, id_cursor = decodificar_cursor(cursor)
+                query = query.where(
+                    tuple_(EvaluacionCV.date_create, EvaluacionCV.id) < tuple_(fecha_cursor, id_cursor)
+                )
+            else:
+                query = query.offset(offset)
+            results = session.exec(query.limit(limit)).all()
 
-            query = query.order_by(desc(EvaluacionCV.date_create))
-            total = len(session.exec(query).all())
-            results = session.exec(query.offset(offset).limit(limit)).all()
+            siguiente_cursor = None
+            if len(results) == limit and results[-1][0].date_create and not texto:
+                ultimo = results[-1][0]
+                siguiente_cursor = codificar_cursor(ultimo.date_create, ultimo.id)
             return {
                 "total": total,
+                "modo_total": modo_total,
+                "siguiente_cursor": siguiente_cursor,
                 "resultados": [
                     {
                         "name": e.name,
@@ -247,6 +393,8 @@ def historial_general_evaluaciones(
                     for e, proc, job in results
                 ]
             }
+        except HTTPException:
+            raise
         except Exception as e:
             print("ERROR:", e)
             raise HTTPException(status_code=500, detail=str(e))
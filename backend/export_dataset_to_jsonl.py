@@ -1,6 +1,12 @@
 import os
+import io
+import gzip
 import json
+import shutil
+import time
 import argparse
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 from psycopg2 import connect
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
@@ -11,6 +17,14 @@ load_dotenv()
 DSN = str(os.getenv("DATABASE_URL"))
 OUT_FILE = 'dataset_for_ft.jsonl'
 LIMIT = None  # opcional, por ejemplo 1000
+# filas que trae el cursor de servidor por viaje (acota la memoria del export)
+ITERSIZE = int(os.getenv("EXPORT_ITERSIZE", "2000"))
+# tope de espera por las transacciones que estaban escribiendo datasetentry al fijar el corte
+ESPERA_ESCRITURAS_SEGUNDOS = float(os.getenv("EXPORT_ESPERA_ESCRITURAS_SEGUNDOS", "60"))
+
+# solo las columnas que usa row_to_example: los demás JSONB (raw_agent_output*, cleaned_output,
+# model_meta...) no se leen del disco ni viajan por la red
+COLUMNAS = ("id", "job_requirements", "cv_text", "process_id", "puesto_id", "nombre_archivo", "final_json")
 
 PROMPT_TEMPLATE = (
     "INSTRUCCIONES: Extrae y evalúa el ajuste del candidato al puesto.\n"
@@ -44,32 +58,230 @@ def row_to_example(row):
     return {"prompt": prompt, "completion": completion}
 
 
-def export_jsonl(dsn, out_file, limit=None):
-    sql = "SELECT * FROM datasetentry WHERE final_json IS NOT NULL ORDER BY id"
+def compresion_de(ruta):
+    if ruta.endswith('.gz'):
+        return 'gzip'
+    if ruta.endswith('.zst'):
+        return 'zstd'
+    return None
+
+
+def abrir_salida(ruta):
+    """Archivo de texto según la extensión (.gz / .zst / plano)."""
+    compresion = compresion_de(ruta)
+    if compresion == 'gzip':
+        return gzip.open(ruta, 'wt', encoding='utf8', compresslevel=6)
+    if compresion == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise SystemExit("Salida .zst requiere el paquete zstandard (pip install zstandard)")
+        crudo = open(ruta, 'wb')
+        return io.TextIOWrapper(zstandard.ZstdCompressor(level=6).stream_writer(crudo), encoding='utf8')
+    return open(ruta, 'w', encoding='utf8')
+
+
+def ruta_con_sufijo(out_file, sufijo):
+    """('dataset.jsonl.gz', '-train') -> 'dataset-train.jsonl.gz' (respeta la extensión de compresión)"""
+    base, resto = out_file, ''
+    for ext in ('.gz', '.zst'):
+        if base.endswith(ext):
+            base, resto = base[:-len(ext)], ext
+    base, ext = os.path.splitext(base)
+    return f"{base}{sufijo}{ext}{resto}"
+
+
+def ruta_shard(out_file, indice, total, corrida=None):
+    """
+    dataset.jsonl.gz -> dataset-0001-of-0004.jsonl.gz
+    Con corrida (incremental): dataset-ids101-250-0001-of-0004.jsonl.gz. Cada corrida escribe sus
+    propios shards en vez de anexar a archivos cuyo número depende de --shards de esa corrida.
+    """
+    prefijo = f"-{corrida}" if corrida else ""
+    return ruta_con_sufijo(out_file, f"{prefijo}-{indice:04d}-of-{total:04d}")
+
+
+def leer_watermark(ruta):
+    if not os.path.exists(ruta):
+        return 0
+    with open(ruta, encoding='utf8') as f:
+        return int(json.load(f).get('ultimo_id') or 0)
+
+
+def guardar_watermark(ruta, ultimo_id, filas):
+    # escritura atómica: un corte a mitad no deja el watermark corrupto
+    tmp = ruta + '.tmp'
+    with open(tmp, 'w', encoding='utf8') as f:
+        json.dump({"ultimo_id": ultimo_id, "filas": filas, "fecha": datetime.now().isoformat()}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, ruta)
+
+
+def iterar_filas(dsn, desde=0, hasta=None, limit=None, itersize=ITERSIZE):
+    """
+    Filas de datasetentry con desde < id <= hasta, en orden de id, leídas con un cursor de
+    servidor (con nombre): Postgres entrega `itersize` filas por viaje en vez de mandar la
+    tabla entera al cliente.
+    """
+    sql = f"SELECT {', '.join(COLUMNAS)} FROM datasetentry WHERE final_json IS NOT NULL AND id > %s"
+    params = [desde]
+    if hasta is not None:
+        sql += " AND id <= %s"
+        params.append(hasta)
+    sql += " ORDER BY id"
     if limit:
         sql += f" LIMIT {int(limit)}"
 
     conn = connect(dsn)
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute(sql)
+    try:
+        # el cursor con nombre vive dentro de la transacción (readonly: no toma locks de escritura)
+        conn.set_session(readonly=True)
+        with conn.cursor(name='export_dataset', cursor_factory=RealDictCursor) as cur:
+            cur.itersize = itersize
+            cur.execute(sql, params)
+            yield from cur
+    finally:
+        conn.close()
 
-    with open(out_file, 'w', encoding='utf8') as f:
-        count = 0
-        for row in cur:
+
+def exportar_rango(dsn, out_file, desde, hasta, limit=None, itersize=ITERSIZE, anexar=False):
+    """
+    Escribe los ejemplos con desde < id <= hasta. Devuelve (filas escritas, último id escrito).
+    Al anexar, lo nuevo se escribe aparte y se concatena solo si terminó: una corrida cortada
+    no deja filas a medias en el archivo que luego se repetirían al reintentar.
+    """
+    # el prefijo conserva la extensión, que decide la compresión
+    destino = os.path.join(os.path.dirname(out_file), '.parcial-' + os.path.basename(out_file)) if anexar else out_file
+    count, ultimo_id = 0, desde
+    with abrir_salida(destino) as f:
+        for row in iterar_filas(dsn, desde, hasta, limit, itersize):
             ex = row_to_example(row)
             f.write(json.dumps(ex, ensure_ascii=False) + '\n')
             count += 1
+            ultimo_id = row['id']
+    if anexar:
+        # gzip / zstd / texto plano admiten concatenar archivos completos
+        with open(destino, 'rb') as parcial, open(out_file, 'ab') as final:
+            shutil.copyfileobj(parcial, final)
+            final.flush()
+            os.fsync(final.fileno())
+        os.remove(destino)
+    return count, ultimo_id
+
+
+def rango_pendiente(dsn, desde):
+    """
+    Máximo id a exportar, fijado al inicio: lo insertado durante el export queda para la próxima corrida.
+
+    max(id) solo ve filas con commit, pero un id menor puede estar en una transacción aún abierta
+    (el id se toma de la secuencia al insertar, el commit llega después): si el watermark pasara
+    por encima, esa fila no se exportaría nunca. Por eso, tras leer el máximo, se espera a que
+    terminen las transacciones que en ese momento tenían lock de escritura sobre datasetentry;
+    las que empiecen después reciben ids mayores. No bloquea a los que escriben.
+    """
+    conn = connect(dsn)
+    try:
+        conn.autocommit = True  # cada consulta con su propio snapshot
+        with conn.cursor() as cur:
+            cur.execute("SELECT max(id) FROM datasetentry WHERE id > %s", (desde,))
+            hasta = cur.fetchone()[0]
+            if hasta is None:
+                return None
+            cur.execute(
+                "SELECT DISTINCT virtualtransaction FROM pg_locks"
+                " WHERE relation = 'datasetentry'::regclass AND mode = 'RowExclusiveLock'"
+                " AND pid <> pg_backend_pid()"
+            )
+            abiertas = [r[0] for r in cur.fetchall()]
+            limite = time.monotonic() + ESPERA_ESCRITURAS_SEGUNDOS
+            while abiertas:
+                if time.monotonic() > limite:
+                    raise SystemExit(
+                        f"Hay {len(abiertas)} transacciones escribiendo datasetentry hace más de "
+                        f"{ESPERA_ESCRITURAS_SEGUNDOS:.0f}s; reintentar el export más tarde"
+                    )
+                time.sleep(0.2)
+                cur.execute(
+                    "SELECT DISTINCT virtualtransaction FROM pg_locks WHERE virtualtransaction = ANY(%s)",
+                    (abiertas,),
+                )
+                abiertas = [r[0] for r in cur.fetchall()]
+            return hasta
+    finally:
+        conn.close()
+
+
+def limites_shards(dsn, desde, hasta, shards):
+    """Cortes por cuantiles de id (no por ancho de rango) para que los shards queden parejos pese a los huecos."""
+    fracciones = [i / shards for i in range(1, shards)]
+    conn = connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT percentile_disc(%s::float8[]) WITHIN GROUP (ORDER BY id) FROM datasetentry"
+                " WHERE final_json IS NOT NULL AND id > %s AND id <= %s",
+                (fracciones, desde, hasta),
+            )
+            cortes = cur.fetchone()[0] or []
+    finally:
+        conn.close()
+    limites = [desde] + sorted(set(c for c in cortes if c is not None)) + [hasta]
+    return [(a, b) for a, b in zip(limites, limites[1:]) if b > a]
+
+
+def export_jsonl(dsn, out_file, limit=None, itersize=ITERSIZE, incremental=False, watermark=None,
+                 shards=1, procesos=None):
+    """
+    Export completo, o incremental desde el watermark (último id exportado, guardado junto al
+    archivo). En incremental se anexa al archivo existente, salvo con shards: cada corrida
+    escribe sus propios archivos, nombrados con su rango de ids. El watermark solo avanza si
+    todos los shards terminaron bien, así que una corrida fallida se repite entera.
+    """
+    watermark = watermark or out_file + '.watermark.json'
+    desde = leer_watermark(watermark) if incremental else 0
+    hasta = rango_pendiente(dsn, desde)
+    if hasta is None:
+        print(f"No new rows after id {desde}")
+        return 0
+
+    if shards > 1:
+        if limit:
+            raise SystemExit("--limit no se puede combinar con --shards")
+        rangos = limites_shards(dsn, desde, hasta, shards)
+        total = len(rangos)
+        corrida = f"ids{desde + 1}-{hasta}" if incremental else None
+        with ProcessPoolExecutor(max_workers=procesos or total) as pool:
+            futuros = [
+                pool.submit(exportar_rango, dsn, ruta_shard(out_file, i, total, corrida), a, b, None, itersize)
+                for i, (a, b) in enumerate(rangos, start=1)
+            ]
+            resultados = [fut.result() for fut in futuros]
+        count = sum(filas for filas, _ in resultados)
+        ultimo_id = hasta
+        for i, (filas, _) in enumerate(resultados, start=1):
+            print(f"  shard {i}/{total}: {filas} examples -> {ruta_shard(out_file, i, total, corrida)}")
+    else:
+        count, ultimo_id = exportar_rango(dsn, out_file, desde, hasta, limit, itersize, incremental)
+        if not limit:
+            ultimo_id = hasta
 
-    cur.close()
-    conn.close()
-    print(f"Wrote {count} examples to {out_file}")
+    guardar_watermark(watermark, ultimo_id, count)
+    print(f"Wrote {count} examples to {out_file} (ids {desde + 1}..{ultimo_id})")
+    return count
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Export DB rows to JSONL for fine-tuning')
-    parser.add_argument('--out', '-o', default=OUT_FILE)
+    parser.add_argument('--out', '-o', default=OUT_FILE, help='.jsonl, .jsonl.gz o .jsonl.zst')
     parser.add_argument('--limit', '-n', default=LIMIT, type=int, nargs='?')
     parser.add_argument('--dsn', default=DSN)
+    parser.add_argument('--itersize', type=int, default=ITERSIZE)
+    parser.add_argument('--incremental', action='store_true', help='exporta solo ids posteriores al watermark y anexa')
+    parser.add_argument('--watermark', default=None, help='por defecto <out>.watermark.json')
+    parser.add_argument('--shards', type=int, default=1, help='archivos por rango de id, exportados en paralelo')
+    parser.add_argument('--procesos', type=int, default=None)
     args = parser.parse_args()
 
-    export_jsonl(args.dsn, args.out, args.limit)
\ No newline at end of file
+    export_jsonl(args.dsn, args.out, args.limit, args.itersize, args.incremental, args.watermark,
+                 args.shards, args.procesos)
@@ -0,0 +1,277 @@
+# extraccion_cv.py
+# Extracción local del texto de los CVs (PDF con pypdf, DOCX con python-docx) para que a n8n
+# le llegue texto en vez del binario y los extractores regex de utilidades.py lean texto real.
+# El parseo es CPU puro: corre en un ProcessPoolExecutor (EXTRACCION_PROCESOS) para no frenar
+# el event loop ni pelear por el GIL. El timeout por archivo corre dentro del worker (SIGALRM),
+# desde que empieza a parsear y no desde que se encoló: el archivo que se pasa falla solo y el
+# proceso sigue sirviendo. Como respaldo, si un parseo no atiende la señal (código en C), se
+# matan los procesos del pool y se arma uno nuevo; las otras extracciones que estaban en ese pool
+# se reintentan una vez en el nuevo. Al pool entran a lo más EXTRACCION_PROCESOS a la vez, así
+# ese respaldo tampoco cuenta la espera en cola.
+# Lo extraído se cachea en textocv por sha256 del contenido: el mismo archivo resubido no se
+# vuelve a parsear. Un timeout o un error no se cachea: el archivo se vuelve a intentar.
+# Si no hay texto útil (PDF escaneado, .doc, archivo dañado o protegido) texto_de_cv devuelve
+# None y el caller manda el archivo como antes, para que lo parsee n8n.
+import io
+import os
+import re
+import time
+import signal
+import asyncio
+import hashlib
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from typing import Optional
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session
+from models import TextoCV, peru_time
+from cargabd import engine
+from metricas import incrementar, observar
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# subirla al cambiar cómo se extrae (librería, normalización) invalida lo cacheado
+EXTRACTOR_VERSION = "1"
+EXTRACCION_PROCESOS = int(os.getenv("EXTRACCION_PROCESOS", str(min(4, os.cpu_count() or 1))))
+EXTRACCION_TIMEOUT_SEGUNDOS = float(os.getenv("EXTRACCION_TIMEOUT_SEGUNDOS", "20"))
+# margen sobre el timeout antes de dar al worker por colgado (no atendió SIGALRM) y matar el pool
+EXTRACCION_MARGEN_SEGUNDOS = float(os.getenv("EXTRACCION_MARGEN_SEGUNDOS", "10"))
+EXTRACCION_MAX_PAGINAS = int(os.getenv("EXTRACCION_MAX_PAGINAS", "30"))  # un CV no tiene más
+EXTRACCION_MIN_CARACTERES = int(os.getenv("EXTRACCION_MIN_CARACTERES", "200"))  # menos: escaneado
+EXTRACCION_CACHE_MAX_DIAS = int(os.getenv("EXTRACCION_CACHE_MAX_DIAS", "90"))
+
+FIRMAS = {"pdf": b"%PDF-", "docx": b"PK\x03\x04"}  # .doc (OLE) no se extrae: va el archivo
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+MC_FALLBACK = "{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback"
+
+
+def detectar_formato(contenido: bytes) -> Optional[str]:
+    for formato, firma in FIRMAS.items():
+        if contenido.startswith(firma):
+            return formato
+    return None
+
+
+def hash_contenido(contenido: bytes) -> str:
+    return hashlib.sha256(contenido).hexdigest()
+
+
+def _normalizar(texto: str) -> str:
+    texto = texto.replace("\x00", "")
+    texto = re.sub(r"[ \t\u00a0]+", " ", texto)
+    texto = re.sub(r" ?\n ?", "\n", texto)
+    texto = re.sub(r"\n{3,}", "\n\n", texto)
+    return texto.strip()
+
+
+def _texto_pdf(contenido: bytes, max_paginas: int):
+    from pypdf import PdfReader
+
+    lector = PdfReader(io.BytesIO(contenido))
+    if lector.is_encrypted:
+        lector.decrypt("")  # muchos CVs vienen "protegidos" solo con contraseña de propietario
+    paginas = [lector.pages[i] for i in range(min(len(lector.pages), max_paginas))]
+    return "\n\n".join(pagina.extract_text() or "" for pagina in paginas), len(paginas)
+
+
+def _parrafos(elemento):
+    # párrafos en orden de documento, incluidos los de tablas y cuadros de texto (plantillas de CV);
+    # el contenido repetido en mc:Fallback (VML para Word antiguo) se salta
+    for p in elemento.iter(f"{W}p"):
+        if any(a.tag == MC_FALLBACK for a in p.iterancestors()):
+            continue
+        yield "".join(t.text or "" for t in p.iter(f"{W}t"))
+
+
+def _texto_docx(contenido: bytes):
+    from docx import Document
+
+    documento = Document(io.BytesIO(contenido))
+    partes = []
+    for seccion in documento.sections:  # los datos de contacto suelen ir en el encabezado
+        if not seccion.header.is_linked_to_previous:
+            partes.extend(_parrafos(seccion.header._element))
+    partes.extend(_parrafos(documento.element.body))
+
+    # DOCX no tiene páginas: las que guardó Word al grabar (docProps/app.xml), o 1
+    paginas = 0
+    with zipfile.ZipFile(io.BytesIO(contenido)) as z:
+        if "docProps/app.xml" in z.namelist():
+            encontrado = re.search(rb"<(?:\w+:)?Pages>(\d+)<", z.read("docProps/app.xml"))
+            paginas = int(encontrado.group(1)) if encontrado else 0
+    return "\n".join(partes), max(1, min(paginas, EXTRACCION_MAX_PAGINAS))
+
+
+def extraer_texto(contenido: bytes, max_paginas: int = EXTRACCION_MAX_PAGINAS) -> dict:
+    """
+    {"formato", "paginas", "texto"} del CV. Bloqueante (corre en el pool); lanza excepción
+    si el formato no es PDF/DOCX o el archivo no se puede leer.
+    """
+    formato = detectar_formato(contenido)
+    if formato == "pdf":
+        texto, paginas = _texto_pdf(contenido, max_paginas)
+    elif formato == "docx":
+        texto, paginas = _texto_docx(contenido)
+    else:
+        raise ValueError("Formato no soportado para extracción local (solo PDF y DOCX)")
+    return {"formato": formato, "paginas": paginas, "texto": _normalizar(texto)}
+
+
+class ExtraccionVencida(Exception):
+    """El parseo de un archivo pasó de EXTRACCION_TIMEOUT_SEGUNDOS (lanzada dentro del worker)."""
+
+
+def _al_vencer(signum, frame):
+    raise ExtraccionVencida(f"la extracción pasó de {EXTRACCION_TIMEOUT_SEGUNDOS:.0f}s")
+
+
+def extraer_con_plazo(contenido: bytes) -> dict:
+    """extraer_texto con un plazo que corre desde que el worker empieza con el archivo."""
+    if not hasattr(signal, "setitimer"):  # Windows: queda solo el respaldo de texto_de_cv
+        return extraer_texto(contenido)
+    anterior = signal.signal(signal.SIGALRM, _al_vencer)
+    signal.setitimer(signal.ITIMER_REAL, EXTRACCION_TIMEOUT_SEGUNDOS)
+    try:
+        return extraer_texto(contenido)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, anterior)
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_cupos: Optional[asyncio.Semaphore] = None
+_cupos_loop = None
+
+
+def pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=EXTRACCION_PROCESOS)
+    return _pool
+
+
+def cupos() -> asyncio.Semaphore:
+    # un semáforo por event loop (asyncio.run en scripts y benchmarks crea uno nuevo cada vez)
+    global _cupos, _cupos_loop
+    loop = asyncio.get_running_loop()
+    if _cupos is None or _cupos_loop is not loop:
+        _cupos, _cupos_loop = asyncio.Semaphore(EXTRACCION_PROCESOS), loop
+    return _cupos
+
+
+def cerrar_pool(ejecutor: Optional[ProcessPoolExecutor] = None):
+    """
+    Apaga el pool terminando sus procesos: shutdown() solo no corta un parseo colgado.
+    Con `ejecutor`, solo si sigue siendo el pool actual (otro error ya pudo haberlo recreado).
+    """
+    global _pool
+    if _pool is None or (ejecutor is not None and ejecutor is not _pool):
+        return
+    actual, _pool = _pool, None
+    procesos = list((actual._processes or {}).values())
+    actual.shutdown(wait=False, cancel_futures=True)
+    for proceso in procesos:
+        if proceso.is_alive():
+            proceso.terminate()
+
+
+def buscar_cache(contenido_hash: str) -> Optional[dict]:
+    with Session(engine) as session:
+        fila = session.get(TextoCV, contenido_hash)
+        if not fila or fila.version != EXTRACTOR_VERSION:
+            return None
+        fila.ultimo_uso = peru_time()
+        session.add(fila)
+        session.commit()
+        return {"formato": fila.formato, "paginas": fila.paginas, "texto": fila.texto}
+
+
+def guardar_cache(contenido_hash: str, extraido: dict):
+    ahora = peru_time()
+    stmt = insert(TextoCV).values(
+        contenido_hash=contenido_hash, version=EXTRACTOR_VERSION, fecha_creacion=ahora, ultimo_uso=ahora,
+        **extraido,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["contenido_hash"],
+        set_={c: stmt.excluded[c] for c in ("version", "formato", "paginas", "texto", "fecha_creacion", "ultimo_uso")},
+    )
+    with Session(engine) as session:
+        session.exec(stmt)  # type: ignore
+        session.commit()
+
+
+async def _extraer_en_pool(contenido: bytes) -> dict:
+    """
+    extraer_con_plazo en el pool. Si el pool se cae (un worker murió o se mató por otro archivo
+    colgado) se reintenta una vez en uno nuevo. Si este archivo no atiende el plazo, se mata el
+    pool y se lanza asyncio.TimeoutError.
+    """
+    for intento in range(2):
+        async with cupos():
+            ejecutor = pool()
+            try:
+                # con cupo propio el archivo no espera en la cola del pool: el reloj mide su parseo
+                return await asyncio.wait_for(
+                    asyncio.get_running_loop().run_in_executor(ejecutor, extraer_con_plazo, contenido),
+                    EXTRACCION_TIMEOUT_SEGUNDOS + EXTRACCION_MARGEN_SEGUNDOS,
+                )
+            except asyncio.TimeoutError:
+                # el worker no atendió SIGALRM y sigue parseando: solo matándolo se libera
+                cerrar_pool(ejecutor)
+                print("⚠️ Worker de extracción colgado, se recrea el pool")
+                raise
+            except BrokenProcessPool:
+                cerrar_pool(ejecutor)
+                if intento:
+                    raise
+                print("⚠️ Pool de extracción caído, se recrea y se reintenta el CV")
+
+
+async def texto_de_cv(contenido: bytes) -> Optional[dict]:
+    """
+    {"formato", "paginas", "texto", "contenido_hash"} para mandar a n8n en vez del archivo,
+    o None si hay que mandar el archivo (formato no soportado, sin capa de texto o error).
+    """
+    if detectar_formato(contenido) is None:
+        return None
+    contenido_hash = hash_contenido(contenido)
+    extraido = await asyncio.to_thread(buscar_cache, contenido_hash)
+    if extraido is not None:
+        incrementar("extraccion_cache_hits")
+    else:
+        inicio = time.perf_counter()
+        try:
+            extraido = await _extraer_en_pool(contenido)
+        except (ExtraccionVencida, asyncio.TimeoutError):
+            incrementar("extraccion_timeouts")
+            print(f"⚠️ Extracción del CV pasó de {EXTRACCION_TIMEOUT_SEGUNDOS:.0f}s, se envía el archivo")
+            return None
+        except Exception as e:
+            incrementar("extraccion_errores")
+            print(f"⚠️ No se pudo extraer el texto del CV ({type(e).__name__}: {e}), se envía el archivo")
+            return None
+        observar("extraccion_cv", time.perf_counter() - inicio)
+        incrementar("extraccion_paginas", extraido["paginas"])
+        # también se cachea el texto vacío de un escaneado: no se vuelve a intentar
+        await asyncio.to_thread(guardar_cache, contenido_hash, extraido)
+
+    if len(extraido["texto"]) < EXTRACCION_MIN_CARACTERES:
+        incrementar("extraccion_sin_texto")
+        return None
+    return {**extraido, "contenido_hash": contenido_hash}
+
+
+def purgar():
+    """Borra lo extraído que no se usa hace EXTRACCION_CACHE_MAX_DIAS."""
+    with Session(engine) as session:
+        limite = peru_time() - timedelta(days=EXTRACCION_CACHE_MAX_DIAS)
+        borrados = session.exec(delete(TextoCV).where(TextoCV.ultimo_uso < limite)).rowcount  # type: ignore
+        session.commit()
+    if borrados:
+        print(f"🧹 Texto de CVs: {borrados} sin uso eliminados")
@@ -0,0 +1,137 @@
+# fake_n8n.py
+# n8n falso para probar localmente reintentos, circuit breaker y concurrencia sin tocar
+# el n8n real. Responde en cualquier ruta con un resultado de evaluación plausible.
+#   python fake_n8n.py --puerto 8765 --tasa-502 0.2 --latencia-ms 300
+#   python fake_n8n.py --caido-seg 30      # 503 durante los primeros 30 s, luego responde bien
+# y apuntar el backend/worker a él, p.ej. N8N_PROCESAR_CVS_URL2=http://localhost:8765/cv
+# Modo callback (N8N_MODO_CALLBACK=true, N8N_PROCESAR_CVS_CALLBACK_URL=http://localhost:8765/cv):
+# si el payload trae callback_url responde 202 y luego hace POST del resultado firmado con
+# N8N_CALLBACK_SECRET (o --secreto); --tasa-sin-callback simula callbacks perdidos.
+import os
+import hmac
+import json
+import time
+import random
+import asyncio
+import argparse
+import hashlib
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+import uvicorn
+
+app = FastAPI()
+config = {
+    "tasa_502": 0.0, "latencia_ms": 200, "caido_hasta": 0.0,
+    "secreto": os.getenv("N8N_CALLBACK_SECRET", ""), "tasa_sin_callback": 0.0, "tasa_duplicado": 0.0,
+}
+contadores = {"total": 0, "errores": 0, "callbacks": 0, "callbacks_rechazados": 0, "sin_callback": 0,
+              "con_archivo": 0, "con_texto": 0, "bytes_recibidos": 0}
+pendientes = set()  # tareas de callback en curso (referencia para que no las recolecte el GC)
+
+
+def resultado_falso(payload: dict) -> dict:
+    url = payload.get("url_cv") or payload.get("nombre_archivo") or str(random.random())
+    h = int(hashlib.md5(url.encode("utf-8")).hexdigest(), 16)
+    return {
+        "url_cv": payload.get("url_cv"),
+        "nombre_archivo": payload.get("nombre_archivo"),
+        "cv_procesado": True,
+        "cv_estado": "leído",
+        "name": f"Postulante {h % 100000}",
+        "dni": f"{h % 100000000:08d}",
+        "email": f"p{h % 100000}@fake.local",
+        "years_exper": h % 15,
+        "level_educa": "Titulado",
+        "certif": ["Scrum"],
+        "languages": ["Español"],
+        "evaluacion": {"match": h % 101, "reason": "fake", "skills": ["python", "sql"], "summary": "fake"},
+        # respuesta de /evaluar-cv(s)
+        "match": h % 101,
+        "reason": "fake",
+        "skills": ["python", "sql"],
+        "summary": "fake",
+    }
+
+
+async def enviar_callback(payload: dict):
+    """Simula el final del flujo: espera la "evaluación" y manda el resultado firmado."""
+    await asyncio.sleep(config["latencia_ms"] / 1000 * random.uniform(0.5, 1.5))
+    if random.random() < config["tasa_sin_callback"]:
+        contadores["sin_callback"] += 1
+        return
+    cuerpo = json.dumps({"correlation_id": payload["correlation_id"], "resultado": resultado_falso(payload)}).encode("utf-8")
+    timestamp = str(int(time.time()))
+    firma = hmac.new(config["secreto"].encode("utf-8"), timestamp.encode("ascii") + b"." + cuerpo, hashlib.sha256).hexdigest()
+    headers = {"Content-Type": "application/json", "X-N8N-Timestamp": timestamp, "X-N8N-Firma": f"sha256={firma}"}
+    envios = 2 if random.random() < config["tasa_duplicado"] else 1  # n8n reintentando un callback
+    async with httpx.AsyncClient(timeout=30) as client:
+        for _ in range(envios):
+            try:
+                response = await client.post(payload["callback_url"], content=cuerpo, headers=headers)
+                contadores["callbacks"] += 1
+                if response.status_code >= 400:
+                    contadores["callbacks_rechazados"] += 1
+                    print("callback rechazado:", response.status_code, response.text[:200])
+            except httpx.HTTPError as e:
+                contadores["callbacks_rechazados"] += 1
+                print("callback falló:", e)
+
+
+@app.get("/estado")
+def estado():
+    return contadores
+
+
+@app.post("/{ruta:path}")
+async def webhook(ruta: str, request: Request):
+    contadores["total"] += 1
+    contadores["bytes_recibidos"] += int(request.headers.get("content-length") or 0)
+    if request.headers.get("content-type", "").startswith("application/json"):
+        payload = await request.json()
+    else:
+        payload = dict(await request.form())
+        if payload.pop("file", None) is not None:
+            contadores["con_archivo"] += 1
+        elif "cv_text" in payload:
+            contadores["con_texto"] += 1
+
+    callback = payload.get("callback_url")
+    if not callback:
+        await asyncio.sleep(config["latencia_ms"] / 1000 * random.uniform(0.5, 1.5))
+
+    if time.monotonic() < config["caido_hasta"]:
+        contadores["errores"] += 1
+        return JSONResponse({"error": "n8n caído (simulado)"}, status_code=503)
+    if random.random() < config["tasa_502"]:
+        contadores["errores"] += 1
+        return JSONResponse({"error": "bad gateway (simulado)"}, status_code=502)
+
+    if callback:
+        tarea = asyncio.create_task(enviar_callback(payload))
+        pendientes.add(tarea)
+        tarea.add_done_callback(pendientes.discard)
+        return JSONResponse({"correlation_id": payload.get("correlation_id"), "aceptado": True}, status_code=202)
+    if "folder_name" in payload:
+        return {"folder_id": f"fake-{payload['folder_name']}", "folder_url": f"https://drive.fake/{payload['folder_name']}"}
+    return resultado_falso(payload)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="n8n falso para pruebas locales")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--tasa-502", type=float, default=0.0, help="fracción de llamadas que responden 502")
+    parser.add_argument("--latencia-ms", type=int, default=200)
+    parser.add_argument("--caido-seg", type=float, default=0.0, help="responder 503 durante los primeros N segundos")
+    parser.add_argument("--secreto", default=config["secreto"], help="secreto HMAC de los callbacks (N8N_CALLBACK_SECRET)")
+    parser.add_argument("--tasa-sin-callback", type=float, default=0.0, help="fracción de CVs cuyo callback nunca llega")
+    parser.add_argument("--tasa-duplicado", type=float, default=0.0, help="fracción de callbacks enviados dos veces")
+    args = parser.parse_args()
+
+    config["tasa_502"] = args.tasa_502
+    config["latencia_ms"] = args.latencia_ms
+    config["caido_hasta"] = time.monotonic() + args.caido_seg
+    config["secreto"] = args.secreto
+    config["tasa_sin_callback"] = args.tasa_sin_callback
+    config["tasa_duplicado"] = args.tasa_duplicado
+    uvicorn.run(app, host="0.0.0.0", port=args.puerto)
@@ -0,0 +1,178 @@
+# finalizacion.py
+# Job "finalizar" (lo encola POST /procesos/{id}/finalizar, lo ejecuta worker.py): envía a n8n
+# (N8N_ACTUALIZR_MATCHS_URL) la shortlist del proceso (match >= 80) por lotes de FINALIZAR_LOTE
+# candidatos, en vez de todo en una sola llamada de horas.
+# El primer intento congela la shortlist en enviofinalizacion; cada lote que n8n confirma (2xx)
+# se marca en la misma transacción que el avance del job, así que un reintento retoma desde el
+# primer lote sin confirmar. lote_id (job-lote) es el mismo entre reintentos: si se perdió la
+# respuesta de un lote que n8n sí procesó, el flujo puede reconocerlo y descartarlo.
+import os
+import math
+import asyncio
+from typing import List, Optional, Tuple
+from sqlalchemy import insert, update, literal
+from sqlmodel import Session, select, func
+from models import ChargeProcess, EvaluacionCV, EnvioFinalizacion, peru_time
+from cargabd import engine
+from clientes_n8n import cliente, CircuitoAbierto
+from cola_jobs import JobPausado, LeasePerdido, job_propio
+from auth import create_job_token
+from progreso import publicar_progreso
+from dotenv import load_dotenv
+
+load_dotenv()
+
+FINALIZAR_LOTE = int(os.getenv("FINALIZAR_LOTE", "100"))  # candidatos por llamada a n8n
+MATCH_SHORTLIST = 80
+
+
+def congelar_shortlist(job_id: int, worker_id: Optional[str] = None) -> Tuple[int, int, int, Optional[str]]:
+    """
+    Copia la shortlist al job la primera vez (en un reintento ya está). Devuelve
+    (process_id, total, ya enviados, creado_por) y alinea el avance del job con los lotes confirmados.
+    """
+    with Session(engine) as session:
+        proc_job = job_propio(session, job_id, worker_id)
+        if not proc_job:
+            if worker_id is not None:
+                raise LeasePerdido(f"Job {job_id}: ya no es de {worker_id}")
+            raise ValueError(f"Job {job_id} no encontrado")
+
+        congelada = session.exec(
+            select(EnvioFinalizacion.job_id).where(EnvioFinalizacion.job_id == job_id).limit(1)
+        ).first()
+        if congelada is None:
+            session.exec(insert(EnvioFinalizacion).from_select(  # type: ignore
+                ["job_id", "evaluacion_id"],
+                select(literal(job_id), EvaluacionCV.id).where(
+                    EvaluacionCV.charge_process_id == proc_job.process_id,
+                    EvaluacionCV.match >= MATCH_SHORTLIST,
+                ),
+            ))
+
+        total, enviados = session.exec(
+            select(func.count(), func.count(EnvioFinalizacion.lote)).where(EnvioFinalizacion.job_id == job_id)
+        ).one()
+        proc_job.total = total
+        proc_job.procesados = enviados
+        proc_job.avance_al_reclamar = enviados
+        session.add(proc_job)
+        session.commit()
+        return proc_job.process_id, total, enviados, proc_job.creado_por
+
+
+def siguiente_lote(job_id: int) -> Tuple[int, List[dict], bool]:
+    """(número de lote, candidatos, es el último) del primer lote sin confirmar."""
+    with Session(engine) as session:
+        ultimo = session.exec(
+            select(func.max(EnvioFinalizacion.lote)).where(EnvioFinalizacion.job_id == job_id)
+        ).one()
+        # uno de más para saber si queda otro lote después de este
+        evaluaciones = session.exec(
+            select(EvaluacionCV)
+            .join(EnvioFinalizacion, EnvioFinalizacion.evaluacion_id == EvaluacionCV.id)  # type: ignore
+            .where(EnvioFinalizacion.job_id == job_id, EnvioFinalizacion.lote == None)  # noqa: E711
+            .order_by(EnvioFinalizacion.evaluacion_id)
+            .limit(FINALIZAR_LOTE + 1)
+        ).all()
+        candidatos = [
+            {
+                "id": e.id,
+                "dni": e.dni_postulante,
+                "match": e.match,
+                "name": e.name,
+                "years_exper": e.years_exper,
+                "level_educa": e.level_educa,
+                "certif": e.certif,
+                "languages": e.languages,
+                "differential_advantages": e.differential_advantages,
+            }
+            for e in evaluaciones[:FINALIZAR_LOTE]
+        ]
+        return (ultimo or 0) + 1, candidatos, len(evaluaciones) <= FINALIZAR_LOTE
+
+
+def confirmar_lote(job_id: int, lote: int, ids: List[int], worker_id: Optional[str] = None) -> int:
+    """
+    Checkpoint: marca el lote como recibido por n8n y suma el avance. Devuelve los enviados.
+    Con worker_id, lanza LeasePerdido (sin marcar nada) si el job ya lo reclamó otro worker.
+    """
+    with Session(engine) as session:
+        # primero el job (con lock): si ya no es nuestro no se toca enviofinalizacion
+        proc_job = job_propio(session, job_id, worker_id)
+        if not proc_job:
+            raise LeasePerdido(f"Job {job_id}: ya no es de {worker_id}")
+        session.exec(  # type: ignore
+            update(EnvioFinalizacion)
+            .where(EnvioFinalizacion.job_id == job_id, EnvioFinalizacion.evaluacion_id.in_(ids))  # type: ignore
+            .values(lote=lote, enviado_en=peru_time())
+        )
+        proc_job.procesados += len(ids)
+        session.add(proc_job)
+        session.commit()
+        return proc_job.procesados
+
+
+def cerrar_proceso(job_id: int, process_id: int, total: int, enviados: int, worker_id: Optional[str] = None):
+    with Session(engine) as session:
+        proc_job = job_propio(session, job_id, worker_id)
+        if not proc_job:
+            raise LeasePerdido(f"Job {job_id}: ya no es de {worker_id}")
+        process = session.get(ChargeProcess, process_id)
+        if process:
+            process.end_process = True
+            session.add(process)
+        if enviados < total:
+            # evaluaciones borradas después de congelar la shortlist
+            proc_job.no_procesados = total - enviados
+            proc_job.detalle = f"{total - enviados} evaluaciones ya no existían al enviarlas"
+            session.add(proc_job)
+        session.commit()
+
+
+async def ejecutar_finalizacion(job_id: int, worker_id: Optional[str] = None):
+    """
+    Ejecuta un job "finalizar". Un error de n8n lanza excepción (el worker reintenta y se
+    sigue desde el último lote confirmado); con el circuit breaker abierto el job se pausa.
+    """
+    process_id, total, enviados, creado_por = await asyncio.to_thread(congelar_shortlist, job_id, worker_id)
+    total_lotes = math.ceil(total / FINALIZAR_LOTE)
+    await asyncio.to_thread(publicar_progreso, process_id, {
+        "tipo": "inicio", "job_id": job_id, "actual": enviados, "total": total, "ok": enviados, "errores": 0,
+    })
+
+    while True:
+        lote, candidatos, ultimo = await asyncio.to_thread(siguiente_lote, job_id)
+        if not candidatos:
+            break
+
+        payload = {
+            "proceso_id": process_id,
+            "evaluaciones": candidatos,
+            "token": create_job_token(creado_por, job_id),
+            "lote": lote,
+            "total_lotes": total_lotes,
+            "ultimo_lote": ultimo,
+            "lote_id": f"{job_id}-{lote}",
+        }
+        try:
+            response = await cliente("matchs").post(json=payload)
+        except CircuitoAbierto as e:
+            raise JobPausado(str(e), e.segundos)
+        if response.is_error:
+            raise RuntimeError(f"n8n respondió {response.status_code} al lote {lote}: {response.text[:200]}")
+
+        enviados = await asyncio.to_thread(
+            confirmar_lote, job_id, lote, [c["id"] for c in candidatos], worker_id
+        )
+        print(f"📤 Proceso {process_id}: lote {lote}/{total_lotes} confirmado ({enviados}/{total})")
+        await asyncio.to_thread(publicar_progreso, process_id, {
+            "tipo": "lote", "job_id": job_id, "lote": lote, "actual": enviados, "total": total,
+            "ok": enviados, "errores": 0,
+        })
+
+    await asyncio.to_thread(cerrar_proceso, job_id, process_id, total, enviados, worker_id)
+    await asyncio.to_thread(publicar_progreso, process_id, {
+        "tipo": "fin", "job_id": job_id, "actual": enviados, "total": total, "ok": enviados, "errores": 0,
+    })
+    return "completado"
@@ -1,21 +1,38 @@
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends
 from models import Postulant, Postulation, ChargeProcess, JobPosition
 from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.orm import Session
-from cargabd import engine, get_session
-import httpx
+from cargabd import engine, get_session, get_async_session
+from clientes_n8n import cliente
 import os
 from typing import Optional
 
 routerform = APIRouter(prefix="/form", tags=["Form"])
 
-N8N_FOLDER_URL = os.getenv("N8N_FOLDER_URL")  # webhook n8n
 MAX_BYTES = 5 * 1024 * 1024
+# límite del cuerpo completo (CV + campos del formulario), aplicado por LimiteTamanoCuerpo en main
+MAX_BODY_APPLY = MAX_BYTES + 64 * 1024
 ALLOWED = {
     "application/pdf",
     "application/msword",
     "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
 }
+# primeros bytes esperados para cada tipo declarado (el content-type lo elige el cliente)
+FIRMAS = {
+    "application/pdf": b"%PDF-",
+    "application/msword": b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1",  # OLE2 (.doc)
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": b"PK\x03\x04",  # zip (.docx)
+}
+
+def tamano_archivo(archivo: UploadFile) -> int:
+    if archivo.size is not None:
+        return archivo.size
+    posicion = archivo.file.tell()
+    archivo.file.seek(0, os.SEEK_END)
+    tamano = archivo.file.tell()
+    archivo.file.seek(posicion)
+    return tamano
 
 @routerform.post("/apply")
 async def apply(
@@ -30,93 +47,90 @@ async def apply(
     drive_folder_id: str = Form(None),
     form_token: Optional[str] = Form(None),  # opcional: se exige si ChargeProcess tiene token
     cv: UploadFile = File(...),
+    session: AsyncSession = Depends(get_async_session),
 ):
-    # 1) validación del archivo (tipo / tamaño)
+    # 1) validación del archivo (tipo / firma / tamaño) sin cargarlo en memoria: Starlette
+    # ya lo dejó en un SpooledTemporaryFile (a disco si es grande) y el tamaño del cuerpo
+    # se cortó mientras llegaba
     if cv.content_type not in ALLOWED:
         raise HTTPException(status_code=400, detail="Formato CV no permitido")
-    contents = await cv.read()
-    if len(contents) > MAX_BYTES:
+    if not (await cv.read(len(FIRMAS[cv.content_type]))).startswith(FIRMAS[cv.content_type]):
+        raise HTTPException(status_code=400, detail="El contenido del CV no corresponde a su formato")
+    if tamano_archivo(cv) > MAX_BYTES:
         raise HTTPException(status_code=400, detail="CV excede tamaño máximo")
+    await cv.seek(0)
 
     # 2) localizar el ChargeProcess (por code preferiblemente, si no por id numérico)
-    with Session(engine) as session:
-        stmt = select(ChargeProcess).where(ChargeProcess.code == process_code)
-        cp_res = session.execute(stmt)
-        cp = cp_res.scalars().first()
+    stmt = select(ChargeProcess).where(ChargeProcess.code == process_code)
+    cp = (await session.exec(stmt)).first()
+
+    if not cp:
+        # intentar por id si el process_code es numérico
+        try:
+            pid = int(process_code)
+            cp = await session.get(ChargeProcess, pid)
+        except Exception:
+            cp = None
+
+    if not cp:
+        raise HTTPException(status_code=404, detail="ChargeProcess no encontrado")
+
+    # Si el ChargeProcess tiene token, exigir que el cliente lo envíe y coincida
+    if getattr(cp, "form_token", None):
+        if not form_token or cp.form_token != form_token:
+            raise HTTPException(status_code=403, detail="Token de formulario inválido o faltante")
+
+    # determinar carpeta: preferir la que está guardada en DB
+    folder_id = cp.drive_folder_id or drive_folder_id
+
+    # 3) crear o actualizar Postulant (PK = dni)
+    postulant = await session.get(Postulant, dni)
+    if not postulant:
+        postulant = Postulant(
+            dni=dni,
+            name=name,
+            email=email,
+            telf=telf,
+            address=address
+        )
+        session.add(postulant)
+    else:
+        # actualizar campos básicos si cambiaron
+        if name and postulant.name != name:
+            postulant.name = name
+        if email and postulant.email != email:
+            postulant.email = email
+        if telf and postulant.telf != telf:
+            postulant.telf = telf
+        if address and postulant.address != address:
+            postulant.address = address
+        session.add(postulant)
+
+    # 4) crear Postulation si no existe (dni + process_id)
+    stmt2 = select(Postulation).where(
+        Postulation.postulant_dni == dni,
+        Postulation.process_id == cp.id
+    )
+    postulation = (await session.exec(stmt2)).first()
+    if not postulation:
+        postulation = Postulation(
+            postulant_dni=dni,
+            process_id=cp.id,
+            status="Pendiente"
+        )
+        session.add(postulation)
 
-        if not cp:
-            # intentar por id si el process_code es numérico
-            try:
-                pid = int(process_code)
-                cp = session.get(ChargeProcess, pid)
-            except Exception:
-                cp = None
+    # un solo commit; la conexión queda libre durante la subida a n8n
+    await session.commit()
 
-        if not cp:
-            raise HTTPException(status_code=404, detail="ChargeProcess no encontrado")
-
-        # Si el ChargeProcess tiene token, exigir que el cliente lo envíe y coincida
-        if getattr(cp, "form_token", None):
-            if not form_token or cp.form_token != form_token:
-                raise HTTPException(status_code=403, detail="Token de formulario inválido o faltante")
-
-        # determinar carpeta: preferir la que está guardada en DB
-        folder_id = cp.drive_folder_id or drive_folder_id
-
-        # 3) crear o actualizar Postulant (PK = dni)
-        postulant = session.get(Postulant, dni)
-        if not postulant:
-            postulant = Postulant(
-                dni=dni,
-                name=name,
-                email=email,
-                telf=telf,
-                address=address
-            )
-            session.add(postulant)
-            session.commit()
-            session.refresh(postulant)
-        else:
-            # actualizar campos básicos si cambiaron
-            updated = False
-            if name and postulant.name != name:
-                postulant.name = name; updated = True
-            if email and postulant.email != email:
-                postulant.email = email; updated = True
-            if telf and postulant.telf != telf:
-                postulant.telf = telf; updated = True
-            if address and postulant.address != address:
-                postulant.address = address; updated = True
-            if updated:
-                session.add(postulant)
-                session.commit()
-                session.refresh(postulant)
-
-        # 4) crear Postulation si no existe (dni + process_id)
-        stmt2 = select(Postulation).where(
-            Postulation.postulant_dni == dni,
-            Postulation.process_id == cp.id
-        )
-        res2 = session.execute(stmt2)
-        postulation = res2.scalars().first()
-        if not postulation:
-            postulation = Postulation(
-                postulant_dni=dni,
-                process_id=cp.id,
-                status="Pendiente"
-            )
-            session.add(postulation)
-            session.commit()
-            session.refresh(postulation)
-
-        # Guardar ids y folder antes de cerrar la sesión
-        saved_postulant_dni = postulant.dni
-        saved_postulation_id = postulation.id
-        saved_cp_id = cp.id
-        saved_folder_id = folder_id
-
-    # 5) Subir el archivo a n8n (fuera del contexto DB)
-    files = {"file": (cv.filename, contents, cv.content_type)}
+    # Guardar ids y folder (expire_on_commit=False: siguen cargados)
+    saved_postulant_dni = postulant.dni
+    saved_postulation_id = postulation.id
+    saved_folder_id = folder_id
+
+    # 5) Subir el archivo a n8n (sin transacción abierta)
+    # httpx envía el archivo por partes desde el spool (no se copia entero a memoria)
+    files = {"file": (cv.filename, cv.file, cv.content_type)}
     data = {
         "drive_folder_id": saved_folder_id,
         "process_code": process_code,
@@ -125,29 +139,22 @@ async def apply(
     }
 
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(N8N_FOLDER_URL, data=data, files=files, timeout=120.0)
-            #if isinstance(resp_json, list) and len(resp_json) > 0:
-            #    resp_json = resp_json[0]
-            print("DEBUG RESP STATUS:", resp.status_code)
-            print("DEBUG RESP CONTENT:", resp.text)
+        resp = await cliente("formulario").post(data=data, files=files)
+        #if isinstance(resp_json, list) and len(resp_json) > 0:
+        #    resp_json = resp_json[0]
+        print("DEBUG RESP STATUS:", resp.status_code)
+        print("DEBUG RESP CONTENT:", resp.text)
     except Exception as e:
         # marcar error en postulation y devolver 502
-        with Session(engine) as session:
-            p = session.get(Postulation, saved_postulation_id)
-            if p:
-                p.status = "ErrorUpload"
-                session.add(p)
-                session.commit()
+        postulation.status = "ErrorUpload"
+        session.add(postulation)
+        await session.commit()
         raise HTTPException(status_code=502, detail=f"Error al conectar con n8n: {e}")
 
     if resp.status_code != 200:
-        with Session(engine) as session:
-            p = session.get(Postulation, saved_postulation_id)
-            if p:
-                p.status = "ErrorUpload"
-                session.add(p)
-                session.commit()
+        postulation.status = "ErrorUpload"
+        session.add(postulation)
+        await session.commit()
         raise HTTPException(status_code=502, detail="Error al subir CV a storage")
 
     resp_json = resp.json()
@@ -155,19 +162,14 @@ async def apply(
     file_id = resp_json.get("file_id")
 
     # 6) actualizar Postulant y Postulation con resultados de la subida
-    with Session(engine) as session:
-        p = session.get(Postulant, saved_postulant_dni)
-        if p:
-            p.cv_url = file_url
-            p.cv_drive_file_id = file_id
-            session.add(p)
-
-        post = session.get(Postulation, saved_postulation_id)
-        if post:
-            post.status = "Recibido"
-            session.add(post)
-
-        session.commit()
+    postulant.cv_url = file_url
+    postulant.cv_drive_file_id = file_id
+    session.add(postulant)
+
+    postulation.status = "Recibido"
+    session.add(postulation)
+
+    await session.commit()
 
     return {
         "detail": "Postulación registrada",
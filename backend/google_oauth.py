@@ -1,15 +1,23 @@
 # google_oauth.py
 import os
 import json
+import time
+import fcntl
+import asyncio
+import threading
+import tempfile
+from datetime import datetime, timedelta
 from fastapi import APIRouter, Request, HTTPException
 from fastapi.responses import RedirectResponse, JSONResponse
 from google_auth_oauthlib.flow import Flow
 from google.auth.transport.requests import Request as GoogleRequest
 from google.oauth2.credentials import Credentials
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 from googleapiclient.errors import HttpError
 from google.auth.exceptions import RefreshError
+from metricas import incrementar, observar
 
 routergoogle = APIRouter(prefix="/google", tags=["Google OAuth"])
 
@@ -21,6 +29,15 @@ SCOPES = ["https://www.googleapis.com/auth/drive.readonly"]
 # archivo local para persistir tokens (mejor: guarda en DB/vault)
 TOKEN_FILE = os.environ.get("GOOGLE_TOKEN_FILE", "/app/credentials/google_tokens.json")
 SERVICE_ACCOUNT_FILE = os.environ.get("GOOGLE_SERVICE_ACCOUNT_FILE")  # opcional
+DRIVE_REFRESH_MARGEN_SEG = int(os.environ.get("DRIVE_REFRESH_MARGEN_SEG", "300"))  # refrescar antes de que venza
+
+# Cliente de Drive compartido por el proceso: credenciales y discovery doc se cargan una vez.
+# El service de googleapiclient usa httplib2 (no thread-safe), así que hay uno por hilo.
+_drive_lock = threading.RLock()
+_drive_creds = None
+_drive_generacion = 0  # cambia cuando se reemplazan las credenciales (re-autorización)
+_drive_doc = None
+_drive_local = threading.local()
 
 def get_flow() -> Flow:
     if not CLIENT_ID or not CLIENT_SECRET:
@@ -70,11 +87,10 @@ def auth_google_callback(request: Request, code: str = None, state: str = None):
 
     # Persistir tokens (puedes sustituir por DB)
     try:
-        os.makedirs(os.path.dirname(TOKEN_FILE), exist_ok=True)
-        with open(TOKEN_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f)
+        _guardar_tokens(data)
     except Exception as e:
         return JSONResponse({"status": "error", "msg": "No se pudo guardar token", "error": str(e)}, status_code=500)
+    _reiniciar_cliente_drive()
 
     return JSONResponse({"status": "ok", "saved_to": TOKEN_FILE, "google": data})
 
@@ -87,19 +103,65 @@ def _read_saved_tokens():
     except Exception:
         return None
 
-def get_drive_service():
+_bloqueo_local = threading.local()
+
+
+class _BloqueoTokens:
     """
-    Crea y devuelve el servicio de Drive. Soporta:
-      - tokens guardados por /google/callback (refresh token)
-      - o service account via GOOGLE_SERVICE_ACCOUNT_FILE
-    Lanzará excepciones claras si no hay credenciales válidas.
+    Lock de archivo (entre procesos: API y worker) para leer/refrescar/escribir los tokens.
+    Reentrante en el mismo hilo: _refrescar guarda con _guardar_tokens teniendo el lock
+    (flock es por descriptor, un segundo open+flock del mismo hilo se bloquearía).
     """
+
+    def __enter__(self):
+        nivel = getattr(_bloqueo_local, "nivel", 0)
+        if nivel == 0:
+            os.makedirs(os.path.dirname(TOKEN_FILE) or ".", exist_ok=True)
+            _bloqueo_local.f = open(f"{TOKEN_FILE}.lock", "w")
+            fcntl.flock(_bloqueo_local.f, fcntl.LOCK_EX)
+        _bloqueo_local.nivel = nivel + 1
+        return self
+
+    def __exit__(self, *exc):
+        _bloqueo_local.nivel -= 1
+        if _bloqueo_local.nivel == 0:
+            fcntl.flock(_bloqueo_local.f, fcntl.LOCK_UN)
+            _bloqueo_local.f.close()
+
+
+def _guardar_tokens(data: dict):
+    """Escritura atómica (archivo temporal + fsync + rename) bajo el lock de archivo."""
+    with _BloqueoTokens():
+        directorio = os.path.dirname(TOKEN_FILE) or "."
+        fd, tmp = tempfile.mkstemp(dir=directorio, prefix=".google_tokens.")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, TOKEN_FILE)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+
+def _parse_expiry(valor):
+    if not valor:
+        return None
+    try:
+        # google-auth trabaja con datetimes naive en UTC
+        return datetime.fromisoformat(valor).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def _cargar_credenciales():
     # 1) Service account fallback (recomendado si lo puedes usar)
     if SERVICE_ACCOUNT_FILE and os.path.exists(SERVICE_ACCOUNT_FILE):
-        creds = service_account.Credentials.from_service_account_file(
+        return service_account.Credentials.from_service_account_file(
             SERVICE_ACCOUNT_FILE, scopes=SCOPES
         )
-        return build("drive", "v3", credentials=creds)
 
     # 2) Leer token guardado
     data = _read_saved_tokens()
@@ -114,31 +176,131 @@ def get_drive_service():
         client_secret=data.get("client_secret") or CLIENT_SECRET,
         scopes=data.get("scopes", SCOPES)
     )
+    creds.expiry = _parse_expiry(data.get("expiry"))
+    return creds
+
+
+def _por_vencer(creds) -> bool:
+    if not creds.token or creds.expiry is None:
+        return not creds.valid
+    return creds.expiry - datetime.utcnow() < timedelta(seconds=DRIVE_REFRESH_MARGEN_SEG)
+
+
+def _refrescar(creds):
+    """
+    Refresca las credenciales (con _drive_lock tomado). Bajo el lock de archivo se relee
+    el token: si otro proceso ya lo refrescó, se usa ese en lugar de pedir uno nuevo.
+    """
+    if isinstance(creds, service_account.Credentials):
+        creds.refresh(GoogleRequest())
+        incrementar("drive_refresh_total")
+        return
+
+    with _BloqueoTokens():
+        data = _read_saved_tokens() or {}
+        expiry = _parse_expiry(data.get("expiry"))
+        if data.get("access_token") and expiry and expiry - datetime.utcnow() > timedelta(seconds=DRIVE_REFRESH_MARGEN_SEG):
+            creds.token = data["access_token"]
+            creds.expiry = expiry
+            return
+
+        if not creds.refresh_token:
+            # no se puede refrescar
+            raise RuntimeError("Credenciales inválidas o sin refresh_token. Reautoriza en /google/auth")
+        try:
+            creds.refresh(GoogleRequest())
+        except RefreshError as e:
+            # token revocado o inválido
+            incrementar("drive_refresh_errores")
+            raise RuntimeError(f"RefreshError al refrescar credenciales: {e}")
+        except HttpError as e:
+            incrementar("drive_refresh_errores")
+            raise RuntimeError(f"HttpError durante refresh de credenciales: {e}")
+        incrementar("drive_refresh_total")
+
+        # actualizar archivo con nuevo access_token + expiry (no bloqueante si falla)
+        try:
+            data.update({
+                "access_token": creds.token,
+                "expiry": creds.expiry.isoformat() if creds.expiry else None,
+            })
+            _guardar_tokens(data)
+        except Exception:
+            # seguimos con las credenciales refrescadas en memoria
+            pass
+
+
+def obtener_credenciales_drive():
+    """Credenciales compartidas del proceso, refrescadas si están por vencer."""
+    global _drive_creds, _drive_generacion
+    with _drive_lock:
+        if _drive_creds is None:
+            _drive_creds = _cargar_credenciales()
+            _drive_generacion += 1
+        if _por_vencer(_drive_creds):
+            _refrescar(_drive_creds)
+        return _drive_creds
 
-    # refrescar si está expirado y hay refresh_token
+
+def _reiniciar_cliente_drive():
+    """Descarta credenciales y services cacheados (p.ej. tras re-autorizar en /google/callback)."""
+    global _drive_creds, _drive_generacion
+    with _drive_lock:
+        _drive_creds = None
+        _drive_generacion += 1
+
+
+def get_drive_service():
+    """
+    Devuelve el servicio de Drive del hilo actual. Soporta:
+      - tokens guardados por /google/callback (refresh token)
+      - o service account via GOOGLE_SERVICE_ACCOUNT_FILE
+    Las credenciales y el discovery doc (el que viene en la librería) se cargan una sola vez;
+    el service se construye una vez por hilo.
+    Lanzará excepciones claras si no hay credenciales válidas.
+    """
+    global _drive_doc
+    creds = obtener_credenciales_drive()
+
+    if getattr(_drive_local, "generacion", None) != _drive_generacion:
+        with _drive_lock:
+            if _drive_doc is None:
+                _drive_doc = json.loads(get_static_doc("drive", "v3"))
+            generacion = _drive_generacion
+        _drive_local.service = build_from_document(_drive_doc, credentials=creds)
+        _drive_local.generacion = generacion
+    return _drive_local.service
+
+
+def ejecutar_drive(request, operacion: str):
+    """Ejecuta un request de la API de Drive registrando su latencia."""
+    inicio = time.perf_counter()
     try:
-        if not creds.valid:
-            if creds.expired and creds.refresh_token:
-                creds.refresh(GoogleRequest())
-                # actualizar archivo con nuevo access_token + expiry
-                try:
-                    data["access_token"] = creds.token
-                    data["expiry"] = creds.expiry.isoformat() if creds.expiry else None
-                    with open(TOKEN_FILE, "w", encoding="utf-8") as f:
-                        json.dump(data, f)
-                except Exception:
-                    # no bloqueante: seguimos con las credenciales refrescadas en memoria
-                    pass
-            else:
-                # no se puede refrescar
-                raise RuntimeError("Credenciales inválidas o sin refresh_token. Reautoriza en /google/auth")
-    except RefreshError as e:
-        # token revocado o inválido
-        raise RuntimeError(f"RefreshError al refrescar credenciales: {e}")
-    except HttpError as e:
-        raise RuntimeError(f"HttpError durante refresh de credenciales: {e}")
+        return request.execute()
+    except Exception:
+        incrementar(f"drive_api_errores.{operacion}")
+        raise
+    finally:
+        observar(f"drive_api.{operacion}", time.perf_counter() - inicio)
+
 
-    return build("drive", "v3", credentials=creds)
+async def refrescar_drive_periodicamente():
+    """
+    Tarea de fondo: refresca el token antes de que venza para que ninguna llamada
+    a Drive pague el refresh (ni compita por hacerlo).
+    """
+    while True:
+        espera = 60.0
+        try:
+            creds = await asyncio.to_thread(obtener_credenciales_drive)
+            if creds.expiry is not None:
+                restante = (creds.expiry - datetime.utcnow()).total_seconds() - DRIVE_REFRESH_MARGEN_SEG
+                espera = max(restante + 1, 5.0)
+        except Exception as e:
+            # sin tokens todavía o refresh fallido: reintentar más tarde
+            print("Drive: no se pudo refrescar credenciales:", e)
+            espera = 300.0
+        await asyncio.sleep(espera)
 
 @routergoogle.get("/drive/files")
 def listar_archivos():
@@ -148,10 +310,10 @@ def listar_archivos():
         return JSONResponse({"error": str(e)}, status_code=500)
 
     try:
-        results = service.files().list(
+        results = ejecutar_drive(service.files().list(
             pageSize=10,
             fields="files(id, name, mimeType)"
-        ).execute()
+        ), "files.list")
         return results.get("files", [])
     except HttpError as e:
         return JSONResponse({"error": "Google API error", "detail": str(e)}, status_code=500)
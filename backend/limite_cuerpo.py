@@ -0,0 +1,64 @@
+# limite_cuerpo.py
+# Middleware ASGI que corta los cuerpos demasiado grandes mientras llegan, antes de que
+# el parser multipart los termine de leer. Rechaza de entrada por Content-Length y, si no
+# viene (chunked), cuenta los bytes trozo a trozo y responde 413 al pasar el límite.
+from typing import Dict
+from fastapi import HTTPException
+
+
+class CuerpoDemasiadoGrande(HTTPException):
+    def __init__(self, limite: int):
+        super().__init__(status_code=413, detail=f"El cuerpo de la solicitud excede {limite // 1024} KB")
+
+
+class LimiteTamanoCuerpo:
+    """
+    `limites`: prefijo de ruta -> bytes máximos del cuerpo. Las rutas sin límite pasan tal cual.
+    El 413 por conteo se lanza desde `receive`, dentro del parseo del formulario, y lo
+    convierte en respuesta el manejador de HTTPException de FastAPI.
+    """
+
+    def __init__(self, app, limites: Dict[str, int]):
+        self.app = app
+        self.limites = limites
+
+    def _limite(self, path: str):
+        for prefijo, limite in self.limites.items():
+            if path.startswith(prefijo):
+                return limite
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            return await self.app(scope, receive, send)
+        limite = self._limite(scope["path"])
+        if limite is None:
+            return await self.app(scope, receive, send)
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limite:
+            await _responder_413(send, limite)
+            return
+
+        recibidos = 0
+
+        async def receive_contado():
+            nonlocal recibidos
+            mensaje = await receive()
+            if mensaje["type"] == "http.request":
+                recibidos += len(mensaje.get("body", b""))
+                if recibidos > limite:
+                    raise CuerpoDemasiadoGrande(limite)
+            return mensaje
+
+        await self.app(scope, receive_contado, send)
+
+
+async def _responder_413(send, limite: int):
+    cuerpo = ('{"detail":"El cuerpo de la solicitud excede %d KB"}' % (limite // 1024)).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 413,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(cuerpo)).encode())],
+    })
+    await send({"type": "http.response.body", "body": cuerpo})
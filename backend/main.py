@@ -1,6 +1,7 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from cargabd import create_db_and_tables
+from cargabd import create_db_and_tables, async_engine
 from puestos import routerpuestos as puestos_router
 from evaluacioncv import routercv as cv_router
 from mantenimiento import routermt as mantenimiento_router
@@ -8,10 +9,14 @@ from auth import routerauth as auth_router
 from usuarios import routeruser as user_router
 from procesos import routerprocess as process_router
 from postulantes import routerpostulant as postulant_router
-from form import routerform as form_router
+from form import routerform as form_router, MAX_BODY_APPLY
 from areas import areasouter as areas_router
 from ia_dataset import routerdataset
-from google_oauth import routergoogle as google_oauth_router
+from google_oauth import routergoogle as google_oauth_router, refrescar_drive_periodicamente
+from clientes_n8n import iniciar_clientes, cerrar_clientes
+from notificaciones import escucha
+from limite_cuerpo import LimiteTamanoCuerpo
+from extraccion_cv import cerrar_pool
 
 app = FastAPI()
 
@@ -27,6 +32,9 @@ origins = [
     #"ws://localhost:8000"
 ]
 
+# corta uploads demasiado grandes mientras llegan (antes de CORS para que el 413 lleve sus headers)
+app.add_middleware(LimiteTamanoCuerpo, limites={"/form/apply": MAX_BODY_APPLY})
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,  # ⚠️ importante
@@ -36,8 +44,22 @@ app.add_middleware(
 )
 
 @app.on_event("startup")
-def on_startup():
+async def on_startup():
     create_db_and_tables()
+    iniciar_clientes()
+    # eventos de progreso publicados por el worker (LISTEN/NOTIFY)
+    await escucha.iniciar()
+    # mantiene el token de Drive vigente sin que lo refresque una request
+    app.state.tarea_drive = asyncio.create_task(refrescar_drive_periodicamente())
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    app.state.tarea_drive.cancel()
+    await cerrar_clientes()
+    await escucha.detener()
+    cerrar_pool()
+    if async_engine is not None:
+        await async_engine.dispose()
 
 @app.get("/health")
 def health_check():
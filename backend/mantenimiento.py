@@ -2,7 +2,13 @@ from fastapi import APIRouter, HTTPException, Depends
 from sqlmodel import Session
 from models import JobPosition
 from cargabd import engine
-from auth import get_current_user
+from auth import get_current_user, require_admin
+from metricas import snapshot
 
 routermt = APIRouter()
 
+
+@routermt.get("/metricas", dependencies=[Depends(require_admin)])
+def ver_metricas():
+    """Contadores y latencias en memoria de este proceso (Drive, n8n, caches...)."""
+    return snapshot()
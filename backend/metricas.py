@@ -0,0 +1,54 @@
+# metricas.py
+# Métricas simples en memoria (por proceso): contadores, latencias y fuentes
+# que se leen al momento de consultar. Se exponen en GET /metricas (mantenimiento.py).
+import threading
+from collections import defaultdict
+from typing import Callable, Dict
+
+_lock = threading.Lock()
+_contadores: Dict[str, float] = defaultdict(float)
+_latencias: Dict[str, dict] = {}
+_fuentes: Dict[str, Callable[[], dict]] = {}
+
+
+def incrementar(nombre: str, valor: float = 1):
+    with _lock:
+        _contadores[nombre] += valor
+
+
+def observar(nombre: str, segundos: float):
+    """Registra una latencia (cantidad, promedio y máximo en ms)."""
+    with _lock:
+        lat = _latencias.setdefault(nombre, {"cantidad": 0, "total_ms": 0.0, "max_ms": 0.0})
+        ms = segundos * 1000
+        lat["cantidad"] += 1
+        lat["total_ms"] += ms
+        lat["max_ms"] = max(lat["max_ms"], ms)
+
+
+def registrar_fuente(nombre: str, fn: Callable[[], dict]):
+    """Fuente de métricas calculadas al consultar (estado de pools, breakers, caches...)."""
+    with _lock:
+        _fuentes[nombre] = fn
+
+
+def snapshot() -> dict:
+    with _lock:
+        contadores = dict(_contadores)
+        latencias = {
+            k: {
+                "cantidad": v["cantidad"],
+                "promedio_ms": round(v["total_ms"] / v["cantidad"], 2) if v["cantidad"] else 0.0,
+                "max_ms": round(v["max_ms"], 2),
+            }
+            for k, v in _latencias.items()
+        }
+        fuentes = dict(_fuentes)
+
+    resultado = {"contadores": contadores, "latencias": latencias}
+    for nombre, fn in fuentes.items():
+        try:
+            resultado[nombre] = fn()
+        except Exception as e:
+            resultado[nombre] = {"error": str(e)}
+    return resultado
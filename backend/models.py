@@ -4,7 +4,7 @@ from uuid import UUID
 from sqlalchemy.dialects.postgresql import JSONB , UUID as pgUUID
 from datetime import datetime, timezone, timedelta
 from pydantic import BaseModel
-from sqlalchemy import DateTime
+from sqlalchemy import DateTime, UniqueConstraint, Index, text
 from functools import partial
 
 peru_time = partial(datetime.now, timezone(timedelta(hours=-5)))
@@ -18,6 +18,22 @@ class User(SQLModel, table=True):
 
 
 class EvaluacionCV(SQLModel, table=True):
+    # índices de las consultas calientes (migraciones "indices compuestos evaluacioncv" y
+    # "indices ranking evaluacioncv");
+    # verificar con: python verificar_indices.py
+    __table_args__ = (
+        # ranking del proceso por match (keyset match DESC, id DESC) y finalizar (match >= 80)
+        Index("ix_evaluacioncv_ranking_match", "charge_process_id", "match", "id"),
+        # ranking por match_total (el match IA mientras no haya evaluación experta); ver ranking.py
+        Index("ix_evaluacioncv_ranking_total", "charge_process_id", text("coalesce(match_total, match)"), "id"),
+        # historial del postulante y actualizar match (dni + proceso)
+        Index("ix_evaluacioncv_dni_proceso", "dni_postulante", "charge_process_id"),
+        # historial general: ORDER BY date_create DESC, id DESC y cursor keyset
+        Index("ix_evaluacioncv_fecha_id", "date_create", "id"),
+        # CVs de un proceso / URLs ya evaluadas (index-only scan); reemplaza al índice
+        # simple de charge_process_id, que es su prefijo
+        Index("ix_evaluacioncv_proceso_url", "charge_process_id", "url_cv"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str
     match: float
@@ -29,7 +45,7 @@ class EvaluacionCV(SQLModel, table=True):
     summary: str
     puesto_id: int
     dni_postulante: Optional[str] = Field(default=None, foreign_key="postulant.dni", nullable=True)
-    charge_process_id: Optional[int] = Field(default=None, foreign_key="chargeprocess.id", index=True, nullable=True)
+    charge_process_id: Optional[int] = Field(default=None, foreign_key="chargeprocess.id", nullable=True)  # índice: ix_evaluacioncv_proceso_url
     date_create: datetime = Field(default_factory=peru_time)
     postulation_id: Optional[int] = Field(default=None, foreign_key="postulation.id", index=True, nullable=True)
 
@@ -144,11 +160,164 @@ class ChargeProcess(SQLModel, table=True):
     
     postulations: List["Postulation"] = Relationship(back_populates="process")
 
+class ProcesamientoJob(SQLModel, table=True):
+    """
+    Cola de trabajos en segundo plano (procesar CVs de un proceso, etc.).
+    La reclama un worker con FOR UPDATE SKIP LOCKED y se checkpointea por archivo.
+    """
+    __table_args__ = (
+        # a lo más un job activo por proceso y tipo (dos "procesar" a la vez no duplican el trabajo)
+        Index(
+            "ux_procesamientojob_activo", "process_id", "tipo", unique=True,
+            postgresql_where=text("estado IN ('pendiente', 'en_proceso')"),
+        ),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    tipo: str = Field(default="procesar_cvs", index=True)
+    process_id: int = Field(foreign_key="chargeprocess.id", index=True)
+    estado: str = Field(default="pendiente", index=True)  # pendiente, en_proceso, completado, fallido
+    creado_por: Optional[str] = None  # username: a n8n va un token de job a su nombre (auth.create_job_token)
+
+    # avance (checkpoint por archivo)
+    total: int = Field(default=0)
+    procesados: int = Field(default=0)
+    no_procesados: int = Field(default=0)
+    errores: Optional[List[Dict[str, Any]]] = Field(default=None, sa_column=Column(JSONB))
+    detalle: Optional[str] = None
+
+    # control de reclamo / reintentos
+    intentos: int = Field(default=0)
+    worker_id: Optional[str] = None
+    heartbeat: Optional[datetime] = Field(default=None, sa_column=Column(DateTime(timezone=True)))
+    disponible_desde: Optional[datetime] = Field(default=None, sa_column=Column(DateTime(timezone=True)))
+    reclamado_en: Optional[datetime] = Field(default=None, sa_column=Column(DateTime(timezone=True)))
+    avance_al_reclamar: int = Field(default=0)  # para estimar ETA del intento actual
+
+    fecha_creacion: datetime = Field(default_factory=peru_time, sa_column=Column(DateTime(timezone=True)))
+    fecha_inicio: Optional[datetime] = Field(default=None, sa_column=Column(DateTime(timezone=True)))
+    fecha_fin: Optional[datetime] = Field(default=None, sa_column=Column(DateTime(timezone=True)))
+
+class EnvioFinalizacion(SQLModel, table=True):
+    """
+    Shortlist de un job "finalizar" (match >= 80 al empezar) y el lote de n8n que confirmó a
+    cada candidato. Los que tienen lote NULL faltan enviar: un reintento sigue desde ahí.
+    """
+    __table_args__ = (
+        Index("ix_enviofinalizacion_pendiente", "job_id", "evaluacion_id", postgresql_where=text("lote IS NULL")),
+    )
+    job_id: int = Field(foreign_key="procesamientojob.id", primary_key=True)
+    evaluacion_id: int = Field(primary_key=True)  # sin FK: borrar una evaluación no debe fallar por esto
+    lote: Optional[int] = None
+    enviado_en: Optional[datetime] = Field(default=None, sa_column=Column(DateTime(timezone=True)))
+
+class SolicitudN8N(SQLModel, table=True):
+    """CV enviado a n8n en modo callback (ver callback_n8n.py); el id es el correlation_id."""
+    __table_args__ = (
+        Index("ix_solicitudn8n_job_estado", "job_id", "estado"),
+        Index("ix_solicitudn8n_vence_en", "vence_en", postgresql_where=text("estado = 'enviado'")),
+    )
+    id: str = Field(primary_key=True)
+    job_id: int = Field(foreign_key="procesamientojob.id")
+    process_id: int = Field(foreign_key="chargeprocess.id")
+    drive_file_id: Optional[str] = None
+    payload: Dict[str, Any] = Field(sa_column=Column(JSONB))  # lo enviado, sin el token
+    # clave de cache_evaluaciones del archivo (para guardar el resultado al llegar)
+    clave_cache: Optional[str] = None
+    contenido_hash: Optional[str] = None
+    contexto_hash: Optional[str] = None
+    estado: str = Field(default="enviado")  # enviado, completado, error, vencido, cancelado
+    error: Optional[str] = None
+    enviado_en: datetime = Field(default_factory=peru_time, sa_column=Column(DateTime(timezone=True)))
+    vence_en: datetime = Field(sa_column=Column(DateTime(timezone=True)))
+    respondido_en: Optional[datetime] = Field(default=None, sa_column=Column(DateTime(timezone=True)))
+
+class DriveSyncEstado(SQLModel, table=True):
+    """Estado de sincronización incremental de la carpeta de Drive de un proceso."""
+    process_id: int = Field(foreign_key="chargeprocess.id", primary_key=True)
+    folder_id: Optional[str] = None
+    page_token: Optional[str] = None  # token de changes.list de Drive
+    ultima_sync: Optional[datetime] = Field(default=None, sa_column=Column(DateTime(timezone=True)))
+
+class DriveArchivo(SQLModel, table=True):
+    """Archivos conocidos de la carpeta de un proceso (para enviar a n8n solo lo nuevo o cambiado)."""
+    __table_args__ = (
+        UniqueConstraint("process_id", "drive_file_id", name="uq_drivearchivo_proceso_archivo"),
+        Index("ix_drivearchivo_proceso_pendiente", "process_id", "pendiente"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    process_id: int = Field(foreign_key="chargeprocess.id")
+    drive_file_id: str
+    nombre: Optional[str] = None
+    web_view_link: Optional[str] = None
+    md5_checksum: Optional[str] = None
+    size: Optional[int] = None
+    modified_time: Optional[str] = None
+    pendiente: bool = Field(default=True, nullable=False)  # falta evaluarlo (nuevo o cambió su contenido)
+    eliminado: bool = Field(default=False, nullable=False)
+
+class CacheEvaluacion(SQLModel, table=True):
+    """Resultado de n8n por (contenido del CV, requisitos del proceso, versión del flujo)."""
+    __table_args__ = (
+        Index("ix_cacheevaluacion_ultimo_uso", "ultimo_uso"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    clave: str = Field(unique=True)  # sha256(contenido_hash, contexto_hash, flow_version)
+    contenido_hash: str              # md5Checksum de Drive
+    contexto_hash: str               # sha256 de puesto + reque + functions
+    flow_version: str
+    resultado: Dict[str, Any] = Field(sa_column=Column(JSONB, nullable=False))
+    hits: int = Field(default=0, nullable=False)
+    fecha_creacion: datetime = Field(default_factory=peru_time, sa_column=Column(DateTime(timezone=True), nullable=False))
+    ultimo_uso: datetime = Field(default_factory=peru_time, sa_column=Column(DateTime(timezone=True), nullable=False))
+
+class TextoCV(SQLModel, table=True):
+    """Texto extraído localmente de un CV (PDF/DOCX) por sha256 del contenido; ver extraccion_cv.py."""
+    __table_args__ = (
+        Index("ix_textocv_ultimo_uso", "ultimo_uso"),
+    )
+    contenido_hash: str = Field(primary_key=True)
+    version: str                        # EXTRACTOR_VERSION: subirla invalida lo extraído
+    formato: str                        # pdf | docx
+    paginas: int = Field(default=0)
+    texto: str = Field(default="")      # vacío si no tiene capa de texto (escaneado): va el archivo
+    fecha_creacion: datetime = Field(default_factory=peru_time, sa_column=Column(DateTime(timezone=True)))
+    ultimo_uso: datetime = Field(default_factory=peru_time, sa_column=Column(DateTime(timezone=True)))
+
+class EstadisticaProceso(SQLModel, table=True):
+    """
+    Rollup de EvaluacionCV por proceso: un contador por (dimensión, valor), p.ej.
+    ("match", "70") o ("cv_estado", "leído"). Lo mantiene estadisticas.py con deltas.
+    """
+    process_id: int = Field(foreign_key="chargeprocess.id", primary_key=True)
+    dimension: str = Field(primary_key=True)
+    valor: str = Field(default="", primary_key=True)
+    cantidad: int = Field(default=0, nullable=False)
+    suma: float = Field(default=0, nullable=False)  # para promedios (years_exper, match_total)
+
 class ChargeProcessCreate(BaseModel):
     job_id: int  # Puesto seleccionado desde el frontend
     reque: str
     functions: str
 
+class ProcesoListado(BaseModel):
+    """Fila de /procesos/listar (solo las columnas que muestra el listado)."""
+    id: int
+    code: str
+    create_date: datetime
+    state: bool
+    end_process: bool
+    puesto: Optional[str] = None
+    area: Optional[str] = None
+    reque: str
+    functions: str
+    autor: Optional[str] = None  # solo para admin
+    drive_folder_url: Optional[str] = None
+
+class ProcesosPaginados(BaseModel):
+    total: Optional[int] = None
+    modo_total: str
+    items: List[ProcesoListado]
+
 class PostulantHistory(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     postulant_id: Optional[str] = Field(foreign_key="postulant.dni")
@@ -0,0 +1,126 @@
+# notificaciones.py
+# Pub/sub entre procesos con LISTEN/NOTIFY de Postgres: el worker (o cualquier worker
+# de uvicorn) publica y cada proceso del API recibe por una sola conexión dedicada,
+# leída desde el event loop con loop.add_reader (sin hilos ni polling).
+import json
+import asyncio
+from typing import Callable, Dict, Set
+from sqlalchemy import text
+from cargabd import engine
+
+NOTIFY_MAX_BYTES = 7900  # Postgres limita el payload de NOTIFY a 8000 bytes
+
+
+def es_postgres() -> bool:
+    return engine.dialect.name == "postgresql"
+
+
+def publicar(canal: str, mensaje: dict):
+    """Publica un mensaje JSON en el canal (bloqueante: desde async usar asyncio.to_thread)."""
+    payload = json.dumps(mensaje, default=str)
+    if len(payload.encode("utf-8")) > NOTIFY_MAX_BYTES:
+        raise ValueError(f"Mensaje demasiado grande para NOTIFY en '{canal}'")
+
+    if not es_postgres():
+        # sin Postgres solo se puede repartir dentro del mismo proceso
+        if escucha.loop is not None:
+            escucha.loop.call_soon_threadsafe(escucha.despachar, canal, payload)
+        return
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_notify(:canal, :payload)"), {"canal": canal, "payload": payload})
+        conn.commit()
+
+
+class Escucha:
+    """
+    Conexión LISTEN del proceso. Los callbacks se ejecutan en el event loop con el
+    mensaje ya decodificado; deben ser rápidos (p.ej. encolar y volver).
+    """
+
+    def __init__(self):
+        self.callbacks: Dict[str, Set[Callable[[dict], None]]] = {}
+        self.conn = None
+        self.fd = None  # fileno() falla si psycopg2 ya marcó la conexión como cerrada
+        self.loop = None
+
+    def suscribir(self, canal: str, callback: Callable[[dict], None]):
+        nuevo = canal not in self.callbacks
+        self.callbacks.setdefault(canal, set()).add(callback)
+        if nuevo and self.conn is not None:
+            self._listen(canal)
+
+    def desuscribir(self, canal: str, callback: Callable[[dict], None]):
+        self.callbacks.get(canal, set()).discard(callback)
+
+    async def iniciar(self):
+        self.loop = asyncio.get_running_loop()
+        if not es_postgres() or self.conn is not None:
+            return
+        # el connect de psycopg2 es bloqueante: con la BD lenta o caída no debe frenar el loop
+        conn = await asyncio.to_thread(self._conectar)
+        if self.conn is not None:
+            conn.close()  # otro iniciar() conectó mientras se esperaba
+            return
+        self.conn = conn
+        self.conn.autocommit = True
+        for canal in self.callbacks:
+            self._listen(canal)
+        self.fd = self.conn.fileno()
+        self.loop.add_reader(self.fd, self._leer)
+        print("📡 LISTEN/NOTIFY iniciado")
+
+    @staticmethod
+    def _conectar():
+        raw = engine.raw_connection()
+        conn = raw.driver_connection
+        raw.detach()  # conexión propia: no vuelve al pool
+        return conn
+
+    async def detener(self):
+        if self.conn is None:
+            return
+        self.loop.remove_reader(self.fd)
+        self.conn.close()
+        self.conn = None
+
+    def _listen(self, canal: str):
+        with self.conn.cursor() as cur:
+            cur.execute(f'LISTEN "{canal}"')
+
+    def _leer(self):
+        try:
+            self.conn.poll()
+        except Exception as e:
+            # conexión caída: reconectar sin bloquear el loop
+            print("⚠️ LISTEN/NOTIFY desconectado:", e)
+            self.loop.remove_reader(self.fd)
+            # la conexión rota está fuera del pool (detach): si no se cierra acá, queda abierta
+            self.conn.close()
+            self.conn = None
+            self.loop.create_task(self._reconectar())
+            return
+        while self.conn.notifies:
+            n = self.conn.notifies.pop(0)
+            self.despachar(n.channel, n.payload)
+
+    async def _reconectar(self):
+        while self.conn is None:
+            try:
+                await self.iniciar()
+            except Exception as e:
+                print("⚠️ No se pudo reconectar LISTEN/NOTIFY:", e)
+                await asyncio.sleep(5)
+
+    def despachar(self, canal: str, payload: str):
+        try:
+            mensaje = json.loads(payload)
+        except ValueError:
+            return
+        for callback in list(self.callbacks.get(canal, ())):
+            try:
+                callback(mensaje)
+            except Exception as e:
+                print(f"Error en callback de '{canal}':", e)
+
+
+escucha = Escucha()
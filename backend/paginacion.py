@@ -0,0 +1,71 @@
+# paginacion.py
+# Utilidades de paginación para listados grandes: conteo en SQL (exacto, estimado por
+# el planner o ninguno) y cursores keyset opacos sobre (fecha, id) o (puntaje, id).
+import json
+import base64
+from datetime import datetime
+from typing import Optional, Tuple
+from fastapi import HTTPException
+from sqlmodel import Session, select, func
+
+MODOS_TOTAL = ("exacto", "estimado", "ninguno")
+# por debajo de esto el estimado del planner se reemplaza por el conteo exacto (es barato)
+UMBRAL_CONTEO_EXACTO = 10000
+
+
+def contar(session: Session, query, modo: str = "exacto") -> Optional[int]:
+    """
+    Total de filas de `query` (sin ORDER BY/LIMIT) según el modo:
+      - exacto: SELECT count(*) sobre la consulta
+      - estimado: filas estimadas por EXPLAIN (Postgres); si son pocas, se cuenta exacto
+      - ninguno: no se cuenta (None)
+    """
+    if modo not in MODOS_TOTAL:
+        raise HTTPException(status_code=400, detail=f"Modo de total inválido: {modo}")
+    if modo == "ninguno":
+        return None
+
+    query = query.order_by(None)
+    if modo == "estimado" and session.get_bind().dialect.name == "postgresql":
+        estimado = estimar_filas(session, query)
+        if estimado > UMBRAL_CONTEO_EXACTO:
+            return estimado
+    return session.exec(select(func.count()).select_from(query.subquery())).one()
+
+
+def estimar_filas(session: Session, query) -> int:
+    """Filas que el planner de Postgres estima para la consulta (no la ejecuta)."""
+    compilada = query.compile(dialect=session.get_bind().dialect)
+    plan = session.connection().exec_driver_sql(
+        f"EXPLAIN (FORMAT JSON) {compilada}", compilada.params
+    ).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def codificar_cursor(fecha: datetime, id: int) -> str:
+    crudo = json.dumps([fecha.isoformat(), id])
+    return base64.urlsafe_b64encode(crudo.encode("utf-8")).decode("ascii")
+
+
+def decodificar_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        fecha, id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(fecha), int(id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
+def codificar_cursor_ranking(puntaje: float, id: int, posicion: int) -> str:
+    """Cursor del ranking: último (puntaje, id) de la página y su posición, para numerar la siguiente."""
+    crudo = json.dumps([puntaje, id, posicion])
+    return base64.urlsafe_b64encode(crudo.encode("utf-8")).decode("ascii")
+
+
+def decodificar_cursor_ranking(cursor: str) -> Tuple[float, int, int]:
+    try:
+        puntaje, id, posicion = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return float(puntaje), int(id), int(posicion)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
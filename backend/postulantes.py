@@ -3,6 +3,7 @@ from sqlmodel import Session, select, desc, or_, func
 from models import User, Postulant, EvaluacionCV
 from cargabd import engine
 from auth import get_current_user
+import busqueda
 from typing import List, Optional
 from dotenv import load_dotenv
 import os
@@ -23,14 +24,11 @@ def listar_postulantes(
     with Session(engine) as session:
         query = select(Postulant)
         if search:
-            query = query.where(
-                or_(
-                    Postulant.name.ilike(f"%{search}%"),  # type: ignore
-                    Postulant.dni.ilike(f"%{search}%"),  # type: ignore
-                    Postulant.email.ilike(f"%{search}%"),  # type: ignore
-                )
-            )
+            # sin distinguir tildes ("Nunez" encuentra "Núñez"); usa los índices de trigramas
+            query = query.where(busqueda.filtro_contiene([Postulant.name, Postulant.dni, Postulant.email], search))
         total = session.exec(select(func.count()).select_from(query.subquery())).one()
+        if search and busqueda.es_postgres():
+            query = query.order_by(busqueda.orden_similitud(Postulant.name, search), Postulant.dni)
         results = session.exec(query.offset(offset).limit(limit)).all()
         return {
             "total": total,
@@ -1,14 +1,25 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, Request, WebSocket, WebSocketDisconnect, Body
-from sqlmodel import Session, select, desc
+from sqlmodel import Session, select, desc, or_, func, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import null
 from sqlalchemy.orm import selectinload
-from models import ChargeProcess, ChargeProcessCreate, JobPosition, User, EvaluacionCV, Postulant
-from google_oauth import get_drive_service
-from googleapiclient.errors import HttpError
-from cargabd import engine, get_session
-from auth import get_current_user
+from models import ChargeProcess, ChargeProcessCreate, ProcesosPaginados, JobPosition, Area, User, EvaluacionCV, Postulant, ProcesamientoJob, SolicitudN8N, peru_time
+from cola_jobs import encolar_job, job_a_dict, ultimo_job, sumar_avance, job_propio, JobPausado, LeasePerdido
+from drive_sync import sincronizar_carpeta, marcar_procesados
+from progreso import publicar_progreso, suscribir, desuscribir
+import cache_evaluaciones
+import callback_n8n
+import estadisticas  # registra el listener que mantiene el rollup por proceso
+from cargabd import engine, get_session, get_async_session
+from paginacion import contar, codificar_cursor_ranking, decodificar_cursor_ranking
+from ranking import consulta_ranking, PUNTAJES
+import busqueda
+from auth import get_current_user, get_user_from_token, create_job_token
+from fastapi.responses import StreamingResponse
 from datetime import datetime, timezone, timedelta
-import httpx
-from typing import List, Optional, Dict
+from clientes_n8n import cliente, CircuitoAbierto
+from metricas import incrementar
+from typing import Callable, List, Optional, Dict
 from dotenv import load_dotenv
 import os
 import uuid
@@ -16,56 +27,37 @@ import json
 from jose import JWTError, jwt
 import asyncio
 import secrets
+import time
+from functools import partial
 load_dotenv()
 
 routerprocess = APIRouter(prefix="/procesos", tags=["Procesos"])
 
 # SECRET_KEY = os.getenv("SECRET_KEY")
 # ALGORITHM = os.getenv("ALGORITHM")
-N8N_FOLDER_URL = str(os.getenv("N8N_CREATE_FOLDER_URL"))
-N8N_PROCESAR_CVS_URL =str(os.getenv("N8N_PROCESAR_CVS_URL"))
-N8N_ACTUALIZR_MATCHS_URL =str(os.getenv("N8N_ACTUALIZR_MATCHS_URL"))
-N8N_PROCESAR_CVS_URL2 =str(os.getenv("N8N_PROCESAR_CVS_URL2"))
+# URLs de los webhooks de n8n: ver PERFILES en clientes_n8n.py
 BASE_FRONT_URL = os.getenv("BASE_FRONT_URL")
 
-##Clase para websocket
-# class ConnectionManager:
-#     def __init__(self):
-#         # mapa process_id -> lista de websockets
-#         self.active_connections: Dict[int, List[WebSocket]] = {}
-
-#     async def connect(self, process_id: int, websocket: WebSocket):
-#         await websocket.accept()
-#         self.active_connections.setdefault(process_id, []).append(websocket)
-
-#     def disconnect(self, process_id: int, websocket: WebSocket):
-#         conns = self.active_connections.get(process_id, [])
-#         if websocket in conns:
-#             conns.remove(websocket)
-#         if not conns:
-#             self.active_connections.pop(process_id, None)
-
-#     async def send_progress(self, process_id: int, message: dict):
-#         conns = list(self.active_connections.get(process_id, []) or [])
-#         for ws in conns:
-#             try:
-#                 await ws.send_json(message)
-#             except Exception:
-#                 # si falla al enviar, cerrar y remover esa conexión
-#                 try:
-#                     await ws.close()
-#                 except:
-#                     pass
-#                 self.disconnect(process_id, ws)
-
-# manager = ConnectionManager()
+# Concurrencia de evaluacion de CVs contra n8n
+N8N_CVS_CONCURRENCIA = int(os.getenv("N8N_CVS_CONCURRENCIA", "4"))  # llamadas en vuelo por proceso
+N8N_CVS_CONCURRENCIA_GLOBAL = int(os.getenv("N8N_CVS_CONCURRENCIA_GLOBAL", "8"))  # tope entre todos los procesos
+
+# semaforo compartido por todos los procesos que se ejecutan en este worker
+semaforo_global_n8n = asyncio.Semaphore(N8N_CVS_CONCURRENCIA_GLOBAL)
+
+# Persistencia por lotes de resultados (group commit)
+PERSISTENCIA_LOTE_TAMANO = int(os.getenv("PERSISTENCIA_LOTE_TAMANO", "25"))
+PERSISTENCIA_LOTE_MS = int(os.getenv("PERSISTENCIA_LOTE_MS", "500"))
+
+PROGRESO_PING_SEGUNDOS = 25  # keep-alive de WebSocket/SSE cuando no hay eventos
 
 
 #Flujo de creacion
 @routerprocess.post("/crear-proceso-carga/")
 async def create_process_charge(
     data: ChargeProcessCreate,
-    user=Depends(get_current_user)
+    user=Depends(get_current_user),
+    session: AsyncSession = Depends(get_async_session)
 ):
     today_str = datetime.utcnow().strftime("%Y%m%d")
     
@@ -73,91 +65,86 @@ async def create_process_charge(
     reque = data.reque
     functions = data.functions
     
-    with Session(engine) as session:
-        # validar puesto
-        puesto = session.get(JobPosition, job_id)
-        if not puesto:
-            raise HTTPException(status_code=404, detail="Puesto no encontrado")
-
-        # contar Nprocesos del usuario
-        existing = session.exec(
-            select(ChargeProcess).where(ChargeProcess.user_id == user.id)
+    # validar puesto
+    puesto = await session.get(JobPosition, job_id)
+    if not puesto:
+        raise HTTPException(status_code=404, detail="Puesto no encontrado")
+
+    # contar Nprocesos del usuario
+    count = (await session.exec(
+        select(func.count()).select_from(ChargeProcess).where(ChargeProcess.user_id == user.id)
+    )).one() + 1
+    code = f"{str(user.id).zfill(4)}-{today_str}-{str(count).zfill(5)}"
+    
+    # Verificar si ya hay un proceso con este código
+    existing_process = (await session.exec(
+        select(ChargeProcess.id).where(ChargeProcess.code == code)
+    )).first()
+    if existing_process:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Ya existe un proceso con el código '{code}'"
         )
-        count = len(existing.all()) + 1
-        code = f"{str(user.id).zfill(4)}-{today_str}-{str(count).zfill(5)}"
-        
-        # Verificar si ya hay un proceso con este código
-        existing_process = session.exec(
-            select(ChargeProcess).where(ChargeProcess.code == code)
-        ).first()
-        if existing_process:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Ya existe un proceso con el código '{code}'"
-            )
+    # liberar la conexión mientras n8n crea la carpeta (puede tardar minutos)
+    await session.commit()
     
     # Crear carpeta en Drive vía n8n
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                N8N_FOLDER_URL,
-                json={"folder_name": code, "puesto": puesto.name}
-                ,timeout=httpx.Timeout(1800.0)
-            )
-        except Exception as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error en comunicación: {e}"
-            )
-            
-        if response.status_code != 200:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error al buscar/crear carpeta: {response.status_code} - {response.text}"
-            )
-                 
-        try:
-            n8n_data = response.json()
-            folder_id = n8n_data.get("folder_id")
-            folder_url = n8n_data.get("folder_url")
-
-            if not folder_id:
-                raise ValueError("Respuesta sin folder_id")
-            if not folder_url:
-                raise ValueError("Respuesta sin folder_url")
+    try:
+        response = await cliente("carpeta").post(
+            json={"folder_name": code, "puesto": puesto.name}
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error en comunicación: {e}"
+        )
+        
+    if response.status_code != 200:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error al buscar/crear carpeta: {response.status_code} - {response.text}"
+        )
+             
+    try:
+        n8n_data = response.json()
+        folder_id = n8n_data.get("folder_id")
+        folder_url = n8n_data.get("folder_url")
 
-        except Exception as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error al interpretar respuesta de n8n: {e} - {response.text}"
-            )
+        if not folder_id:
+            raise ValueError("Respuesta sin folder_id")
+        if not folder_url:
+            raise ValueError("Respuesta sin folder_url")
 
-    with Session(engine) as session:
-        # Crear proceso
-        process = ChargeProcess(
-            code=code,
-            job_id=job_id,
-            reque=reque,
-            functions=functions,
-            user_id=user.id,
-            drive_folder_id=folder_id,
-            drive_folder_url=folder_url
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error al interpretar respuesta de n8n: {e} - {response.text}"
         )
-        session.add(process)
-        session.commit()
-        session.refresh(process)
-        
-        token = secrets.token_urlsafe(12)
-        process_code = getattr(process, "code", None) or str(process.id)
-        base = os.getenv("BASE_FRONT_URL", BASE_FRONT_URL)
-        form_url = f"{base.rstrip('/')}/{process_code}/{token}"
- 
-        process.form_token = token
-        process.form_url = form_url
 
-        session.add(process)
-        session.commit()
-        session.refresh(process)
+    # Crear proceso
+    process = ChargeProcess(
+        code=code,
+        job_id=job_id,
+        reque=reque,
+        functions=functions,
+        user_id=user.id,
+        drive_folder_id=folder_id,
+        drive_folder_url=folder_url
+    )
+    session.add(process)
+    await session.flush()  # asigna el id sin cerrar la transacción
+    
+    token = secrets.token_urlsafe(12)
+    process_code = getattr(process, "code", None) or str(process.id)
+    base = os.getenv("BASE_FRONT_URL", BASE_FRONT_URL)
+    form_url = f"{base.rstrip('/')}/{process_code}/{token}"
+
+    process.form_token = token
+    process.form_url = form_url
+
+    session.add(process)
+    await session.commit()
+    await session.refresh(process)
 
     return {
         "id": process.id,
@@ -170,47 +157,81 @@ async def create_process_charge(
     }
 
 #Listar
-@routerprocess.get("/listar", response_model=List[ChargeProcess])
+@routerprocess.get("/listar", response_model=ProcesosPaginados)
 def list_process(
     job_id: Optional[int] = Query(None),
     state: Optional[bool] = Query(None),
+    area: Optional[str] = Query(None),
+    fecha: Optional[str] = Query(None),
+    search: Optional[str] = Query(None),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    modo_total: str = Query("exacto"),
     user=Depends(get_current_user)
 ):
+    """
+    Procesos visibles para el usuario, paginados. Una sola consulta con los JOIN a puesto,
+    área y autor (antes eran ~3 consultas por proceso) más la del total.
+    `area` y `search` (código) buscan "contiene"; `fecha` (YYYY-MM-DD) es el día de creación.
+    """
     with Session(engine) as session:
-        query = select(ChargeProcess)
-        
-        if user.role != "admin":
+        es_admin = user.role == "admin"
+        query = (
+            select(
+                ChargeProcess.id,
+                ChargeProcess.code,
+                ChargeProcess.create_date,
+                ChargeProcess.state,
+                ChargeProcess.end_process,
+                JobPosition.name.label("puesto"),  # type: ignore
+                Area.name.label("area"),  # type: ignore
+                ChargeProcess.reque,
+                ChargeProcess.functions,
+                (User.username if es_admin else null()).label("autor"),  # type: ignore
+                ChargeProcess.drive_folder_url,
+            )
+            .outerjoin(JobPosition, JobPosition.id == ChargeProcess.job_id)  # type: ignore
+            .outerjoin(Area, Area.id == JobPosition.area_id)  # type: ignore
+        )
+        if es_admin:
+            query = query.outerjoin(User, User.id == ChargeProcess.user_id)  # type: ignore
+        else:
             query = query.where(ChargeProcess.user_id == user.id)
-            
+
         if job_id is not None:
             query = query.where(ChargeProcess.job_id == job_id)
-            
+
         if state is not None:
             query = query.where(ChargeProcess.state == state)
-            
-        process = session.exec(query.order_by(desc(ChargeProcess.create_date))).all()
-        
-        result = []
-        
-        for p in process:
-            autor = None
-            if user.role == "admin":
-                usr = session.get(User, p.user_id)
-                autor = usr.username if usr else None
-            result.append({
-                "id": p.id,
-                "code": p.code,
-                "create_date": p.create_date,
-                "state": p.state,
-                "end_process": p.end_process,
-                "puesto": p.job.name if p.job else None,
-                "area": p.job.area.name if p.job and p.job.area else None,
-                "reque": p.reque,
-                "functions": p.functions,
-                "autor": autor,
-                "drive_folder_url": p.drive_folder_url
-            })
-        return result
+
+        if area:
+            query = query.where(busqueda.filtro_contiene([Area.name], area))
+
+        if search:
+            query = query.where(busqueda.filtro_contiene([ChargeProcess.code], search))
+
+        if fecha:
+            try:
+                dia = datetime.strptime(fecha, "%Y-%m-%d")
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Fecha inválida, use YYYY-MM-DD")
+            query = query.where(
+                ChargeProcess.create_date >= dia,
+                ChargeProcess.create_date < dia + timedelta(days=1),
+            )
+
+        total = contar(session, query, modo_total)
+        filas = session.exec(
+            query.order_by(desc(ChargeProcess.create_date), desc(ChargeProcess.id))
+            .offset(offset)
+            .limit(limit)
+        ).all()
+
+        return {
+            "total": total,
+            "modo_total": modo_total,
+            "items": [dict(f._mapping) for f in filas],
+        }
 
 #Activar  
 @routerprocess.put("/{id}/activar")
@@ -237,71 +258,189 @@ def disable_process(id: int, user=Depends(get_current_user)):
         return {"msg": "Proceso desactivado"}
 
 ######################  PRUEBAS ##############################
-#async
-def list_drive_files(folder_id: str):
+
+class MapaPostulantes:
     """
-    Lista los archivos de una carpeta en Google Drive usando el service.
+    Identity map de Postulant para un lote de CVs, indexado por cv_url, cv_drive_file_id
+    y dni. Se precarga con una sola consulta y se actualiza al crear/modificar
+    postulantes, así resolver_postulante no consulta la DB por cada CV.
+    Usar con una sesión expire_on_commit=False (los objetos viven entre commits).
     """
-    try:
-        service = get_drive_service()
-        archivos = []
-        page_token = None
 
-        while True:
-            # results = (
-            #     service.files()
-            #     .list(
-            #         q=f"'{folder_id}' in parents and mimeType!='application/vnd.google-apps.folder'",
-            #         fields="nextPageToken, files(id, name, webViewLink)",
-            #         pageSize=1000,  # máximo permitido por la API
-            #         pageToken=page_token,
-            #     )
-            #     .execute()
-            # )
-            results = service.files().list(
-                q=f"'{folder_id}' in parents and mimeType!='application/vnd.google-apps.folder'",
-                fields="nextPageToken, files(id, name, webViewLink)",
-                pageSize=1000,
-                pageToken=page_token,
-            ).execute()
-
-            archivos.extend(results.get("files", []))
-            page_token = results.get("nextPageToken")
-
-            if not page_token:
-                break
-
-        return archivos
-
-    except HttpError as e:
-        print(f"❌ Error al listar archivos de Drive: {e}")
-        return []
-
-
-def guardar_resultado(session: Session, result: dict, process):
+    def __init__(self):
+        self.urls: List[str] = []
+        self.drive_ids: List[str] = []
+        self._limpiar()
+
+    def _limpiar(self):
+        self.por_url: Dict[str, Postulant] = {}
+        self.por_drive: Dict[str, Postulant] = {}
+        self.por_dni: Dict[str, Postulant] = {}
+        self.dnis_consultados: set = set()
+
+    def precargar(self, session: Session, urls: List[str], drive_ids: List[str]):
+        """Trae en una consulta todos los postulantes asociados a los archivos pendientes."""
+        self.urls = [u for u in urls if u]
+        self.drive_ids = [d for d in drive_ids if d]
+        if not self.urls and not self.drive_ids:
+            return
+        stmt = select(Postulant).where(
+            or_(
+                Postulant.cv_url.in_(self.urls),  # type: ignore
+                Postulant.cv_drive_file_id.in_(self.drive_ids),  # type: ignore
+            )
+        )
+        for p in session.exec(stmt).all():
+            self.registrar(p)
+
+    def precargar_dnis(self, session: Session, dnis: List[str]):
+        """Una consulta por lote para los dni que aún no se conocen."""
+        faltan = {d for d in dnis if d and d not in self.por_dni and d not in self.dnis_consultados}
+        if not faltan:
+            return
+        for p in session.exec(select(Postulant).where(Postulant.dni.in_(faltan))).all():  # type: ignore
+            self.registrar(p)
+        self.dnis_consultados |= faltan
+
+    def recargar(self, session: Session):
+        """Tras un rollback el mapa puede tener objetos que no llegaron a la DB: se vuelve a cargar."""
+        self._limpiar()
+        self.precargar(session, self.urls, self.drive_ids)
+
+    def registrar(self, p: Postulant):
+        # setdefault: se conserva el primero encontrado, como el .first() de la consulta
+        if p.cv_url:
+            self.por_url.setdefault(p.cv_url, p)
+        if p.cv_drive_file_id:
+            self.por_drive.setdefault(p.cv_drive_file_id, p)
+        self.por_dni[p.dni] = p
+
+    def buscar(self, url_cv: Optional[str], drive_file_id: Optional[str], dni: Optional[str]) -> Optional[Postulant]:
+        # mismo orden de prioridad que las consultas: cv_url -> drive id -> dni
+        return (
+            (self.por_url.get(url_cv) if url_cv else None)
+            or (self.por_drive.get(drive_file_id) if drive_file_id else None)
+            or (self.por_dni.get(dni) if dni else None)
+        )
+
+
+def guardar_resultado(session: Session, result: dict, process, mapa: Optional[MapaPostulantes] = None):
     """
     Guarda el resultado de n8n en Postulant y EvaluacionCV respetando la
     prioridad: si ya existe postulant asociado al CV -> no sobrescribir datos básicos.
     """
+    postulant = resolver_postulante(session, result, mapa)
+    session.flush()  # asegurar que tenga dni para FK de EvaluacionCV
+    evaluacion = construir_evaluacion(result, process, postulant)
+    agregar_o_reemplazar(session, [evaluacion], evaluaciones_existentes(session, process.id, [evaluacion.url_cv]))
+    # No commit aquí — commit lo hace el caller (como en tu bucle). 
+
+
+def evaluaciones_existentes(session: Session, process_id: int, urls: List[Optional[str]]) -> Dict[str, List[EvaluacionCV]]:
+    """Evaluaciones del proceso para esos CVs (url_cv -> filas, la más nueva primero)."""
+    urls = list({u for u in urls if u})
+    if not urls:
+        return {}
+    existentes: Dict[str, List[EvaluacionCV]] = {}
+    for e in session.exec(
+        select(EvaluacionCV)
+        .where(EvaluacionCV.charge_process_id == process_id, EvaluacionCV.url_cv.in_(urls))  # type: ignore
+        .order_by(desc(EvaluacionCV.id))
+    ).all():
+        existentes.setdefault(e.url_cv, []).append(e)
+    return existentes
+
+
+def agregar_o_reemplazar(session: Session, evaluaciones: List[EvaluacionCV], existentes: Dict[str, List[EvaluacionCV]]):
+    """
+    Una evaluación por CV y proceso: si el CV ya tenía una (se reevaluó porque cambió su
+    contenido o se reintentó), se actualiza esa fila (mismo id para ranking y finalización)
+    y se borran las copias de antes; si no, se inserta. Todo por ORM para que el rollup de
+    estadisticas.py vea los cambios.
+    """
+    for nueva in evaluaciones:
+        filas = existentes.get(nueva.url_cv) if nueva.url_cv else None
+        if not filas:
+            session.add(nueva)
+            if nueva.url_cv:
+                existentes[nueva.url_cv] = [nueva]
+            continue
+        actual, *copias = filas
+        # lo que no viene de n8n (postulación del formulario, marca del reclutador) se conserva
+        for campo, valor in nueva.model_dump(exclude={"id", "postulation_id", "flag_shade"}).items():
+            setattr(actual, campo, valor)
+        session.add(actual)
+        for copia in copias:
+            session.delete(copia)
+        existentes[nueva.url_cv] = [actual]
+
+
+def guardar_lote(session: Session, resultados: List[dict], process,
+                 mapa: Optional[MapaPostulantes] = None) -> List[Optional[Exception]]:
+    """
+    Guarda varios resultados en la transacción actual: postulantes en un flush y las
+    EvaluacionCV nuevas en un solo INSERT multi-fila (las de CVs que ya tenían evaluación en el
+    proceso se actualizan, ver agregar_o_reemplazar). Si algo falla, reintenta fila por fila
+    con SAVEPOINT para aislar la fila mala sin perder el resto del lote.
+    Con mapa, los postulantes se resuelven en memoria (una consulta de dni por lote).
+    Devuelve, por cada resultado, None si se guardó o la excepción. No hace commit.
+    """
+    try:
+        if mapa is not None:
+            mapa.precargar_dnis(session, [(r.get("dni") or "").strip() for r in resultados])
+        postulantes = [resolver_postulante(session, r, mapa) for r in resultados]
+        session.flush()
+        existentes = evaluaciones_existentes(session, process.id, [r.get("url_cv") for r in resultados])
+        agregar_o_reemplazar(session, [construir_evaluacion(r, process, p) for r, p in zip(resultados, postulantes)], existentes)
+        session.flush()
+        return [None] * len(resultados)
+    except Exception as e:
+        print(f"Lote de {len(resultados)} falló ({e}); reintentando fila por fila")
+        session.rollback()
+        if mapa is not None:
+            mapa.recargar(session)
+
+    # fila por fila se consulta la DB (no el mapa) para no repetir un conflicto del lote
+    errores: List[Optional[Exception]] = []
+    for r in resultados:
+        try:
+            with session.begin_nested():
+                postulant = resolver_postulante(session, r)
+                session.flush()
+                evaluacion = construir_evaluacion(r, process, postulant)
+                agregar_o_reemplazar(session, [evaluacion], evaluaciones_existentes(session, process.id, [evaluacion.url_cv]))
+            if mapa is not None:
+                mapa.registrar(postulant)
+            errores.append(None)
+        except Exception as e:
+            errores.append(e)
+    return errores
+
+
+def resolver_postulante(session: Session, result: dict, mapa: Optional[MapaPostulantes] = None) -> Postulant:
+    """
+    Busca (por CV, drive id o dni) o crea el Postulant del resultado y aplica los cambios.
+    Con mapa, las búsquedas se hacen en memoria y el mapa se actualiza con el resultado.
+    """
     url_cv = result.get("url_cv")
     nombre_archivo = result.get("nombre_archivo")
-    cv_procesado = result.get("cv_procesado", False)
-    cv_estado = result.get("cv_estado", "no leído")
-    motivo = result.get("motivo")
     name = result.get("name") or nombre_archivo
     dni = (result.get("dni") or "").strip() or None
 
-    # 1) buscar postulant por cv_url (prioritario) o por drive file id si lo tienes
     postulant = None
-    if url_cv:
+    if mapa is not None:
+        postulant = mapa.buscar(url_cv, result.get("drive_file_id"), dni)
+
+    # 1) buscar postulant por cv_url (prioritario) o por drive file id si lo tienes
+    elif url_cv:
         postulant = session.exec(select(Postulant).where(Postulant.cv_url == url_cv)).first()
 
     # (opcional) si n8n devuelve drive_file_id puedes buscar por cv_drive_file_id también:
-    if not postulant and result.get("drive_file_id"):
+    if mapa is None and not postulant and result.get("drive_file_id"):
         postulant = session.exec(select(Postulant).where(Postulant.cv_drive_file_id == result.get("drive_file_id"))).first()
 
     # 2) si no lo encontramos por CV, buscar por dni si viene
-    if not postulant and dni:
+    if mapa is None and not postulant and dni:
         postulant = session.exec(select(Postulant).where(Postulant.dni == dni)).first()
 
     # 3) si aún no existe, crear uno nuevo (dni puede ser temp-UUID si no hay dni)
@@ -364,7 +503,19 @@ def guardar_resultado(session: Session, result: dict, process):
 
     # Guardar postulant (si fue modificado)
     session.add(postulant)
-    session.flush()
+    if mapa is not None:
+        mapa.registrar(postulant)
+    return postulant
+
+
+def construir_evaluacion(result: dict, process, postulant: Postulant) -> EvaluacionCV:
+    """Arma la EvaluacionCV del resultado (sin agregarla a la sesión)."""
+    url_cv = result.get("url_cv")
+    nombre_archivo = result.get("nombre_archivo")
+    cv_procesado = result.get("cv_procesado", False)
+    cv_estado = result.get("cv_estado", "no leído")
+    motivo = result.get("motivo")
+    name = result.get("name") or nombre_archivo
 
     # 4) ahora crear la EvaluacionCV asociada
     eval_data = result.get("evaluacion") or {}
@@ -412,17 +563,132 @@ def guardar_resultado(session: Session, result: dict, process):
             summary=""
         )
 
-    session.add(evaluation)
-    # No commit aquí — commit lo hace el caller (como en tu bucle). 
+    return evaluation
+
 
+class LoteResultados:
+    """Buffer de resultados de n8n: se vacía al llegar a N elementos o tras T ms del primero."""
 
-#Proceso de evaluacion de CV
+    def __init__(self, tamano: int = PERSISTENCIA_LOTE_TAMANO, max_ms: int = PERSISTENCIA_LOTE_MS):
+        self.tamano = tamano
+        self.max_ms = max_ms
+        self.items: List[tuple] = []
+        self.inicio: Optional[float] = None
+
+    def __len__(self):
+        return len(self.items)
+
+    def agregar(self, payload: dict, result: Optional[dict], error: Optional[Exception]):
+        if not self.items:
+            self.inicio = time.monotonic()
+        self.items.append((payload, result, error))
+
+    def segundos_restantes(self) -> Optional[float]:
+        if not self.items:
+            return None
+        return max(self.max_ms / 1000 - (time.monotonic() - self.inicio), 0)
+
+    def lleno(self) -> bool:
+        return len(self.items) >= self.tamano or self.segundos_restantes() == 0
+
+    def vaciar(self) -> List[tuple]:
+        items, self.items, self.inicio = self.items, [], None
+        return items
+
+
+def guardar_lote_job(session: Session, items: List[tuple], process, proc_job_id: int,
+                     mapa: Optional[MapaPostulantes] = None, claves_cache: Optional[Dict[str, tuple]] = None,
+                     worker_id: Optional[str] = None):
+    """
+    Persiste un lote de (payload, resultado, error) y el checkpoint del job en una
+    sola transacción. Los errores de n8n y las filas que no se pudieron guardar
+    cuentan como no procesados. Lo evaluado por n8n se agrega a la cache de evaluaciones
+    (claves_cache: drive_file_id -> (clave, md5, contexto_hash)).
+    Si el worker perdió el lease no se guarda nada (rollback y LeasePerdido): el lote lo
+    vuelve a evaluar el nuevo dueño del job.
+    """
+    try:
+        registrar_lote_job(session, items, process, proc_job_id, mapa, claves_cache, worker_id)
+    except LeasePerdido:
+        session.rollback()
+        raise
+    session.commit()
+
+
+def registrar_lote_job(session: Session, items: List[tuple], process, proc_job_id: int,
+                       mapa: Optional[MapaPostulantes] = None, claves_cache: Optional[Dict[str, tuple]] = None,
+                       worker_id: Optional[str] = None):
+    """guardar_lote_job sin commit. Devuelve el avance del job (procesados, no_procesados, total)."""
+    ok = [(p, r) for p, r, e in items if e is None]
+    errores_db = guardar_lote(session, [r for _, r in ok], process, mapa) if ok else []
+
+    fallidos = [(p, e) for p, _, e in items if e is not None]
+    fallidos += [(p, e) for (p, _), e in zip(ok, errores_db) if e is not None]
+    for p, e in fallidos:
+        print("Error procesando archivo:", p["nombre_archivo"], e)
+
+    # los guardados dejan de estar pendientes en la sincronización de Drive
+    guardados = [p for (p, _), e in zip(ok, errores_db) if e is None]
+    marcar_procesados(session, process.id, [p.get("drive_file_id") for p in guardados])
+
+    if claves_cache:
+        cache_evaluaciones.guardar(session, [
+            (*claves_cache[p["drive_file_id"]], r)
+            for (p, r), e in zip(ok, errores_db)
+            if e is None and p.get("drive_file_id") in claves_cache and r.get("cv_procesado")
+            and not p.get(cache_evaluaciones.DESDE_CACHE)
+        ])
+
+    return sumar_avance(session, proc_job_id, len(items) - len(fallidos), len(fallidos), [
+        {"nombre_archivo": p["nombre_archivo"], "url_cv": p["url_cv"], "cv_estado": "falló", "error": str(e)}
+        for p, e in fallidos
+    ], worker_id)
+
+
+async def evaluar_cv_n8n(payload: dict, semaforo_proceso: asyncio.Semaphore, token: Callable[[], Optional[str]]):
+    """
+    Envia un CV a n8n respetando el limite por proceso y el tope global.
+    Devuelve (payload, resultado, error) para que el caller persista en orden de llegada.
+    `token` firma uno nuevo al momento de enviar (el CV puede esperar turno mucho rato).
+    """
+    try:
+        # primero el cupo del proceso: asi no se retiene un cupo global mientras se espera turno
+        async with semaforo_proceso:
+            async with semaforo_global_n8n:
+                print(f"Procesando archivo → {payload.get('nombre_archivo')}")
+                response = await cliente("procesar_cvs").post(json={**payload, "token": token()})
+        response.raise_for_status()
+        result = response.json()
+
+        if isinstance(result, str):
+            result = json.loads(result)
+
+        return payload, result, None
+    except Exception as e:
+        return payload, None, e
+
+
+async def resultado_cacheado(payload: dict, cacheado: dict):
+    payload = {**payload, cache_evaluaciones.DESDE_CACHE: True}
+    return payload, cache_evaluaciones.resultado_para_archivo(cacheado, payload), None
+
+
+async def reutilizar_evaluacion(original: asyncio.Task, payload: dict, semaforo_proceso: asyncio.Semaphore,
+                                token: Callable[[], Optional[str]]):
+    """Copia del mismo CV en el lote: espera la evaluación del primero en vez de llamar otra vez a n8n."""
+    _, result, error = await asyncio.shield(original)
+    if error is None and result and result.get("cv_procesado"):
+        incrementar("cache_eval_duplicados_lote")
+        payload = {**payload, cache_evaluaciones.DESDE_CACHE: True}
+        return payload, cache_evaluaciones.resultado_para_archivo(result, payload), None
+    if isinstance(error, CircuitoAbierto):
+        return payload, None, error
+    return await evaluar_cv_n8n(payload, semaforo_proceso, token)
+
+
+#Proceso de evaluacion de CV (encola un job; lo ejecuta worker.py)
 @routerprocess.post("/{process_id}/procesar-cvs")
-async def process_cvs(process_id: int, request: Request, user=Depends(get_current_user)):
-    
-    token = request.headers.get("authorization")
-    if not token:
-        raise HTTPException(status_code=401, detail="No se proporcionó token")
+def process_cvs(process_id: int, user=Depends(get_current_user)):
 
     with Session(engine) as session:
         process = session.get(ChargeProcess, process_id)
@@ -436,152 +702,334 @@ async def process_cvs(process_id: int, request: Request, user=Depends(get_curren
         if not job:
             raise HTTPException(status_code=404, detail="Puesto asociado no encontrado")
 
+        # Encolar (marca is_processing); si ya hay un job activo se devuelve ese
+        proc_job = encolar_job(session, process_id, "procesar_cvs", creado_por=user.username)
+        return job_a_dict(proc_job)
+
+
+async def ejecutar_procesamiento_cvs(proc_job_id: int, worker_id: Optional[str] = None):
+    """
+    Ejecuta un job "procesar_cvs": sincroniza la carpeta de Drive, evalua en n8n los CVs
+    pendientes y checkpointea el avance en el job por cada lote.
+    Es reanudable: los archivos ya evaluados dejan de estar pendientes en drivearchivo.
+    Devuelve el estado final ("completado") o lanza excepcion si el intento falló.
+    Con `worker_id` cada checkpoint verifica que el job siga siendo de ese worker (LeasePerdido si no).
+    """
+    with Session(engine) as session:
+        proc_job = session.get(ProcesamientoJob, proc_job_id)
+        if not proc_job:
+            raise ValueError(f"Job {proc_job_id} no encontrado")
+        process_id = proc_job.process_id
+        creado_por = proc_job.creado_por
+
+        process = session.get(ChargeProcess, process_id)
+        if not process:
+            raise ValueError("Proceso no encontrado")
+
+        job = session.get(JobPosition, process.job_id)
+        if not job:
+            raise ValueError("Puesto asociado no encontrado")
+
         job_name = job.name
         job_id = job.id
         job_area = job.area.name if job.area else None
         job_reque = process.reque
         job_funcs = process.functions
 
-        
+    # 1. Sincronizar la carpeta de Drive: solo archivos nuevos o cambiados quedan pendientes
+    try:
+        pendientes = await asyncio.to_thread(sincronizar_carpeta, process.id, process.drive_folder_id)
+    except Exception as e:
+        # log claro; el worker reintenta el job más tarde
+        print("Error sincronizando carpeta de Drive (posible invalid_grant):", e)
+        raise RuntimeError(f"Error autenticación/Drive: {str(e)}")
 
-        # Marcar como en proceso
-        process.is_processing = True
-        session.add(process)
+    print(f"📂 Proceso {process.id}: ⏳ Pendientes: {len(pendientes)}")
+
+    # checkpoint inicial: en una reanudación los fallidos del intento anterior se reintentan
+    with Session(engine) as session:
+        proc_job = job_propio(session, proc_job_id, worker_id)
+        if not proc_job:
+            raise LeasePerdido(f"Job {proc_job_id}: ya no es de {worker_id}")
+        proc_job.total = proc_job.procesados + len(pendientes)
+        proc_job.no_procesados = 0
+        proc_job.errores = []
+        proc_job.avance_al_reclamar = proc_job.procesados
+        session.add(proc_job)
         session.commit()
-        session.refresh(process)
 
-        res = session.exec(
-            select(EvaluacionCV.url_cv).where(EvaluacionCV.charge_process_id == process.id)
-        )
-        try:
-            already = res.scalars().all()
-        except AttributeError:
-            # fallback si res no tiene scalars()
-            already = res.all()
-        urls_procesadas = set([u for u in already if u])
-        
-        print ("-----------------------------DEBUG:",urls_procesadas)
-    try:
-        # 1. Listar todos los archivos en la carpeta de Drive
-        #archivos = await list_drive_files(process.drive_folder_id)
-        # justo donde usas asyncio.to_thread(list_drive_files, process.drive_folder_id)
-        try:
-            archivos = await asyncio.to_thread(list_drive_files, process.drive_folder_id)
-        except Exception as e:
-            # log claro
-            print("Error listando archivos de Drive (posible invalid_grant):", e)
-            # limpiar estado
-            with Session(engine) as s2:
-                proc2 = s2.get(ChargeProcess, process_id)
-                if proc2:
-                    proc2.is_processing = False
-                    s2.add(proc2)
-                    s2.commit()
-            # devolver error legible al cliente
-            raise HTTPException(status_code=502, detail=f"Error autenticación/Drive: {str(e)}")
-        
+    semaforo_proceso = asyncio.Semaphore(N8N_CVS_CONCURRENCIA)
 
-        # Filtrar solo los pendientes (los que NO están en urls_procesadas)
-        pendientes = [a for a in archivos if a.get("webViewLink") not in urls_procesadas]
-
-        print(f"📂 Total: {len(archivos)}, ✅ Procesados: {len(urls_procesadas)}, ⏳ Pendientes: {len(pendientes)}")
-
-        results_ok, cvs_no_procesados, cvs_procesados = [], [], []
-        errores = []
-
-        async with httpx.AsyncClient() as client:
-            with Session(engine) as session:
-                for idx, archivo in enumerate(pendientes, start=1):
-                    url_cv = archivo.get("webViewLink")
-                    nombre_archivo = archivo.get("name")
-
-                    print(f"Procesando archivo N° {idx} de {len(pendientes)} → {nombre_archivo}")
-
-                    payload = {
-                        "folder_id": process.drive_folder_id,
-                        "process_id": process.id,
-                        "puesto": job_name,
-                        "puesto_id": job_id,
-                        "area": job_area,
-                        "reque": job_reque,
-                        "funcs": job_funcs,
-                        "url_cv": url_cv,
-                        "nombre_archivo": nombre_archivo,
-                        "token": token
-                    }
-
-                    try:
-                        response = await client.post(N8N_PROCESAR_CVS_URL2, json=payload, timeout=httpx.Timeout(300.0))
-                        response.raise_for_status()
-                        result = response.json()
-
-                        if isinstance(result, str):
-                            result = json.loads(result)
-
-                        # Guardar inmediatamente en DB
-                        guardar_resultado(session, result, process)
-
-                        session.commit()
-                        results_ok.append(result)
-                        cvs_procesados.append({"nombre_archivo": nombre_archivo, "url_cv": url_cv, "cv_estado": result.get("cv_estado")})
-                        
-                        # -- enviar progreso (éxito) --
-                        # try:
-                        #     await manager.send_progress(process.id, {
-                        #         "current": idx,
-                        #         "total": len(pendientes),
-                        #         "file": nombre_archivo,
-                        #         "status": "ok"
-                        #     })
-                        # except Exception as ws_err:
-                        #     print("Warning: fallo al enviar progreso por WS:", ws_err)
-
-                    except Exception as e:
-                        session.rollback()
-                        errores.append({"nombre_archivo": nombre_archivo, "url_cv": url_cv, "error": str(e)})
-                        cvs_no_procesados.append({"nombre_archivo": nombre_archivo, "url_cv": url_cv, "cv_estado": "falló"})
-                        print("Error procesando archivo:", nombre_archivo, e)
-
-                        # try:
-                        #     await manager.send_progress(process.id, {
-                        #         "current": idx,
-                        #         "total": len(pendientes),
-                        #         "file": nombre_archivo,
-                        #         "status": "error",
-                        #         "error": str(e)
-                        #     })
-                        # except Exception as ws_err:
-                        #     print("Warning: fallo al enviar progreso por WS (error):", ws_err)
-
-                        continue
-
-        # try:
-        #     await manager.send_progress(process.id, {
-        #         "current": len(pendientes),
-        #         "total": len(pendientes),
-        #         "completed": True
-        #     })
-        # except Exception as ws_err:
-        #     print("Warning: fallo al enviar progreso final por WS:", ws_err)
+    # cache por contenido: mismo md5 + mismo puesto/reque/functions + misma versión del flujo
+    contexto = cache_evaluaciones.hash_contexto(job_id, job_reque, job_funcs)
+    claves_cache = {}
+    for archivo in pendientes:
+        clave = cache_evaluaciones.clave_cache(archivo.get("md5Checksum"), contexto)
+        if clave:
+            claves_cache[archivo.get("id")] = (clave, archivo.get("md5Checksum"), contexto)
+    with Session(engine) as session:
+        cacheados = cache_evaluaciones.buscar(session, [c for c, _, _ in claves_cache.values()])
+        session.commit()
 
-        return {
-            "evaluaciones_registradas": len(results_ok),
-            "cvs_procesados": cvs_procesados,
-            "cvs_no_procesados": cvs_no_procesados,
-            "errores": errores
+    payloads = [
+        {
+            "folder_id": process.drive_folder_id,
+            "process_id": process.id,
+            "puesto": job_name,
+            "puesto_id": job_id,
+            "area": job_area,
+            "reque": job_reque,
+            "funcs": job_funcs,
+            "url_cv": archivo.get("webViewLink"),
+            "nombre_archivo": archivo.get("name"),
+            "drive_file_id": archivo.get("id"),
         }
-    
-    except Exception as e:
-        print("Error en el procesamiento:", e)
-        return {"error": "Error en el procesamiento"}
-    
+        for archivo in pendientes
+    ]
+    # el token va recién al enviar cada CV (ver evaluar_cv_n8n)
+    token = partial(create_job_token, creado_por, proc_job_id)
+    if callback_n8n.N8N_MODO_CALLBACK:
+        return await ejecutar_con_callback(proc_job_id, process, payloads, cacheados, claves_cache, token, worker_id)
+
+    tareas = []
+    primeros = {}  # clave -> tarea que evalúa ese contenido en esta corrida
+    for payload in payloads:
+        clave = claves_cache.get(payload["drive_file_id"], (None,))[0]
+        if clave in cacheados:
+            tarea = asyncio.create_task(resultado_cacheado(payload, cacheados[clave]))
+        elif clave in primeros:
+            tarea = asyncio.create_task(reutilizar_evaluacion(primeros[clave], payload, semaforo_proceso, token))
+        else:
+            tarea = asyncio.create_task(evaluar_cv_n8n(payload, semaforo_proceso, token))
+            if clave:
+                primeros[clave] = tarea
+        tareas.append(tarea)
+    try:
+        # expire_on_commit=False: los postulantes del mapa siguen válidos entre lotes
+        with Session(engine, expire_on_commit=False) as session:
+            mapa = MapaPostulantes()
+            mapa.precargar(session, [a.get("webViewLink") for a in pendientes], [a.get("id") for a in pendientes])
+            lote = LoteResultados()
+            en_vuelo = set(tareas)
+            hechos = ok = fallidos = 0
+            pausa = None
+            await asyncio.to_thread(publicar_progreso, process_id, {
+                "tipo": "inicio", "job_id": proc_job_id, "actual": 0, "total": len(pendientes), "ok": 0, "errores": 0,
+            })
+            # los resultados se acumulan y se guardan por lote (N resultados o T ms)
+            while en_vuelo or lote:
+                if en_vuelo:
+                    listas, en_vuelo = await asyncio.wait(
+                        en_vuelo, timeout=lote.segundos_restantes(), return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for tarea in listas:
+                        payload, result, error = tarea.result()
+                        if isinstance(error, CircuitoAbierto):
+                            # n8n caído: el archivo sigue pendiente para cuando se retome el job
+                            pausa = error
+                            continue
+                        hechos += 1
+                        print(f"Procesado archivo N° {hechos} de {len(pendientes)} → {payload['nombre_archivo']}")
+                        lote.agregar(payload, result, error)
+                        ok, fallidos = (ok + 1, fallidos) if error is None else (ok, fallidos + 1)
+                        await asyncio.to_thread(publicar_progreso, process_id, {
+                            "tipo": "archivo", "job_id": proc_job_id, "archivo": payload["nombre_archivo"],
+                            "estado": "ok" if error is None else "error", "error": str(error) if error else None,
+                            "actual": hechos, "total": len(pendientes), "ok": ok, "errores": fallidos,
+                        })
+
+                    if pausa and en_vuelo:
+                        # no seguir golpeando a n8n: se guarda lo hecho y se pausa el job
+                        for t in en_vuelo:
+                            t.cancel()
+                        en_vuelo = set()
+
+                if lote and (lote.lleno() or not en_vuelo):
+                    guardar_lote_job(session, lote.vaciar(), process, proc_job_id, mapa, claves_cache, worker_id)
     finally:
-        # 🚩 siempre marcar como terminado
-        with Session(engine) as session:
-            process = session.get(ChargeProcess, process_id)
-            process.is_processing = False
-            session.add(process)
-            session.commit()
+        # si algo corta el bucle, no dejar llamadas huerfanas contra n8n
+        for t in tareas:
+            t.cancel()
+
+    if pausa:
+        await asyncio.to_thread(publicar_progreso, process_id, {
+            "tipo": "pausa", "job_id": proc_job_id, "detalle": str(pausa), "actual": hechos, "total": len(pendientes),
+            "ok": ok, "errores": fallidos,
+        })
+        raise JobPausado(str(pausa), pausa.segundos)
+
+    try:
+        await asyncio.to_thread(cache_evaluaciones.purgar)
+    except Exception as e:
+        print("⚠️ No se pudo purgar la cache de evaluaciones:", e)
+
+    await asyncio.to_thread(publicar_progreso, process_id, {
+        "tipo": "fin", "job_id": proc_job_id, "actual": len(pendientes), "total": len(pendientes), "ok": ok, "errores": fallidos,
+    })
+    return "completado"
+
+
+async def ejecutar_con_callback(proc_job_id: int, process, payloads: List[dict], cacheados: dict,
+                                claves_cache: Dict[str, tuple], token: Callable[[], Optional[str]],
+                                worker_id: Optional[str] = None):
+    """
+    ejecutar_procesamiento_cvs con N8N_MODO_CALLBACK: los CVs se entregan a n8n con un
+    correlation_id (a lo más N8N_CALLBACK_EN_VUELO esperando a la vez) y los resultados los guarda
+    POST /procesos/n8n/callback. Termina cuando no queda ninguno esperando; los vencidos cuentan
+    como no procesados. En una reanudación no se reenvían los que siguen esperando callback.
+    """
+    if not callback_n8n.N8N_CALLBACK_URL or not callback_n8n.N8N_CALLBACK_SECRET:
+        raise RuntimeError("N8N_MODO_CALLBACK requiere N8N_CALLBACK_URL y N8N_CALLBACK_SECRET")
+    process_id = process.id
+
+    # lo que ya está en la cache de evaluaciones se guarda sin llamar a n8n
+    cacheados_items, por_enviar = [], []
+    for payload in payloads:
+        clave = claves_cache.get(payload["drive_file_id"], (None,))[0]
+        if clave in cacheados:
+            cacheados_items.append((payload, cache_evaluaciones.resultado_para_archivo(cacheados[clave], payload), None))
+        else:
+            por_enviar.append(payload)
+    if cacheados_items:
+        with Session(engine, expire_on_commit=False) as session:
+            mapa = MapaPostulantes()
+            mapa.precargar(session, [p["url_cv"] for p, _, _ in cacheados_items], [p["drive_file_id"] for p, _, _ in cacheados_items])
+            for i in range(0, len(cacheados_items), PERSISTENCIA_LOTE_TAMANO):
+                guardar_lote_job(session, cacheados_items[i:i + PERSISTENCIA_LOTE_TAMANO], process, proc_job_id, mapa,
+                                 worker_id=worker_id)
+
+    esperando = await asyncio.to_thread(callback_n8n.en_vuelo, proc_job_id)
+    por_enviar = [p for p in por_enviar if p["drive_file_id"] not in esperando]
+    await asyncio.to_thread(publicar_progreso, process_id, {
+        "tipo": "inicio", "job_id": proc_job_id, "actual": len(cacheados_items), "total": len(payloads),
+        "ok": len(cacheados_items), "errores": 0,
+    })
+
+    pausa = None
+    while True:
+        await asyncio.to_thread(callback_n8n.barrer_vencidas)
+        esperando = await asyncio.to_thread(callback_n8n.en_vuelo, proc_job_id)
+        cupo = callback_n8n.N8N_CALLBACK_EN_VUELO - len(esperando)
+        if por_enviar and not pausa and cupo > 0:
+            tanda, por_enviar = por_enviar[:cupo], por_enviar[cupo:]
+            ids = await asyncio.to_thread(
+                callback_n8n.registrar_solicitudes, proc_job_id, process_id, tanda, claves_cache, worker_id
+            )
+            errores = await asyncio.gather(*(
+                callback_n8n.enviar(cid, {**p, "token": token()}) for cid, p in zip(ids, tanda)
+            ))
+            no_enviadas = [cid for cid, e in zip(ids, errores) if isinstance(e, CircuitoAbierto)]
+            if no_enviadas:
+                # n8n caído: esos archivos siguen pendientes para cuando se retome el job
+                pausa = next(e for e in errores if isinstance(e, CircuitoAbierto))
+                await asyncio.to_thread(callback_n8n.cancelar, no_enviadas)
+            for cid, e in zip(ids, errores):
+                if e is not None and not isinstance(e, CircuitoAbierto):
+                    await asyncio.to_thread(registrar_callback, cid, None, f"n8n no aceptó el CV: {e}")
+            continue
+        if not esperando and (pausa or not por_enviar):
+            break
+        await asyncio.sleep(callback_n8n.N8N_CALLBACK_POLL_SEGUNDOS)
+
+    with Session(engine) as session:
+        proc_job = session.get(ProcesamientoJob, proc_job_id)
+        ok, fallidos = proc_job.procesados, proc_job.no_procesados
+    if pausa:
+        await asyncio.to_thread(publicar_progreso, process_id, {
+            "tipo": "pausa", "job_id": proc_job_id, "detalle": str(pausa), "actual": ok + fallidos,
+            "total": len(payloads), "ok": ok, "errores": fallidos,
+        })
+        raise JobPausado(str(pausa), pausa.segundos)
+
+    try:
+        await asyncio.to_thread(cache_evaluaciones.purgar)
+    except Exception as e:
+        print("⚠️ No se pudo purgar la cache de evaluaciones:", e)
+
+    await asyncio.to_thread(publicar_progreso, process_id, {
+        "tipo": "fin", "job_id": proc_job_id, "actual": ok + fallidos, "total": len(payloads), "ok": ok, "errores": fallidos,
+    })
+    return "completado"
+
+
+def registrar_callback(correlation_id: str, resultado: Optional[dict], error: Optional[str]) -> dict:
+    """
+    Guarda el resultado (o el error) de una solicitud en modo callback con el mismo camino que
+    el modo síncrono. Idempotente: un callback repetido no vuelve a guardar.
+    """
+    with Session(engine, expire_on_commit=False) as session:
+        solicitud = session.get(SolicitudN8N, correlation_id)
+        if not solicitud:
+            raise HTTPException(status_code=404, detail="Solicitud no encontrada")
+        if solicitud.estado in ("completado", "error"):
+            return {"correlation_id": correlation_id, "estado": solicitud.estado, "duplicado": True}
+        if solicitud.estado != "enviado":
+            raise HTTPException(status_code=409, detail=f"La solicitud está {solicitud.estado}")
+
+        process = session.get(ChargeProcess, solicitud.process_id)
+        payload, job_id = solicitud.payload, solicitud.job_id
+        claves = None
+        if solicitud.clave_cache:
+            claves = {solicitud.drive_file_id: (solicitud.clave_cache, solicitud.contenido_hash, solicitud.contexto_hash)}
+        item = (payload, None, RuntimeError(error)) if error else (payload, resultado, None)
+        procesados, no_procesados, total = registrar_lote_job(session, [item], process, job_id, None, claves)
+
+        estado = "error" if error else "completado"
+        # solo si sigue esperando: otro callback igual o el barrido pudieron cerrarla mientras tanto
+        marcada = session.exec(  # type: ignore
+            update(SolicitudN8N)
+            .where(SolicitudN8N.id == correlation_id, SolicitudN8N.estado == "enviado")
+            .values(estado=estado, error=error, respondido_en=peru_time())
+        ).rowcount
+        if not marcada:
+            session.rollback()
+            session.refresh(solicitud)
+            if solicitud.estado in ("completado", "error"):
+                return {"correlation_id": correlation_id, "estado": solicitud.estado, "duplicado": True}
+            raise HTTPException(status_code=409, detail=f"La solicitud está {solicitud.estado}")
+        session.commit()
+
+    publicar_progreso(process.id, {
+        "tipo": "archivo", "job_id": job_id, "archivo": payload.get("nombre_archivo"),
+        "estado": "error" if error else "ok", "error": error,
+        "actual": procesados + no_procesados, "total": total, "ok": procesados, "errores": no_procesados,
+    })
+    return {"correlation_id": correlation_id, "estado": estado}
+
+
+# Resultado de n8n en modo callback: lo autentica la firma HMAC (ver callback_n8n.py), no un usuario
+@routerprocess.post("/n8n/callback")
+async def recibir_callback_n8n(request: Request):
+    cuerpo = await request.body()
+    callback_n8n.verificar_firma(cuerpo, request.headers.get("x-n8n-timestamp"), request.headers.get("x-n8n-firma"))
+    try:
+        datos = json.loads(cuerpo)
+        correlation_id = str(datos["correlation_id"])
+        resultado = datos.get("resultado")
+        if isinstance(resultado, str):
+            resultado = json.loads(resultado)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Se espera JSON con correlation_id y resultado o error")
+    error = datos.get("error")
+    if not isinstance(resultado, dict) and not error:
+        raise HTTPException(status_code=400, detail="Se espera JSON con correlation_id y resultado o error")
+
+    return await asyncio.to_thread(registrar_callback, correlation_id, resultado, str(error) if error else None)
+
+
+#Estado de un job (antes de /{process_id} para que "jobs" no se tome como id)
+@routerprocess.get("/jobs/{job_id}")
+def get_job_status(job_id: int, user=Depends(get_current_user)):
+    with Session(engine) as session:
+        proc_job = session.get(ProcesamientoJob, job_id)
+        if not proc_job:
+            raise HTTPException(status_code=404, detail="Job no encontrado")
+
+        process = session.get(ChargeProcess, proc_job.process_id)
+        if user.role != "admin" and (not process or process.user_id != user.id):
+            raise HTTPException(status_code=403, detail="No autorizado")
+
+        return job_a_dict(proc_job)
 ######################  PRUEBAS #############################
  
 
@@ -606,6 +1054,8 @@ def get_process_detail(process_id: int, user=Depends(get_current_user)):
 
         #job = session.get(JobPosition, process.job_id)
         autor = session.get(User, process.user_id)
+        proc_job = ultimo_job(session, process_id)
+        job_finalizar = ultimo_job(session, process_id, "finalizar")
         
         return {
             "id": process.id,
@@ -621,6 +1071,8 @@ def get_process_detail(process_id: int, user=Depends(get_current_user)):
             "drive_folder_url": process.drive_folder_url,
             "end_process": process.end_process,
             "is_processing": process.is_processing,  # 🚩 nuevo
+            "job": job_a_dict(proc_job) if proc_job else None,
+            "job_finalizar": job_a_dict(job_finalizar) if job_finalizar else None,
         }
 
 # Obtener evaluaciones del historial por proceso
@@ -658,88 +1110,107 @@ def get_evaluaciones_por_proceso(process_id: int, user=Depends(get_current_user)
             for e in evaluaciones
         ]
 
-#Finalizar proceso
-@routerprocess.post("/{id}/finalizar")
-async def endless_process(
-id: int,
-request: Request,
-session: Session = Depends(get_session),
-current_user: User = Depends(get_current_user)
-):    
-    token = request.headers.get("authorization")
-    if not token:
-        raise HTTPException(status_code=401, detail="No se proporcionó token")
+# Estadísticas del proceso (rollup mantenido al guardar evaluaciones, sin leer las filas)
+@routerprocess.get("/{process_id}/estadisticas")
+def get_estadisticas_proceso(process_id: int, user=Depends(get_current_user)):
+    with Session(engine) as session:
+        process = session.get(ChargeProcess, process_id)
+        if not process:
+            raise HTTPException(status_code=404, detail="Proceso no encontrado")
 
-    process = session.get(ChargeProcess, id)
-    
-    if not process:
-        raise HTTPException(status_code=404, detail="Proceso no encontrado")
-    if process.end_process:
-        raise HTTPException(status_code=400, detail="Este proceso ya fue finalizado")
-
-    # 1. Obtener evaluaciones con match ≥ 80
-    evaluations = session.exec(
-        select(EvaluacionCV).where(
-            EvaluacionCV.charge_process_id == id,
-            EvaluacionCV.match >= 80
-        )
-    ).all()
+        if user.role != "admin" and process.user_id != user.id:
+            raise HTTPException(status_code=403, detail="No autorizado")
+
+        return estadisticas.resumen(session, process_id)
+
+# Ranking de candidatos del proceso (top N por índice, páginas siguientes por keyset)
+@routerprocess.get("/{process_id}/ranking")
+def get_ranking_proceso(
+    process_id: int,
+    orden: str = Query("match_total"),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None),
+    solo_procesados: bool = Query(True),
+    user=Depends(get_current_user),
+):
+    """
+    `orden`: match_total (el match IA mientras no haya evaluación experta) o match.
+    `cursor`: el `siguiente_cursor` de la página anterior; las posiciones siguen desde ahí
+    y un re-puntaje entre páginas no repite ni salta a los demás candidatos.
+    """
+    if orden not in PUNTAJES:
+        raise HTTPException(status_code=400, detail="orden debe ser match_total o match")
+
+    with Session(engine) as session:
+        process = session.get(ChargeProcess, process_id)
+        if not process:
+            raise HTTPException(status_code=404, detail="Proceso no encontrado")
 
-    if not evaluations:
-        raise HTTPException(status_code=400, detail="No hay evaluaciones con match ≥ 80 para finalizar")
+        if user.role != "admin" and process.user_id != user.id:
+            raise HTTPException(status_code=403, detail="No autorizado")
 
-    # 2. Armar payload para n8n
-    payload = {
-        "proceso_id": id,
-        "evaluaciones": [
+        despues, posicion = None, 0
+        if cursor:
+            puntaje, id_cursor, posicion = decodificar_cursor_ranking(cursor)
+            despues = (puntaje, id_cursor)
+
+        filas = session.exec(consulta_ranking(process_id, orden, despues, solo_procesados).limit(limit)).all()
+
+        items = [
             {
-                "dni": e.dni_postulante,
-                "match": e.match,
+                "posicion": posicion + i,
+                "id": e.id,
                 "name": e.name,
-                "years_exper": e.years_exper,
-                "level_educa": e.level_educa,
-                "certif": e.certif,
-                "languages": e.languages,
-                "differential_advantages": e.differential_advantages,
+                "puntaje": puntaje,
+                "match": e.match,
+                "match_eval": e.match_eval,
+                "match_total": e.match_total,
+                "cv_procesado": e.cv_procesado,
+                "flag_shade": e.flag_shade,
+                "url_cv": e.url_cv,
+                "nombre_archivo": e.nombre_archivo,
+                "dni_postulante": e.dni_postulante,
             }
-            for e in evaluations
-        ],
-        "token": token
-    }
-    
-    # 3. Enviar a n8n
-    try:
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(
-                                N8N_ACTUALIZR_MATCHS_URL,
-                                json=payload
-                                ,timeout=httpx.Timeout(10800.0)
-                            )
-
-                response.raise_for_status()
-            
-            except httpx.TimeoutException:
-                raise HTTPException(status_code=504, detail="Tiempo de espera agotado al contactar con n8n")
-            except httpx.HTTPStatusError as e:
-                raise HTTPException(status_code=502, detail=f"Error desde n8n: {e.response.text}")
-        
-    except httpx.HTTPError as e:
-        raise HTTPException(status_code=502, detail=f"Error al llamar al flujo de n8n: {str(e)}")
-                
-    # 4. Marcar proceso como finalizado
-    process.end_process = True
-    session.add(process)
-    session.commit()
+            for i, (e, puntaje) in enumerate(filas, start=1)
+        ]
+        siguiente_cursor = None
+        if len(items) == limit:
+            ultimo = items[-1]
+            siguiente_cursor = codificar_cursor_ranking(ultimo["puntaje"], ultimo["id"], ultimo["posicion"])
+        return {"orden": orden, "items": items, "siguiente_cursor": siguiente_cursor}
 
-    return {
-        "detail": f"Proceso {id} finalizado correctamente.",
-        "total_enviados": len(evaluations)
-    }
+#Finalizar proceso (encola un job "finalizar"; lo ejecuta worker.py, ver finalizacion.py)
+@routerprocess.post("/{id}/finalizar")
+def endless_process(
+id: int,
+current_user: User = Depends(get_current_user)
+):
+
+    with Session(engine) as session:
+        process = session.get(ChargeProcess, id)
+
+        if not process:
+            raise HTTPException(status_code=404, detail="Proceso no encontrado")
+        if process.end_process:
+            raise HTTPException(status_code=400, detail="Este proceso ya fue finalizado")
+
+        hay_shortlist = session.exec(
+            select(EvaluacionCV.id).where(
+                EvaluacionCV.charge_process_id == id,
+                EvaluacionCV.match >= 80
+            ).limit(1)
+        ).first()
+        if hay_shortlist is None:
+            raise HTTPException(status_code=400, detail="No hay evaluaciones con match ≥ 80 para finalizar")
+
+        # los candidatos se envían a n8n por lotes y el proceso queda finalizado al confirmarse
+        # el último; si ya hay una finalización en curso se devuelve ese job
+        proc_job = encolar_job(session, id, "finalizar", creado_por=current_user.username)
+        return job_a_dict(proc_job)
 
 @routerprocess.post("/{id}/reactivar")
-async def reactivate_process(id: int, session: Session = Depends(get_session)):
-    process = session.get(ChargeProcess, id)
+async def reactivate_process(id: int, session: AsyncSession = Depends(get_async_session)):
+    process = await session.get(ChargeProcess, id)
     if not process:
         raise HTTPException(status_code=404, detail="Proceso no encontrado")
 
@@ -748,7 +1219,7 @@ async def reactivate_process(id: int, session: Session = Depends(get_session)):
 
     process.end_process = False
     session.add(process)
-    session.commit()
+    await session.commit()
     return {"detail": f"Proceso {id} reactivado exitosamente"} 
 
 #Creacion Form
@@ -838,54 +1309,75 @@ def update_evaluacion_match(eval_id: int, payload: dict = Body(...), user=Depend
             "match_total": ev.match_total
         }
 
-#API websocket
-# @routerprocess.websocket("/ws/{process_id}")
-# async def websocket_endpoint(websocket: WebSocket, process_id: int):
-#     # El cliente debe pasar token como query param: ?token=Bearer%20<token>
-#     token = websocket.query_params.get("token")
-#     if token and token.startswith("Bearer "):
-#         token = token.split(" ", 1)[1]
-#     if not token:
-#         # 4401 -> custom "no autorizado"
-#         await websocket.close(code=4401)
-#         return
-
-#     # validar token
-#     try:
-#         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-#         username = payload.get("sub")
-#         if not isinstance(username, str):
-#             raise JWTError("sub inválido")
-#     except JWTError:
-#         await websocket.close(code=4401)
-#         return
-
-#     # validar que el usuario tiene acceso al proceso
-#     try:
-#         with Session(engine) as session:
-#             user = session.exec(select(User).where(User.username == username)).first()
-#             if not user:
-#                 await websocket.close(code=4401)
-#                 return
-#             process = session.get(ChargeProcess, process_id)
-#             if not process:
-#                 await websocket.close(code=4403)  # no encontrado / prohibido
-#                 return
-#             if user.role != "admin" and process.user_id != user.id:
-#                 await websocket.close(code=4403)
-#                 return
-#     except Exception:
-#         await websocket.close(code=4401)
-#         return
-
-#     # conectar y mantener vivo
-#     await manager.connect(process_id, websocket)
-#     try:
-#         # loop para mantener la conexión abierta; los envíos son desde el backend
-#         while True:
-#             # Sólo mantenemos vivo. Si el cliente envía pings, esto los ignora.
-#             await asyncio.sleep(30)
-#     except WebSocketDisconnect:
-#         manager.disconnect(process_id, websocket)
-#     except Exception:
-#         manager.disconnect(process_id, websocket)
\ No newline at end of file
+#Progreso en tiempo real (WebSocket, con SSE como alternativa)
+def autorizar_progreso(token: Optional[str], process_id: int):
+    """
+    Valida el token enviado por query param (?token=Bearer%20<token>) y el acceso al proceso.
+    Devuelve el último job del proceso como estado inicial, o None si no está autorizado.
+    """
+    if token and token.startswith("Bearer "):
+        token = token.split(" ", 1)[1]
+    if not token:
+        return None
+    try:
+        user = get_user_from_token(token)
+    except HTTPException:
+        return None
+    with Session(engine) as session:
+        process = session.get(ChargeProcess, process_id)
+        if not process or (user.role != "admin" and process.user_id != user.id):
+            return None
+        proc_job = ultimo_job(session, process_id)
+        return {"tipo": "estado", "process_id": process_id, "job": job_a_dict(proc_job) if proc_job else None}
+
+
+@routerprocess.websocket("/ws/{process_id}")
+async def websocket_progreso(websocket: WebSocket, process_id: int):
+    inicial = await asyncio.to_thread(autorizar_progreso, websocket.query_params.get("token"), process_id)
+    if inicial is None:
+        # 4401 -> custom "no autorizado"
+        await websocket.close(code=4401)
+        return
+
+    await websocket.accept()
+    suscripcion = suscribir(process_id)
+    try:
+        await websocket.send_json(inicial)
+        # los envíos son desde el backend; si no hay eventos se manda un ping
+        while True:
+            try:
+                evento = await suscripcion.siguiente(PROGRESO_PING_SEGUNDOS)
+            except asyncio.TimeoutError:
+                evento = {"tipo": "ping"}
+            await websocket.send_json(evento)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        desuscribir(suscripcion)
+
+
+@routerprocess.get("/sse/{process_id}")
+async def sse_progreso(process_id: int, request: Request, token: Optional[str] = Query(None)):
+    inicial = await asyncio.to_thread(autorizar_progreso, token, process_id)
+    if inicial is None:
+        raise HTTPException(status_code=401, detail="No autorizado")
+
+    async def eventos():
+        suscripcion = suscribir(process_id)
+        try:
+            yield f"data: {json.dumps(inicial, default=str)}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    evento = await suscripcion.siguiente(PROGRESO_PING_SEGUNDOS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield f"data: {json.dumps(evento, default=str)}\n\n"
+        finally:
+            desuscribir(suscripcion)
+
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,76 @@
+# progreso.py
+# Avance del procesamiento de CVs en tiempo real. El loop del job publica un evento por
+# archivo (publicar_progreso) y cada proceso del API lo recibe por LISTEN/NOTIFY y lo
+# reparte a sus WebSockets / SSE suscritos al proceso.
+import os
+import asyncio
+from typing import Dict, Set
+from dotenv import load_dotenv
+from notificaciones import publicar, escucha
+from metricas import incrementar, registrar_fuente
+
+load_dotenv()
+
+CANAL_PROGRESO = "progreso_cvs"
+PROGRESO_COLA_MAX = int(os.getenv("PROGRESO_COLA_MAX", "100"))  # eventos pendientes por suscriptor
+
+
+class Suscripcion:
+    """
+    Cola acotada de un cliente. Si el cliente no lee a tiempo se descarta el evento
+    más viejo: cada evento trae el avance acumulado, así que basta con el último.
+    """
+
+    def __init__(self, process_id: int):
+        self.process_id = process_id
+        self.cola: asyncio.Queue = asyncio.Queue(maxsize=PROGRESO_COLA_MAX)
+        self.descartados = 0
+
+    def entregar(self, evento: dict):
+        if self.cola.full():
+            self.cola.get_nowait()
+            self.descartados += 1
+            incrementar("progreso_eventos_descartados")
+        self.cola.put_nowait(evento)
+
+    async def siguiente(self, timeout: float) -> dict:
+        """Próximo evento; lanza asyncio.TimeoutError si no llega ninguno en `timeout` seg."""
+        return await asyncio.wait_for(self.cola.get(), timeout)
+
+
+_suscripciones: Dict[int, Set[Suscripcion]] = {}
+
+
+def _recibir(evento: dict):
+    for s in list(_suscripciones.get(evento.get("process_id"), ())):
+        s.entregar(evento)
+
+
+def suscribir(process_id: int) -> Suscripcion:
+    s = Suscripcion(process_id)
+    _suscripciones.setdefault(process_id, set()).add(s)
+    return s
+
+
+def desuscribir(s: Suscripcion):
+    conjunto = _suscripciones.get(s.process_id, set())
+    conjunto.discard(s)
+    if not conjunto:
+        _suscripciones.pop(s.process_id, None)
+
+
+def publicar_progreso(process_id: int, evento: dict):
+    """Publica un evento de avance del proceso (bloqueante; desde async usar asyncio.to_thread)."""
+    try:
+        publicar(CANAL_PROGRESO, {"process_id": process_id, **evento})
+    except Exception as e:
+        # el progreso es informativo: nunca debe cortar el procesamiento
+        print(f"⚠️ No se pudo publicar progreso del proceso {process_id}:", e)
+
+
+escucha.suscribir(CANAL_PROGRESO, _recibir)
+
+registrar_fuente("progreso", lambda: {
+    "suscriptores": sum(len(v) for v in _suscripciones.values()),
+    "procesos": len(_suscripciones),
+})
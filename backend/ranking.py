@@ -0,0 +1,31 @@
+# ranking.py
+# Shortlist de candidatos por proceso, ordenada por match o por match_total. No hay tabla
+# aparte que mantener: los índices ix_evaluacioncv_ranking_match / _total (proceso, puntaje, id)
+# son el ranking ya ordenado y Postgres los actualiza en cada INSERT y en cada re-puntuación
+# (PUT /procesos/evaluaciones/{id}). Leer el top N es recorrer N entradas del índice hacia
+# atrás; las páginas siguientes siguen por keyset desde el último (puntaje, id).
+from typing import Optional, Tuple
+from sqlmodel import select, func, tuple_
+from models import EvaluacionCV
+
+# la expresión de "match_total" debe coincidir con la de ix_evaluacioncv_ranking_total
+PUNTAJES = {
+    "match": EvaluacionCV.match,
+    "match_total": func.coalesce(EvaluacionCV.match_total, EvaluacionCV.match),
+}
+
+
+def consulta_ranking(process_id: int, orden: str, despues: Optional[Tuple[float, int]] = None,
+                     solo_procesados: bool = True):
+    """SELECT de (EvaluacionCV, puntaje) del proceso en orden de ranking, sin LIMIT."""
+    puntaje = PUNTAJES[orden]
+    query = (
+        select(EvaluacionCV, puntaje.label("puntaje"))
+        .where(EvaluacionCV.charge_process_id == process_id)
+        .order_by(puntaje.desc(), EvaluacionCV.id.desc())  # type: ignore
+    )
+    if solo_procesados:
+        query = query.where(EvaluacionCV.cv_procesado == True)  # noqa: E712
+    if despues is not None:
+        query = query.where(tuple_(puntaje, EvaluacionCV.id) < tuple_(*despues))
+    return query
@@ -3,6 +3,7 @@ from sqlmodel import Session, select
 from models import User, UserUpdate, PasswordChange, PasswordChangeLog
 from auth import hash_password, verify_password, create_access_token, require_admin, get_current_user
 from cargabd import engine, get_session
+from cache_usuarios import invalidar_usuario
 from typing import List
 
 routeruser = APIRouter(prefix="/usuarios", tags=["Usuarios"])
@@ -24,6 +25,7 @@ def change_role_user(
         
         user.role = new_role
         session.commit()
+        invalidar_usuario(user.username)
         return {"ok": True, "message": f"Rol cambiado a {new_role}"}
 
 #Editar usuario
@@ -53,6 +55,7 @@ def update_user(
         session.add(update_log)
         session.commit()
         session.refresh(user)
+        invalidar_usuario(username_old, new_username)
 
     return {"ok": True, "message": f"Usuario actualizado a {new_username}"}
 
@@ -67,6 +70,7 @@ def enable_user(user_id: int):
         
         user.state = True
         session.commit()
+        invalidar_usuario(user.username)
         return {"ok": True, "message": f"Usuario {user.username} reactivado"}
 
 #Desactivar usuario
@@ -83,6 +87,7 @@ def disable_user(user_id: int):
         
         user.state = False
         session.commit()
+        invalidar_usuario(user.username)
         return {"ok": True, "message": f"Usuario {user.username} desactivado"}
 
 #Cambio de contraseña
@@ -115,6 +120,7 @@ def cambiar_password(
         session.add(log)
         
         session.commit()
+        invalidar_usuario(user.username)
         return {"ok": True, "message": f"Contraseña actualizada para {user.username}"}
 
 #Auditoria
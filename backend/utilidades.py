@@ -1,9 +1,13 @@
 # utils/extraccion_datos.py
 import re
+from extraccion_cv import extraer_texto
 
 def extraer_datos_desde_pdf(contenido: bytes) -> dict:
-    texto = contenido.decode("latin-1", errors="ignore")  # Ajustar según encoding del PDF
-    
+    # texto extraído de verdad (PDF o DOCX); decodificar los bytes como latin-1 solo servía
+    # con streams sin comprimir. Bloqueante: desde async usar extraccion_cv.texto_de_cv
+    return extraer_datos(extraer_texto(contenido)["texto"])
+
+def extraer_datos(texto: str) -> dict:
     return {
         "dni": extraer_dni(texto),
         "nombre": extraer_nombre(texto),
@@ -26,7 +30,8 @@ def extraer_telefono(texto):
 
 def extraer_nombre(texto):
     # Lógica básica, puedes mejorarla con NLP
-    match = re.search(r"(?i)(?:nombre\s*completo|postulante)[:\-]?\s*([A-ZÁÉÍÓÚÑ\s]{10,})", texto)
+    # el nombre termina en el salto de línea (con texto real \s se comía las líneas siguientes)
+    match = re.search(r"(?i)(?:nombre\s*completo|postulante)[:\-]?[ \t]*([A-ZÁÉÍÓÚÑ ]{10,})", texto)
     return match.group(1).strip() if match else "Nombre no detectado"
 
 def extraer_direccion(texto):
@@ -0,0 +1,65 @@
+# verificar_consultas.py
+# Regresión de N+1 en /procesos/listar: cuenta las sentencias SQL que emite el endpoint con
+# páginas de distinto tamaño y falla si el número crece con la cantidad de filas.
+#   python verificar_consultas.py                # contra la BD configurada en DATABASE_URL
+#   python verificar_consultas.py --maximo 2
+# Antes del cambio un admin listando 2000 procesos emitía ~6000 consultas.
+import argparse
+from types import SimpleNamespace
+from sqlalchemy import event
+from sqlmodel import Session, select
+from cargabd import engine
+from models import User
+from procesos import list_process
+
+
+class ContadorSentencias:
+    def __init__(self):
+        self.sentencias = []
+
+    def _antes(self, conn, cursor, statement, parameters, context, executemany):
+        self.sentencias.append(statement)
+
+    def __enter__(self):
+        event.listen(engine, "before_cursor_execute", self._antes)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(engine, "before_cursor_execute", self._antes)
+
+
+def contar_sentencias(usuario, limit: int):
+    with ContadorSentencias() as contador:
+        respuesta = list_process(
+            job_id=None, state=None, area=None, fecha=None, search=None,
+            offset=0, limit=limit, modo_total="exacto", user=usuario,
+        )
+    return len(contador.sentencias), len(respuesta["items"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verifica que /procesos/listar no haga N+1")
+    parser.add_argument("--maximo", type=int, default=2, help="sentencias permitidas por llamada (página + total)")
+    args = parser.parse_args()
+
+    engine.echo = False
+    usuarios = [("admin", SimpleNamespace(id=None, role="admin"))]
+    with Session(engine) as session:
+        comun = session.exec(select(User).where(User.role != "admin").limit(1)).first()
+    if comun:
+        usuarios.append((f"usuario {comun.username}", SimpleNamespace(id=comun.id, role=comun.role)))
+
+    fallas = 0
+    for nombre, usuario in usuarios:
+        conteos = {}
+        for limit in (1, 50, 500):
+            sentencias, filas = contar_sentencias(usuario, limit)
+            conteos[limit] = sentencias
+            print(f"{nombre:<20} limit={limit:<4} filas={filas:<4} sentencias={sentencias}")
+        if len(set(conteos.values())) > 1 or max(conteos.values()) > args.maximo:
+            fallas += 1
+            print(f"FALLA {nombre}: el número de sentencias depende de las filas o supera {args.maximo}")
+
+    if fallas:
+        raise SystemExit(1)
+    print("\nOK: número de sentencias constante")
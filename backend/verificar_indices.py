@@ -0,0 +1,159 @@
+# verificar_indices.py
+# Corre EXPLAIN ANALYZE de las consultas calientes sobre evaluacioncv y verifica que cada
+# una use uno de los índices esperados (migración "indices compuestos evaluacioncv").
+#   python verificar_indices.py                  # con los datos reales
+#   python verificar_indices.py --sin-seqscan    # BD de desarrollo con pocas filas
+# En tablas chicas el planner prefiere con razón un Seq Scan; --sin-seqscan lo desalienta
+# para comprobar que el índice al menos es utilizable. Sale con código 1 si alguna falla.
+import json
+import argparse
+from sqlmodel import Session, select, desc, func, tuple_
+from cargabd import engine
+from models import EvaluacionCV
+from ranking import consulta_ranking
+
+NODOS_INDICE = ("Index Scan", "Index Only Scan", "Bitmap Index Scan")
+
+
+def valores_de_prueba(session: Session) -> dict:
+    """Proceso y DNI con más evaluaciones: el peor caso de cada consulta."""
+    proceso = session.exec(
+        select(EvaluacionCV.charge_process_id)
+        .where(EvaluacionCV.charge_process_id.is_not(None))  # type: ignore
+        .group_by(EvaluacionCV.charge_process_id)
+        .order_by(desc(func.count()))
+        .limit(1)
+    ).first()
+    dni = session.exec(
+        select(EvaluacionCV.dni_postulante)
+        .where(EvaluacionCV.dni_postulante.is_not(None))  # type: ignore
+        .group_by(EvaluacionCV.dni_postulante)
+        .order_by(desc(func.count()))
+        .limit(1)
+    ).first()
+    cursor = session.exec(
+        select(EvaluacionCV.date_create, EvaluacionCV.id)
+        .order_by(desc(EvaluacionCV.date_create), desc(EvaluacionCV.id))
+        .offset(1000)
+        .limit(1)
+    ).first()
+    ranking = session.exec(consulta_ranking(proceso or 0, "match_total").offset(1000).limit(1)).first()
+    return {
+        "proceso": proceso or 0,
+        "dni": dni or "",
+        "cursor": tuple(cursor) if cursor else None,
+        "cursor_ranking": (ranking[1], ranking[0].id) if ranking else None,
+    }
+
+
+def consultas_calientes(v: dict) -> list:
+    """(descripción, consulta, índices aceptables)"""
+    consultas = [
+        (
+            "finalizar proceso (match >= 80)",
+            select(EvaluacionCV).where(EvaluacionCV.charge_process_id == v["proceso"], EvaluacionCV.match >= 80),
+            {"ix_evaluacioncv_ranking_match"},
+        ),
+        (
+            "ranking top 50 (match_total)",
+            consulta_ranking(v["proceso"], "match_total").limit(50),
+            {"ix_evaluacioncv_ranking_total"},
+        ),
+        (
+            "ranking top 50 (match)",
+            consulta_ranking(v["proceso"], "match").limit(50),
+            {"ix_evaluacioncv_ranking_match"},
+        ),
+        (
+            "historial del postulante (dni)",
+            select(EvaluacionCV).where(EvaluacionCV.dni_postulante == v["dni"]),
+            {"ix_evaluacioncv_dni_proceso"},
+        ),
+        (
+            "actualizar match (dni + proceso)",
+            select(EvaluacionCV).where(
+                EvaluacionCV.dni_postulante == v["dni"], EvaluacionCV.charge_process_id == v["proceso"]
+            ),
+            {"ix_evaluacioncv_dni_proceso"},
+        ),
+        (
+            "historial general (date_create DESC)",
+            select(EvaluacionCV).order_by(desc(EvaluacionCV.date_create), desc(EvaluacionCV.id)).limit(20),
+            {"ix_evaluacioncv_fecha_id"},
+        ),
+        (
+            "URLs evaluadas del proceso",
+            select(EvaluacionCV.url_cv).where(EvaluacionCV.charge_process_id == v["proceso"]),
+            {"ix_evaluacioncv_proceso_url"},
+        ),
+        (
+            "CVs del proceso",
+            select(EvaluacionCV).where(EvaluacionCV.charge_process_id == v["proceso"]),
+            {"ix_evaluacioncv_proceso_url", "ix_evaluacioncv_ranking_match"},
+        ),
+    ]
+    if v["cursor"]:
+        consultas.append((
+            "historial general (cursor keyset)",
+            select(EvaluacionCV)
+            .where(tuple_(EvaluacionCV.date_create, EvaluacionCV.id) < tuple_(*v["cursor"]))
+            .order_by(desc(EvaluacionCV.date_create), desc(EvaluacionCV.id))
+            .limit(20),
+            {"ix_evaluacioncv_fecha_id"},
+        ))
+    if v["cursor_ranking"]:
+        consultas.append((
+            "ranking (cursor keyset)",
+            consulta_ranking(v["proceso"], "match_total", v["cursor_ranking"]).limit(50),
+            {"ix_evaluacioncv_ranking_total"},
+        ))
+    return consultas
+
+
+def nodos(plan: dict):
+    yield plan
+    for hijo in plan.get("Plans", []):
+        yield from nodos(hijo)
+
+
+def explicar(session: Session, query) -> dict:
+    compilada = query.compile(dialect=engine.dialect)
+    plan = session.connection().exec_driver_sql(
+        f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {compilada}", compilada.params
+    ).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verifica que las consultas calientes usen índices")
+    parser.add_argument("--sin-seqscan", action="store_true", help="SET enable_seqscan = off (BD con pocas filas)")
+    args = parser.parse_args()
+
+    engine.echo = False
+    if engine.dialect.name != "postgresql":
+        raise SystemExit("verificar_indices.py requiere Postgres")
+
+    fallas = 0
+    with Session(engine) as session:
+        if args.sin_seqscan:
+            session.connection().exec_driver_sql("SET enable_seqscan = off")
+        v = valores_de_prueba(session)
+        print(f"Proceso: {v['proceso']}  DNI: {v['dni'] or '-'}\n")
+        for descripcion, query, esperados in consultas_calientes(v):
+            resultado = explicar(session, query)
+            usados = {
+                n.get("Index Name") for n in nodos(resultado["Plan"])
+                if n["Node Type"] in NODOS_INDICE and n.get("Relation Name", "evaluacioncv") == "evaluacioncv"
+            }
+            ok = bool(usados & esperados)
+            fallas += not ok
+            tipos = sorted({n["Node Type"] for n in nodos(resultado["Plan"]) if "Scan" in n["Node Type"]})
+            print(f"{'OK   ' if ok else 'FALLA'} {descripcion:<40} {resultado['Execution Time']:8.2f} ms  "
+                  f"{', '.join(tipos)} [{', '.join(sorted(i for i in usados if i)) or 'sin índice'}]")
+        session.rollback()
+
+    if fallas:
+        raise SystemExit(f"\n{fallas} consulta(s) sin el índice esperado")
+    print("\nTodas las consultas calientes usan índice")
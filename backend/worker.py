@@ -0,0 +1,115 @@
+# worker.py
+# Proceso separado que ejecuta los jobs encolados por el API.
+# Uso: python worker.py
+import os
+import socket
+import asyncio
+from dotenv import load_dotenv
+from cargabd import create_db_and_tables
+from cola_jobs import (reclamar_job, latido, finalizar_job, reintentar_mas_tarde, pausar_job, JobPausado,
+                       LeasePerdido, JOB_LEASE_SEGUNDOS)
+from procesos import ejecutar_procesamiento_cvs
+from finalizacion import ejecutar_finalizacion
+from google_oauth import refrescar_drive_periodicamente
+from clientes_n8n import iniciar_clientes, cerrar_clientes
+from callback_n8n import N8N_MODO_CALLBACK, barrer_periodicamente
+
+load_dotenv()
+
+WORKER_JOBS_SIMULTANEOS = int(os.getenv("WORKER_JOBS_SIMULTANEOS", "2"))
+WORKER_POLL_SEGUNDOS = float(os.getenv("WORKER_POLL_SEGUNDOS", "3"))
+
+# tipo de job -> coroutine que lo ejecuta: (job_id, worker_id) -> estado final
+EJECUTORES = {
+    "procesar_cvs": ejecutar_procesamiento_cvs,
+    "finalizar": ejecutar_finalizacion,
+}
+
+
+async def mantener_latido(job_id: int, worker_id: str, tarea: asyncio.Task):
+    """
+    Renueva el lease mientras el job corre (si el worker muere, otro lo retoma). Si el lease
+    se perdió (otro worker reclamó el job) cancela el ejecutor: seguir duplicaría el trabajo.
+    """
+    while True:
+        await asyncio.sleep(max(JOB_LEASE_SEGUNDOS / 3, 1))
+        try:
+            vigente = await asyncio.to_thread(latido, job_id, worker_id)
+        except Exception as e:
+            # BD caída un momento: el lease aún puede estar vigente, se reintenta en el próximo latido
+            print(f"Error renovando el lease del job {job_id}:", e)
+            continue
+        if not vigente:
+            print(f"⚠️ Job {job_id}: lease perdido, se detiene")
+            tarea.cancel()
+            return
+
+
+async def ejecutar_job(job_id: int, tipo: str, worker_id: str):
+    tarea = asyncio.create_task(EJECUTORES[tipo](job_id, worker_id))
+    tarea_latido = asyncio.create_task(mantener_latido(job_id, worker_id, tarea))
+    try:
+        try:
+            estado = await tarea
+        except asyncio.CancelledError:
+            if not tarea_latido.done():
+                raise  # se está apagando el worker
+            raise LeasePerdido(f"Job {job_id}: ya no es de {worker_id}")
+        await asyncio.to_thread(finalizar_job, job_id, estado or "completado", None, worker_id)
+        print(f"✅ Job {job_id} ({tipo}) terminado: {estado}")
+    except LeasePerdido as e:
+        # el job es de otro worker: no tocar su estado
+        print(f"⚠️ Job {job_id} ({tipo}) abandonado:", e)
+    except JobPausado as e:
+        print(f"⏸️ Job {job_id} ({tipo}) pausado {e.segundos:.0f}s:", e)
+        await asyncio.to_thread(pausar_job, job_id, str(e), e.segundos, worker_id)
+    except Exception as e:
+        print(f"❌ Job {job_id} ({tipo}) falló, se reintentará:", e)
+        await asyncio.to_thread(reintentar_mas_tarde, job_id, str(e), worker_id)
+    finally:
+        tarea_latido.cancel()
+        tarea.cancel()
+
+
+async def bucle_worker(slot: int, worker_id: str):
+    # el lease es por slot: si el mismo proceso re-reclama un job vencido en otro slot,
+    # el slot anterior igual ve que lo perdió
+    worker_id = f"{worker_id}#{slot}"
+    while True:
+        try:
+            reclamado = await asyncio.to_thread(reclamar_job, worker_id, list(EJECUTORES))
+        except Exception as e:
+            print("Error reclamando job:", e)
+            reclamado = None
+
+        if reclamado is None:
+            await asyncio.sleep(WORKER_POLL_SEGUNDOS)
+            continue
+
+        job_id, tipo = reclamado
+        print(f"🔧 [{worker_id}] ejecutando job {job_id} ({tipo})")
+        await ejecutar_job(job_id, tipo, worker_id)
+
+
+async def main():
+    create_db_and_tables()
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    print(f"Worker {worker_id} iniciado con {WORKER_JOBS_SIMULTANEOS} slots")
+    iniciar_clientes()
+    # el event loop solo guarda referencias débiles a las tareas: sin este set se las puede
+    # llevar el recolector de basura a mitad de camino
+    tareas_fondo = {asyncio.create_task(refrescar_drive_periodicamente())}
+    if N8N_MODO_CALLBACK:
+        # solicitudes sin callback (también las de jobs que ya terminaron o fallaron)
+        tareas_fondo.add(asyncio.create_task(barrer_periodicamente()))
+    try:
+        await asyncio.gather(*(bucle_worker(i, worker_id) for i in range(WORKER_JOBS_SIMULTANEOS)))
+    finally:
+        for tarea in tareas_fondo:
+            tarea.cancel()
+        await asyncio.gather(*tareas_fondo, return_exceptions=True)
+        await cerrar_clientes()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,8 +1,8 @@
 import { useEffect, useState } from "react"; //, useRef
 import { useParams } from "react-router-dom";
 import { useAuth } from "../context/AuthContext";
-import { obtenerDetalleProceso, procesarCVsProceso, finalizarProcesoCarga, reactivarProceso } from "../services/procesosService";
-// import { connectWS } from "../services/WebsocketService";
+import { obtenerDetalleProceso, obtenerEstadisticasProceso, procesarCVsProceso, finalizarProcesoCarga, reactivarProceso, obtenerJob } from "../services/procesosService";
+import { connectProgreso } from "../services/WebsocketService";
 import API from "../api/axios";
 import { useNavigate } from "react-router-dom";
 import ModalDetalleEvaluacion from "../components/ModalDetalleEvaluacion";
@@ -18,6 +18,7 @@ const DetalleProcesoCarga = () => {
 
   const [proceso, setProceso] = useState(null);
   const [evaluacionesHistorial, setEvaluacionesHistorial] = useState([]);
+  const [estadisticas, setEstadisticas] = useState(null);
   const [evalSeleccionada, setEvalSeleccionada] = useState(null);
   const [cargando, setCargando] = useState(true);
   const [procesando, setProcesando] = useState(false);
@@ -31,12 +32,15 @@ const DetalleProcesoCarga = () => {
   const [mostrarSombreados, setMostrarSombreados] = useState(false);
   const [savingMap, setSavingMap] = useState({});
   const [tieneCambios, setTieneCambios] = useState(false);
-  // const [progress, setProgress] = useState({
-  //   current: 0,
-  //   total: 0,
-  //   file: "",
-  //   completed: false,
-  // });
+  const [jobActivo, setJobActivo] = useState(null);
+  const [progress, setProgress] = useState({
+    current: 0,
+    total: 0,
+    file: "",
+    ok: 0,
+    errores: 0,
+    completed: false,
+  });
 
 
   const fetchData = async () => {
@@ -45,6 +49,13 @@ const DetalleProcesoCarga = () => {
       setProceso(detalle);
       setFinalizado(detalle.end_process === true);
       setProcesando(detalle.is_processing === true); // 🚩 importante
+      // si hay un job en curso (p.ej. se recargó la página) seguir su avance
+      const enCurso = [detalle.job, detalle.job_finalizar].find(
+        (j) => j && ["pendiente", "en_proceso"].includes(j.estado)
+      );
+      if (enCurso) {
+        setJobActivo(enCurso);
+      }
       await fetchHistorial(id);
     } catch (error) {
       console.error("Error al obtener detalle o historial:", error);
@@ -59,6 +70,7 @@ const DetalleProcesoCarga = () => {
   }, [id, token]);
 
   const fetchHistorial = async (id) => {
+    fetchEstadisticas(id);
     try {
       const response = await API.get(`/procesos/${id}/evaluaciones`, {
         headers: { Authorization: `Bearer ${token}` }, //llevarlo a services
@@ -69,6 +81,15 @@ const DetalleProcesoCarga = () => {
     }
   };
 
+  // conteos, histograma y promedios vienen ya agregados del backend
+  const fetchEstadisticas = async (id) => {
+    try {
+      setEstadisticas(await obtenerEstadisticasProceso(id, token));
+    } catch (error) {
+      console.error("Error al obtener estadísticas:", error);
+    }
+  };
+
   useEffect(() => {
     const handleBeforeUnload = (e) => {
       if (tieneCambios) {
@@ -157,56 +178,27 @@ const DetalleProcesoCarga = () => {
         setSavingMap(prev => ({ ...prev, [evalId]: false }));
       }
     };
-  //
-  // useEffect(() => {
-  //   if (!id || !token) return;
-
-  //   // Si ya hay conexión, no crear otra
-  //   if (wsRef.current) return;
-
-  //   const onMessage = (data) => {
-  //     if (data.error === "token_invalid") {
-  //       console.warn("WS: token inválido recibido");
-  //       return;
-  //     }
-  //     setProgress((prev) => ({
-  //       current: data.current ?? prev.current,
-  //       total: data.total ?? prev.total,
-  //       file: data.file ?? prev.file,
-  //       completed: data.completed ?? prev.completed,
-  //     }));
-  //   };
-
-  //   const onOpen = () => {
-  //     console.log("WS abierta (DetalleProcesoCarga)");
-  //   };
-
-  //   const onClose = (ev) => {
-  //     // si el cierre indica token inválido (4401) loguear y limpiar
-  //     if (ev && ev.code === 4401) {
-  //       console.warn("WS cerrado: token inválido o no autorizado (4401).");
-  //     }
-  //     wsRef.current = null;
-  //   };
-
-  //   try {
-  //     const ws = connectWS(id, token, onMessage, onOpen, onClose);
-  //     wsRef.current = ws;
-  //   } catch (e) {
-  //     console.error("No se pudo conectar al WS:", e);
-  //   }
-
-  //   // cleanup al desmontar o cambiar id/token
-  //   return () => {
-  //     try {
-  //       if (wsRef.current) {
-  //         wsRef.current.close();
-  //         wsRef.current = null;
-  //       }
-  //     } catch {}
-  //   };
-  // }, [id, token]);
-  //
+  // progreso en vivo mientras hay un job (WebSocket, o SSE si el WS no conecta)
+  useEffect(() => {
+    if (!id || !token || !jobActivo?.job_id) return;
+
+    const onMessage = (data) => {
+      if (data.tipo === "estado") return; // estado inicial: ya lo tenemos en jobActivo
+      setProgress((prev) => ({
+        current: data.actual ?? prev.current,
+        total: data.total ?? prev.total,
+        file: data.archivo ?? prev.file,
+        ok: data.ok ?? prev.ok,
+        errores: data.errores ?? prev.errores,
+        completed: data.tipo === "fin",
+      }));
+    };
+
+    const desconectar = connectProgreso(id, token, onMessage);
+    // cleanup al desmontar, cambiar id/token o terminar el job
+    return () => desconectar();
+  }, [id, token, jobActivo?.job_id]);
+
   const handleSaveAll = async () => {
     const cambios = evaluacionesHistorial.filter(e => e.match_eval !== null);
     if (cambios.length === 0) {
@@ -231,19 +223,46 @@ const DetalleProcesoCarga = () => {
   };
 
 
+  // seguimiento del job de procesamiento (el backend lo ejecuta en segundo plano)
+  useEffect(() => {
+    if (!jobActivo?.job_id || !token) return;
+    const timer = setInterval(async () => {
+      try {
+        const job = await obtenerJob(jobActivo.job_id, token);
+        setJobActivo(job);
+        if (job.estado === "completado" || job.estado === "fallido") {
+          clearInterval(timer);
+          setJobActivo(null);
+          setProcesando(false);
+          if (job.tipo === "finalizar") {
+            await fetchData(); // refresca end_process
+          } else {
+            await fetchHistorial(id);
+          }
+          if (job.estado === "completado") {
+            alert(job.tipo === "finalizar"
+              ? `Proceso finalizado: ${job.procesados} candidatos enviados.`
+              : `CVs procesados: ${job.procesados}. No procesados: ${job.no_procesados}.`);
+          } else {
+            alert(`El procesamiento falló: ${job.detalle || "error desconocido"}`);
+          }
+        }
+      } catch (error) {
+        console.error("Error consultando el job:", error?.response?.data || error);
+      }
+    }, 10000); // el avance llega en vivo; esto solo detecta el cierre del job
+    return () => clearInterval(timer);
+  }, [jobActivo?.job_id, token]);
+
   const handleProcesar = async () => {
     if (!id || !token) return;
     setProcesando(true);
-    // setProgress({ current: 0, total: 0, file: "", completed: false });
     try {
-      const data = await procesarCVsProceso(id, token);
-      alert("CVs procesados correctamente.");
-      await fetchHistorial(id);
-      //setProgress((p) => ({ ...p, completed: true }));
+      const job = await procesarCVsProceso(id, token);
+      setJobActivo(job);
     } catch (error) {
       console.error("Error al procesar CVs:", error?.response?.data || error);
       alert("Hubo un error al procesar los CVs.");
-    } finally {
       setProcesando(false);
     }
   };
@@ -287,13 +306,12 @@ const DetalleProcesoCarga = () => {
     if (!window.confirm("¿Finalizar el proceso? Esta acción es irreversible.")) return;
     setProcesando(true);
     try {
-      const respuesta = await finalizarProcesoCarga(id, token); // ← Esta función debe retornar el JSON completo
-      alert(respuesta.mensaje || "Proceso finalizado correctamente.");
-      await fetchData();
+      // el backend envía los candidatos por lotes en segundo plano; se sigue como cualquier job
+      const job = await finalizarProcesoCarga(id, token);
+      setJobActivo(job);
     } catch (error) {
       console.error("Error al finalizar proceso:", error);
-      alert("Ocurrió un error.");
-    } finally {
+      alert(error?.response?.data?.detail || "Ocurrió un error.");
       setProcesando(false);
     }
   };
@@ -406,7 +424,14 @@ const DetalleProcesoCarga = () => {
         </button>
       </div>
 
-      {/* {progress.total > 0 && (
+      {jobActivo && (
+        <p className="mb-4 text-sm text-gray-600">
+          Job #{jobActivo.job_id} ({jobActivo.estado}): {jobActivo.procesados + jobActivo.no_procesados}/{jobActivo.total} {jobActivo.tipo === "finalizar" ? "candidatos enviados" : "archivos"}
+          {jobActivo.eta_segundos != null && ` · ETA ~${Math.ceil(jobActivo.eta_segundos / 60)} min`}
+        </p>
+      )}
+
+      {jobActivo && progress.total > 0 && (
         <div className="w-full mt-4">
           <div className="w-full bg-gray-200 rounded h-4">
             <div
@@ -415,14 +440,40 @@ const DetalleProcesoCarga = () => {
             />
           </div>
           <p className="mt-2 text-sm text-gray-600">
-            {progress.current}/{progress.total} archivos
-            {progress.file && ` → procesando: ${progress.file}`}
+            {progress.current}/{progress.total} {jobActivo.tipo === "finalizar" ? "candidatos" : "archivos"} ({progress.ok} ok, {progress.errores} con error)
+            {progress.file && ` → último: ${progress.file}`}
           </p>
           {progress.completed && (
             <p className="text-green-600 font-semibold mt-2">✅ Proceso completado</p>
           )}
         </div>
-      )} */}
+      )}
+
+      {estadisticas && estadisticas.total > 0 && (
+        <div className="mb-6 p-4 border rounded bg-gray-50">
+          <h3 className="text-lg font-semibold mb-2">Estadísticas</h3>
+          <p>
+            <strong>{estadisticas.total}</strong> CVs · {estadisticas.procesados} procesados · {estadisticas.no_procesados} no procesados
+          </p>
+          <p>
+            Experiencia promedio: {estadisticas.promedio_years_exper ?? "-"} años · Match total promedio: {estadisticas.promedio_match_total != null ? `${estadisticas.promedio_match_total}%` : "-"} ({estadisticas.con_match_total} evaluados por experto)
+          </p>
+          <p className="text-sm text-gray-600">
+            {Object.entries(estadisticas.por_cv_estado).map(([estado, n]) => `${estado || "sin estado"}: ${n}`).join(" · ")}
+          </p>
+          <div className="flex items-end gap-1 h-24 mt-3">
+            {estadisticas.histograma_match.map((b) => {
+              const max = Math.max(...estadisticas.histograma_match.map((x) => x.cantidad), 1);
+              return (
+                <div key={b.desde} className="flex-1 flex flex-col items-center justify-end h-full" title={`${b.desde}-${b.hasta}%: ${b.cantidad}`}>
+                  <div className="w-full bg-blue-500 rounded-t" style={{ height: `${(b.cantidad / max) * 100}%` }} />
+                  <span className="text-xs">{b.desde}</span>
+                </div>
+              );
+            })}
+          </div>
+        </div>
+      )}
 
       <div className="flex items-center space-x-4 mb-4">
         <label>
@@ -4,6 +4,8 @@ import { obtenerProcesos, activarProcesoCarga, desactivarProcesoCarga } from "..
 import { Link } from "react-router-dom";
 import { useNavigate } from "react-router-dom";
 
+const POR_PAGINA = 50;
+
 const ListadoProcesosCarga = () => {
   const { token } = useAuth();
   const navigate = useNavigate();
@@ -15,14 +17,34 @@ const ListadoProcesosCarga = () => {
   const [mostrarActivos, setMostrarActivos] = useState(true);
   const [mostrarInactivos, setMostrarInactivos] = useState(false);
 
+  const [pagina, setPagina] = useState(0);
+  const [total, setTotal] = useState(0);
+
+  // al cambiar filtros se vuelve a la primera página
+  useEffect(() => {
+    setPagina(0);
+  }, [filtros, mostrarActivos, mostrarInactivos]);
+
   useEffect(() => {
     fetchProcesos();
-  }, [filtros]);
+  }, [filtros, mostrarActivos, mostrarInactivos, pagina]);
 
   const fetchProcesos = async () => {
+    // filtros y paginación en el servidor; vacíos no se envían
+    const params = { offset: pagina * POR_PAGINA, limit: POR_PAGINA };
+    Object.entries(filtros).forEach(([k, v]) => {
+      if (v) params[k] = v;
+    });
+    if (mostrarActivos !== mostrarInactivos) params.state = mostrarActivos;
+    if (!mostrarActivos && !mostrarInactivos) {
+      setProcesos([]);
+      setTotal(0);
+      return;
+    }
     try {
-      const data = await obtenerProcesos(token, filtros);
-      setProcesos(data);
+      const data = await obtenerProcesos(token, params);
+      setProcesos(data.items);
+      setTotal(data.total ?? 0);
     } catch (error) {
       console.error("Error al obtener procesos:", error);
     }
@@ -50,10 +72,8 @@ const ListadoProcesosCarga = () => {
   }
   };
 
-  const procesosFiltrados = procesos.filter(p =>
-    (mostrarActivos && p.state === true) ||
-    (mostrarInactivos && p.state === false)
-  );
+  const procesosFiltrados = procesos;
+  const totalPaginas = Math.max(1, Math.ceil(total / POR_PAGINA));
 
  return (
     <div className="p-6">
@@ -182,6 +202,28 @@ const ListadoProcesosCarga = () => {
         </tbody>
       </table>
       )}
+
+      {total > POR_PAGINA && (
+        <div className="flex items-center gap-4 mt-4">
+          <button
+            onClick={() => setPagina((p) => p - 1)}
+            disabled={pagina === 0}
+            className="px-3 py-1 border rounded disabled:opacity-50"
+          >
+            Anterior
+          </button>
+          <span>
+            Página {pagina + 1} de {totalPaginas} ({total} procesos)
+          </span>
+          <button
+            onClick={() => setPagina((p) => p + 1)}
+            disabled={pagina + 1 >= totalPaginas}
+            className="px-3 py-1 border rounded disabled:opacity-50"
+          >
+            Siguiente
+          </button>
+        </div>
+      )}
     </div>
   );
 };
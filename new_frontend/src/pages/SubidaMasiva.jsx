@@ -8,6 +8,8 @@ const SubidaMasiva = () => {
   const [puestos, setPuestos] = useState([]);
   const [puestoId, setPuestoId] = useState("");
   const [resultados, setResultados] = useState([]);
+  const [fallidos, setFallidos] = useState([]);
+  const [resumen, setResumen] = useState(null);
   const [cargando, setCargando] = useState(false);
 
   useEffect(() => {
@@ -28,16 +30,44 @@ const SubidaMasiva = () => {
     archivos.forEach((file) => formData.append("archivos", file));
     formData.append("puesto_id", puestoId);
 
+    setResultados([]);
+    setFallidos([]);
+    setResumen(null);
+
     try {
       setCargando(true);
-      const res = await API.post("/evaluar-cvs", formData, {
-        headers: {
-          Authorization: `Bearer ${token}`,
-          "Content-Type": "multipart/form-data"
-        }
+      // la respuesta es NDJSON: una línea por CV a medida que termina (axios no permite leerla por partes)
+      const res = await fetch(`${API.defaults.baseURL}/evaluar-cvs`, {
+        method: "POST",
+        headers: { Authorization: `Bearer ${token}` },
+        body: formData,
       });
+      if (!res.ok) {
+        const error = await res.json().catch(() => ({}));
+        throw new Error(error.detail || `HTTP ${res.status}`);
+      }
 
-      setResultados(res.data);
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let pendiente = "";
+      for (;;) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        pendiente += decoder.decode(value, { stream: true });
+        const lineas = pendiente.split("\n");
+        pendiente = lineas.pop();
+        for (const linea of lineas) {
+          if (!linea.trim()) continue;
+          const evento = JSON.parse(linea);
+          if (evento.tipo === "resultado" && evento.ok) {
+            setResultados((prev) => [...prev, evento.evaluacion]);
+          } else if (evento.tipo === "resultado") {
+            setFallidos((prev) => [...prev, evento]);
+          } else if (evento.tipo === "fin") {
+            setResumen(evento);
+          }
+        }
+      }
     } catch (err) {
       console.error("Error en la carga masiva", err);
       alert("No se pudo procesar los archivos");
@@ -86,7 +116,25 @@ const SubidaMasiva = () => {
             <circle className="opacity-25" cx="12" cy="12" r="10" stroke="currentColor" strokeWidth="4"></circle>
             <path className="opacity-75" fill="currentColor" d="M4 12a8 8 0 018-8v8H4z"></path>
           </svg>
-          <span>Evaluando CVs...</span>
+          <span>
+            Evaluando CVs... {resultados.length + fallidos.length} de {archivos.length}
+          </span>
+        </div>
+      )}
+
+      {resumen && (
+        <p className="mb-4">
+          <strong>{resumen.ok}</strong> de {resumen.total} CVs evaluados
+          {resumen.fallidos > 0 && `, ${resumen.fallidos} con error`}
+        </p>
+      )}
+
+      {fallidos.length > 0 && (
+        <div className="bg-red-50 p-4 rounded mb-4">
+          <h3 className="font-semibold mb-2">No se pudieron evaluar</h3>
+          {fallidos.map((f, idx) => (
+            <p key={idx}>{f.archivo}: {f.error}</p>
+          ))}
         </div>
       )}
 
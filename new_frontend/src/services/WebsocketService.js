@@ -1,43 +1,87 @@
 // src/services/WebsocketService.js
-// Usa VITE_WS_URL si existe; si no, fallback a ws://localhost:8000
-// const WS_BASE = import.meta.env.VITE_WS_URL || (location.protocol === "https:" ? "wss://localhost:8000" : "ws://localhost:8000");
-
-// export function connectWS(processId, token, onMessage, onOpen, onClose) {
-//   // token debe ser solo el access token (no "Bearer " repetido)
-//   const bearer = token.startsWith("Bearer ") ? token : `Bearer ${token}`;
-//   const url = `${WS_BASE}/procesos/ws/${processId}?token=${encodeURIComponent(bearer)}`;
-
-//   let ws;
-//   try {
-//     ws = new WebSocket(url);
-//   } catch (err) {
-//     console.error("WS: fallo creación WebSocket (URL):", url, err);
-//     return null;
-//   }
-
-//   ws.onopen = (ev) => {
-//     console.log("WS conectado a:", url);
-//     onOpen && onOpen(ev);
-//   };
-
-//   ws.onmessage = (ev) => {
-//     try {
-//       const data = JSON.parse(ev.data);
-//       onMessage && onMessage(data);
-//     } catch (err) {
-//       console.error("WS: error parseando mensaje:", ev.data, err);
-//     }
-//   };
-
-//   ws.onclose = (ev) => {
-//     console.log("WS cerrado:", ev.code, ev.reason);
-//     onClose && onClose(ev);
-//   };
-
-//   ws.onerror = (err) => {
-//     // no prints masivas; mostrar resumen
-//     console.error("WS error (ver consola de red si es problema de handshake):", err);
-//   };
-
-//   return ws;
-// }
+// Progreso en tiempo real de un proceso: WebSocket y, si no se puede abrir, SSE (EventSource).
+// Usa VITE_WS_URL si existe; si no, se deriva de VITE_API_URL (http -> ws)
+const API_BASE = import.meta.env.VITE_API_URL || "http://localhost:8000";
+const WS_BASE = import.meta.env.VITE_WS_URL || API_BASE.replace(/^http/, "ws");
+
+function bearerDe(token) {
+  // token debe ser solo el access token (no "Bearer " repetido)
+  return token.startsWith("Bearer ") ? token : `Bearer ${token}`;
+}
+
+export function connectWS(processId, token, onMessage, onOpen, onClose) {
+  const url = `${WS_BASE}/procesos/ws/${processId}?token=${encodeURIComponent(bearerDe(token))}`;
+
+  let ws;
+  try {
+    ws = new WebSocket(url);
+  } catch (err) {
+    console.error("WS: fallo creación WebSocket (URL):", url, err);
+    return null;
+  }
+
+  ws.onopen = (ev) => {
+    onOpen && onOpen(ev);
+  };
+
+  ws.onmessage = (ev) => {
+    try {
+      const data = JSON.parse(ev.data);
+      if (data.tipo !== "ping") onMessage && onMessage(data);
+    } catch (err) {
+      console.error("WS: error parseando mensaje:", ev.data, err);
+    }
+  };
+
+  ws.onclose = (ev) => {
+    onClose && onClose(ev);
+  };
+
+  ws.onerror = (err) => {
+    // no prints masivas; mostrar resumen
+    console.error("WS error (ver consola de red si es problema de handshake):", err);
+  };
+
+  return ws;
+}
+
+export function connectSSE(processId, token, onMessage) {
+  const url = `${API_BASE}/procesos/sse/${processId}?token=${encodeURIComponent(bearerDe(token))}`;
+  const es = new EventSource(url);
+  es.onmessage = (ev) => {
+    try {
+      onMessage && onMessage(JSON.parse(ev.data));
+    } catch (err) {
+      console.error("SSE: error parseando mensaje:", ev.data, err);
+    }
+  };
+  // EventSource reconecta solo; no hace falta manejar onerror
+  return es;
+}
+
+// Conecta por WebSocket; si el socket se cierra sin haber abierto (proxy sin soporte
+// de WS, etc.) cae a SSE. Devuelve una función para desconectar.
+export function connectProgreso(processId, token, onMessage) {
+  let abierto = false;
+  let cerrado = false;
+  let sse = null;
+
+  const ws = connectWS(
+    processId,
+    token,
+    onMessage,
+    () => { abierto = true; },
+    (ev) => {
+      if (!abierto && !cerrado && ev.code !== 4401) {
+        sse = connectSSE(processId, token, onMessage);
+      }
+    }
+  );
+  if (!ws) sse = connectSSE(processId, token, onMessage);
+
+  return () => {
+    cerrado = true;
+    if (ws) ws.close();
+    if (sse) sse.close();
+  };
+}
@@ -55,6 +55,13 @@ export async function obtenerDetalleProceso(id, token) {
   return res.data;
 }
 
+export async function obtenerEstadisticasProceso(id, token) {
+  const res = await API.get(`/procesos/${id}/estadisticas`, {
+    headers: { Authorization: `Bearer ${token}` },
+  });
+  return res.data;
+}
+
 export async function procesarCVsProceso(id, token) {
   const res = await API.post(`/procesos/${id}/procesar-cvs`, null, {
     headers: { Authorization: `Bearer ${token}` },
@@ -62,6 +69,13 @@ export async function procesarCVsProceso(id, token) {
   return res.data;
 }
 
+export async function obtenerJob(jobId, token) {
+  const res = await API.get(`/procesos/jobs/${jobId}`, {
+    headers: { Authorization: `Bearer ${token}` },
+  });
+  return res.data;
+}
+
 export async function finalizarProcesoCarga(id, token) {
   const res = await API.post(`/procesos/${id}/finalizar`, null, {
     headers: { Authorization: `Bearer ${token}` },